@@ -7,6 +7,9 @@ import json
 import time
 from typing import Dict, Any, Optional
 
+# Worker任务的终止状态
+FINISHED_STATUSES = ('completed', 'failed', 'cancelled', 'expired')
+
 class DistributedWorkerClient:
     """分布式Worker客户端 - 供OpenClaw Agent使用"""
     
@@ -77,17 +80,20 @@ class DistributedWorkerClient:
             
             task_id = response.json()['id']
             
-            # 轮询结果
+            # 长轮询结果：Worker在任务完成时立即返回，最多等待wait秒
             start_time = time.time()
             while time.time() - start_time < timeout:
-                time.sleep(1)
+                wait = max(0.1, min(30, timeout - (time.time() - start_time)))
+                poll_start = time.time()
                 
                 result_response = requests.get(
                     f"{worker_url}/tasks/{task_id}",
-                    timeout=10
+                    params={"wait": wait},
+                    timeout=wait + 10
                 )
                 
                 if result_response.status_code != 200:
+                    time.sleep(1)
                     continue
                 
                 result = result_response.json()
@@ -100,12 +106,17 @@ class DistributedWorkerClient:
                         "result": result['result'],
                         "execution_time": time.time() - start_time
                     }
-                elif result['status'] == 'failed':
+                elif result['status'] in FINISHED_STATUSES:
+                    # failed / cancelled / expired
                     return {
                         "success": False,
                         "task_id": task_id,
-                        "error": result.get('error', 'Unknown error')
+                        "status": result['status'],
+                        "error": result.get('error') or f"Task {result['status']}"
                     }
+                elif time.time() - poll_start < wait / 2:
+                    # 旧版Worker不支持wait参数，会立即返回，退回到定时轮询
+                    time.sleep(1)
             
             return {"error": f"Timeout after {timeout}s"}
             
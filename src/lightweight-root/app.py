@@ -2,18 +2,34 @@
 """
 Enhanced Flask app with code execution capabilities
 """
-from flask import Flask, jsonify, request
+from flask import Flask, Response, g, jsonify, request, send_file
 import os
+import json
 import sys
 import time
 import threading
-import queue
-import uuid
-import subprocess
-import tempfile
+import heapq
+from contextlib import ExitStack
 from datetime import datetime
 from monitoring import Monitor, Logger
+from execution_pool import ExecutionPool, TaskQueue, load_pool_config, load_client_weights
+from runner_pool import python_pool_from_env, node_pool_from_env
+from executors import CodeExecutor, CancelToken, TaskCancelled
+from output_capture import OutputCapture, STREAMS, load_output_config
+from blob_store import CHUNK_SIZE, BlobError, blob_store_from_env
+from python_envs import normalize_requirements, python_env_cache_from_env
+from resource_usage import UsageStats
+from result_cache import is_cacheable_result, result_cache_from_env
+from task_store import FINISHED_STATUSES, task_store_from_env
+from shared_state import shared_state_from_env
 from version import VERSION
+from worker_api import (
+    MAX_WAIT_SECONDS, DEFAULT_TIMEOUT, RequestError, service_info, health_info, client_identity,
+    prepare_task, can_follow, batch_specs, batch_ids, submission_response,
+    batch_response, status_response, list_query, output_query, task_counters,
+    blob_upload, blob_info, blob_path, run_builtin_task, sleep_timeout, task_time_left,
+    WorkerMetrics, task_label, language_label
+)
 
 print("=" * 50, file=sys.stderr)
 print(f"Starting Lightweight AI Worker v{VERSION} - Code Execution", file=sys.stderr)
@@ -22,311 +38,636 @@ print("=" * 50, file=sys.stderr)
 app = Flask(__name__)
 
 # Initialize monitoring and logging
-monitor = Monitor()
 logger = Logger('worker')
+monitor = Monitor(logger=logger)
 
 # Task queue and storage
-task_queue = queue.Queue()
-tasks = {}
+task_outputs = {}  # task_id -> OutputCapture while the task is queued or running
+spilled_outputs = {}  # task_id -> closed OutputCapture whose full output lives on disk
 task_lock = threading.Lock()
+output_config = load_output_config()
+result_cache = result_cache_from_env()
+blob_store = blob_store_from_env(logger)
+python_envs = python_env_cache_from_env(logger)
+task_waiters = {}  # task_id -> Event set when the task finishes, created by long-poll requests
+task_cancels = {}  # task_id -> CancelToken while the task is running
+task_deadlines = []  # heap of (deadline, task_id) for queued tasks that have a deadline
+coalescing = {}  # fingerprint -> id of the task whose run identical new tasks follow
+SHARED_POLL_INTERVAL = 0.05
+
+def release_evicted(task_ids):
+    """Delete spill files of tasks that were evicted from memory"""
+    with task_lock:
+        outputs = [spilled_outputs.pop(task_id, None) for task_id in task_ids]
+    for output in outputs:
+        if output is not None:
+            output.discard()
+
+# With SHARED_STATE_DB set, records and queue live in SQLite so that several
+# worker processes (e.g. gunicorn workers) serve the same tasks
+shared_state = shared_state_from_env(on_evict=release_evicted, logger=logger)
+if shared_state is not None:
+    tasks, task_queue = shared_state
+else:
+    tasks = task_store_from_env(on_evict=release_evicted, logger=logger)
+    task_queue = TaskQueue(load_client_weights())
 
 # Worker stats
 stats = {
     'started_at': datetime.utcnow().isoformat(),
-    'tasks_completed': 0,
-    'tasks_failed': 0,
-    'tasks_pending': 0
+    'tasks_coalesced': 0
 }
+task_usage = UsageStats()  # CPU time, peak RSS and I/O of executed code
 
-def execute_code(language, code, input_data=None):
-    """Execute code in specified language"""
-    try:
-        if language == 'python':
-            return execute_python(code, input_data)
-        elif language == 'javascript' or language == 'node':
-            return execute_javascript(code, input_data)
-        elif language == 'bash' or language == 'shell':
-            return execute_bash(code, input_data)
-        else:
-            return {'error': f'Unsupported language: {language}'}
-    except Exception as e:
-        return {'error': str(e)}
-
-def execute_python(code, input_data=None):
-    """Execute Python code"""
-    with tempfile.NamedTemporaryFile(mode='w', suffix='.py', delete=False) as f:
-        f.write(code)
-        temp_file = f.name
+def run_task(task_id):
+    """Execute a single queued task and record its result"""
+    with task_lock:
+        task = tasks.get(task_id)
+        if task is None or task['status'] != 'pending':
+            return  # cancelled or expired while queued
+        timeout = task_time_left(task)
+        if timeout <= 0:
+            finish_task(task_id, 'expired', error='Deadline passed before the task started')
+            return
+        started_at = datetime.utcnow()
+        if tasks.set_status(task_id, 'processing', started_at=started_at.isoformat()) is None:
+            return  # finished by another worker process meanwhile
+        output = task_outputs.get(task_id)
+        if output is None:  # shared state: submitted through another worker process
+            output = task_outputs[task_id] = OutputCapture(task_id, **output_config)
+        cancel = task_cancels[task_id] = CancelToken()
+    worker_metrics.task_started(task, started_at)
+    
+    task_type = task.get('type', 'default')
+    payload = task.get('payload', {})
+    started = time.monotonic()
+    status = 'failed'
     
     try:
-        env = os.environ.copy()
-        if input_data:
-            env['INPUT_DATA'] = str(input_data)
+        logger.info(f"Processing task {task_id}: {task_type}")
         
-        print(f"[EXEC DEBUG] Starting subprocess to execute Python code", flush=True)
-        start_time = time.time()
+        # Execute task based on type
+        result = execute_task(task_type, payload, output, timeout, cancel, task.get('deadline'))
+        status = 'completed'
+        task_usage.add(task_label(task), language_label(task), result)
         
-        result = subprocess.run(
-            ['python3', temp_file],
-            capture_output=True,
-            text=True,
-            timeout=30,
-            env=env
-        )
+        with task_lock:
+            finish_task(task_id, 'completed', result=result)
         
-        elapsed = time.time() - start_time
-        print(f"[EXEC DEBUG] Subprocess completed in {elapsed:.2f}s, returncode={result.returncode}", flush=True)
+        if task.get('cache') and result_cache is not None and is_cacheable_result(result):
+            result_cache.put(task['fingerprint'], result)
         
-        return {
-            'stdout': result.stdout,
-            'stderr': result.stderr,
-            'returncode': result.returncode,
-            'success': result.returncode == 0
-        }
-    finally:
-        os.unlink(temp_file)
-
-def execute_javascript(code, input_data=None):
-    """Execute JavaScript code"""
-    with tempfile.NamedTemporaryFile(mode='w', suffix='.js', delete=False) as f:
-        if input_data:
-            f.write(f"const INPUT_DATA = {input_data};\n")
-        f.write(code)
-        temp_file = f.name
+        logger.info(f"Task {task_id} completed")
     
-    try:
-        result = subprocess.run(
-            ['node', temp_file],
-            capture_output=True,
-            text=True,
-            timeout=30
-        )
+    except TaskCancelled:
+        status = 'cancelled'
+        logger.info(f"Task {task_id} cancelled")
+        with task_lock:
+            partial = output.snapshot() if output is not None else None
+            finish_task(task_id, 'cancelled', error='Task cancelled', result=partial)
         
-        return {
-            'stdout': result.stdout,
-            'stderr': result.stderr,
-            'returncode': result.returncode,
-            'success': result.returncode == 0
-        }
-    except FileNotFoundError:
-        return {'error': 'Node.js not installed'}
-    finally:
-        os.unlink(temp_file)
-
-def execute_bash(code, input_data=None):
-    """Execute Bash script"""
-    with tempfile.NamedTemporaryFile(mode='w', suffix='.sh', delete=False) as f:
-        f.write('#!/bin/bash\n')
-        if input_data:
-            f.write(f'INPUT_DATA="{input_data}"\n')
-        f.write(code)
-        temp_file = f.name
+    except Exception as e:
+        logger.error(f"Task error: {e}")
+        with task_lock:
+            finish_task(task_id, 'failed', error=str(e))
     
-    try:
-        os.chmod(temp_file, 0o755)
-        result = subprocess.run(
-            ['/bin/bash', temp_file],
-            capture_output=True,
-            text=True,
-            timeout=30
-        )
-        
-        return {
-            'stdout': result.stdout,
-            'stderr': result.stderr,
-            'returncode': result.returncode,
-            'success': result.returncode == 0
-        }
     finally:
-        os.unlink(temp_file)
+        worker_metrics.task_finished(task, status, time.monotonic() - started)
 
-def task_worker():
-    """Background worker to process tasks"""
-    logger.info("Task worker started")
-    while True:
-        try:
-            task_id = task_queue.get(timeout=1)
-            with task_lock:
-                if task_id not in tasks:
-                    continue
-                tasks[task_id]['status'] = 'processing'
-                tasks[task_id]['started_at'] = datetime.utcnow().isoformat()
-            
-            task_data = tasks[task_id]
-            task_type = task_data.get('type', 'default')
-            payload = task_data.get('payload', {})
-            
-            logger.info(f"Processing task {task_id}: {task_type}")
-            
-            # Execute task based on type
-            result = execute_task(task_type, payload)
-            
-            with task_lock:
-                tasks[task_id]['status'] = 'completed'
-                tasks[task_id]['result'] = result
-                tasks[task_id]['completed_at'] = datetime.utcnow().isoformat()
-                stats['tasks_completed'] += 1
-                stats['tasks_pending'] -= 1
-            
-            logger.info(f"Task {task_id} completed")
-            
-        except queue.Empty:
-            continue
-        except Exception as e:
-            logger.error(f"Task error: {e}")
-            with task_lock:
-                if task_id in tasks:
-                    tasks[task_id]['status'] = 'failed'
-                    tasks[task_id]['error'] = str(e)
-                    stats['tasks_failed'] += 1
-                    stats['tasks_pending'] -= 1
-
-def execute_task(task_type, payload):
+def fail_task(task_id, error):
+    """Mark a task failed after an error run_task did not handle itself"""
+    with task_lock:
+        task = tasks.get(task_id)
+        if task is not None and task['status'] in ('pending', 'processing'):
+            finish_task(task_id, 'failed', error=str(error))
+
+def finish_task(task_id, status, **fields):
+    """Record a task's final state and release what was tied to it (call with task_lock held)"""
+    task_cancels.pop(task_id, None)
+    finish_output(task_id)
+    task = tasks.set_status(task_id, status, completed_at=datetime.utcnow().isoformat(), **fields)
+    wake_waiters(task_id)
+    if task is not None and task.get('fingerprint'):
+        if coalescing.get(task['fingerprint']) == task_id:
+            del coalescing[task['fingerprint']]
+        if task.get('followers'):
+            finish_followers(task, status, fields)
+
+def finish_followers(leader, status, fields):
+    """Give tasks coalesced onto a finished task its outcome (call with task_lock held).
+
+    Followers did not ask for a cancellation or expiry of the task they follow,
+    so in that case the first one still waiting is queued to run instead.
+    """
+    followers = [tasks.get(task_id) for task_id in leader['followers']]
+    waiting = [task for task in followers if task is not None and task['status'] == 'pending']
+    if status not in ('cancelled', 'expired'):
+        for task in waiting:
+            finish_task(task['id'], status, **fields)
+        return
+    if not waiting:
+        return
+    new_leader, rest = waiting[0], [task['id'] for task in waiting[1:]]
+    tasks.set_status(new_leader['id'], 'pending', coalesced_with=None, followers=rest)
+    for task_id in rest:
+        tasks.set_status(task_id, 'pending', coalesced_with=new_leader['id'])
+    coalescing[new_leader['fingerprint']] = new_leader['id']
+    if not tasks.shared:
+        task_outputs[new_leader['id']] = OutputCapture(new_leader['id'], **output_config)
+    task_queue.put(new_leader['id'], new_leader['client'], new_leader['priority'])
+
+def finish_output(task_id):
+    """Close a task's live output once its record holds the result (call with task_lock held)"""
+    output = task_outputs.pop(task_id, None)
+    if output is not None:
+        output.close()
+        if output.spilled:
+            output.drop_memory()
+            spilled_outputs[task_id] = output
+
+def wake_waiters(task_id):
+    """Release long-poll requests waiting on a finished task (call with task_lock held)"""
+    event = task_waiters.pop(task_id, None)
+    if event is not None:
+        event.set()
+
+def wait_for_task(task_id, timeout):
+    """Block until a task finishes or `timeout` seconds pass"""
+    with task_lock:
+        task = tasks.get(task_id)
+        if task is None or task['status'] in FINISHED_STATUSES:
+            return
+        event = task_waiters.setdefault(task_id, threading.Event())
+    if not tasks.shared:
+        event.wait(timeout)
+        return
+    # Another worker process may finish it, which does not set our event
+    deadline = time.monotonic() + timeout
+    while not event.wait(min(SHARED_POLL_INTERVAL, max(0, deadline - time.monotonic()))):
+        if time.monotonic() >= deadline or tasks.get(task_id, {}).get('status') in FINISHED_STATUSES:
+            return
+
+def queue_positions(task_ids):
+    """Positions of pending tasks in the queue, or for tasks parked until their
+    language has a free slot, among the tasks waiting for that language"""
+    positions = task_queue.positions(task_ids)
+    positions.update(pool.positions([task_id for task_id in task_ids if task_id not in positions]))
+    return positions
+
+def get_queued_task(task_id):
+    """Look up a task for the execution pool"""
+    with task_lock:
+        return tasks.get(task_id)
+
+def execute_task(task_type, payload, output=None, timeout=DEFAULT_TIMEOUT, cancel=None, deadline=None):
     """Execute different types of tasks"""
     if task_type == 'code':
         # Code execution task
         language = payload.get('language', 'python')
         code = payload.get('code', '')
         input_data = payload.get('input')
+        requirements = payload.get('requirements')
+        files, artifacts = payload.get('files'), payload.get('artifacts')
         
-        return execute_code(language, code, input_data)
-    
-    elif task_type == 'compute':
-        # Simple computation task
-        operation = payload.get('operation', 'add')
-        numbers = payload.get('numbers', [1, 2, 3])
+        if not (requirements or files or artifacts):
+            return executor.execute(language, code, input_data, output, timeout, cancel)
         
-        if operation == 'add':
-            return {'result': sum(numbers)}
-        elif operation == 'multiply':
-            result = 1
-            for n in numbers:
-                result *= n
-            return {'result': result}
-        elif operation == 'factorial':
-            n = payload.get('number', 5)
-            result = 1
-            for i in range(1, n + 1):
-                result *= i
-            return {'result': result}
+        with ExitStack() as stack:
+            # Cached virtualenv with the requirements installed
+            python = None
+            if requirements:
+                lease = python_envs.acquire(normalize_requirements(requirements), cancel, deadline)
+                python = stack.enter_context(lease).python
+            
+            # Inputs from / artifacts into the blob store
+            workspace = None
+            if files or artifacts:
+                workspace = stack.enter_context(blob_store.workspace(files, artifacts))
+            
+            result = executor.execute(language, code, input_data, output, timeout, cancel,
+                                      workspace.env if workspace else None, python)
+            return workspace.finish(result) if workspace else result
     
     elif task_type == 'sleep':
         duration = payload.get('duration', 1)
-        time.sleep(duration)
+        wait = min(duration, max(timeout, 0))
+        if cancel is not None:
+            if cancel.wait(wait):
+                raise TaskCancelled()
+        else:
+            time.sleep(wait)
+        if duration > timeout:
+            raise sleep_timeout(duration, timeout)
         return {'slept': duration}
     
-    elif task_type == 'echo':
-        return {'echo': payload.get('message', 'hello')}
-    
-    return {'result': 'unknown task type'}
+    return run_builtin_task(task_type, payload, timeout)
 
-def metrics_collector():
-    """Collect metrics periodically"""
+def deadline_reaper():
+    """Drop queued tasks whose deadline passes before they start, and pass on
+    cancellations requested through other worker processes"""
     while True:
-        time.sleep(10)
-        monitor.collect_metrics()
+        time.sleep(0.5)
+        now = time.time()
+        with task_lock:
+            while task_deadlines and task_deadlines[0][0] <= now:
+                _, task_id = heapq.heappop(task_deadlines)
+                task = tasks.get(task_id)
+                if task is not None and task['status'] == 'pending':
+                    task_queue.remove(task_id)
+                    finish_task(task_id, 'expired', error='Deadline passed before the task started')
+                    logger.info(f"Task {task_id} expired in queue")
+            running = list(task_cancels)
+        if tasks.shared and running:
+            for task_id in tasks.cancel_requested(running):
+                with task_lock:
+                    cancel = task_cancels.get(task_id)
+                if cancel is not None:
+                    cancel.cancel()
+
+# Start runner pools and threads
+pool_config = load_pool_config()
+
+python_pool = python_pool_from_env(pool_config['language_limits']['python'], logger)
+if python_pool is not None:
+    python_pool.start()
+
+node_pool = node_pool_from_env(pool_config['language_limits']['javascript'], logger)
+if node_pool is not None:
+    try:
+        node_pool.start()
+    except OSError as e:
+        logger.warning(f"Node.js pool disabled: {e}")
+        node_pool = None
+
+executor = CodeExecutor(python_pool, node_pool, logger=logger)
+
+tasks.start()
 
-# Start threads
-worker_thread = threading.Thread(target=task_worker, daemon=True)
-worker_thread.start()
+# Latency histograms and queue gauges for GET /metrics/prometheus; created before
+# the pool starts, which may pick up tasks already queued in the shared state
+worker_metrics = WorkerMetrics(tasks, task_queue, lambda: pool.get_stats()['busy_workers'])
 
-metrics_thread = threading.Thread(target=metrics_collector, daemon=True)
-metrics_thread.start()
+pool = ExecutionPool(
+    task_queue,
+    run_task,
+    get_queued_task,
+    logger=logger,
+    on_error=fail_task,
+    **pool_config
+)
+pool.start()
+
+monitor.start()
+
+reaper_thread = threading.Thread(target=deadline_reaper, daemon=True)
+reaper_thread.start()
 
 # Routes
+@app.before_request
+def start_timer():
+    g.request_started = time.perf_counter()
+
+@app.after_request
+def record_latency(response):
+    if 'request_started' in g:
+        rule = request.url_rule.rule if request.url_rule is not None else None
+        worker_metrics.request_handled(request.method, rule, response.status_code,
+                                       time.perf_counter() - g.request_started)
+    return response
+
 @app.route('/')
 def root():
-    return jsonify({
-        'service': 'lightweight-ai-worker',
-        'status': 'running',
-        'version': VERSION,
-        'features': ['task-scheduling', 'distributed-computing', 'code-execution'],
-        'supported_languages': ['python', 'javascript', 'bash'],
-        'endpoints': ['/', '/health', '/ping', '/tasks', '/tasks/<id>', '/stats', '/metrics', '/logs']
-    })
+    return jsonify(service_info('threaded'))
 
 @app.route('/health')
 def health():
-    return jsonify({
-        'status': 'healthy',
-        'service': 'lightweight-ai-worker',
-        'version': VERSION
-    })
+    return jsonify(health_info())
 
 @app.route('/ping')
 def ping():
     return jsonify({'pong': True, 'timestamp': datetime.utcnow().isoformat()})
 
+def register_tasks(new_tasks):
+    """Store tasks and queue the runnable ones under a single lock acquisition"""
+    queued = []
+    with task_lock:
+        tasks.add_many(new_tasks)
+        for task in new_tasks:
+            if task['status'] != 'completed':
+                if task.get('deadline') is not None:
+                    heapq.heappush(task_deadlines, (task['deadline'], task['id']))
+                if task.get('coalesce') and follow_identical(task):
+                    continue
+                if not tasks.shared:
+                    # With shared state the capture is made by whichever process runs the task
+                    task_outputs[task['id']] = OutputCapture(task['id'], **output_config)
+                queued.append((task['id'], task['client'], task['priority']))
+    
+    task_queue.put_many(queued)
+
+def follow_identical(task):
+    """Attach a new task to an identical queued or running one, or make it the
+    one that others follow; True if attached (call with task_lock held)"""
+    fingerprint = task['fingerprint']
+    leader_id = coalescing.get(fingerprint)
+    if leader_id is not None and can_follow(task, tasks.get(leader_id)) \
+            and tasks.add_follower(leader_id, task['id']):
+        tasks.set_status(task['id'], 'pending', coalesced_with=leader_id)
+        task['coalesced_with'] = leader_id
+        stats['tasks_coalesced'] += 1
+        return True
+    coalescing[fingerprint] = task['id']
+    return False
+
+def request_client():
+    """Fair-share identity of the caller"""
+    return client_identity(request.headers, request.remote_addr)
+
 @app.route('/tasks', methods=['POST'])
 def create_task():
     """Create a new task"""
     data = request.get_json() or {}
-    task_id = str(uuid.uuid4())
+    try:
+        task = prepare_task(data, request_client(), result_cache, blob_store, python_envs)
+    except RequestError as e:
+        return jsonify({'error': str(e)}), e.status
+    register_tasks([task])
     
-    task = {
-        'id': task_id,
-        'type': data.get('type', 'echo'),
-        'payload': data.get('payload', {}),
-        'status': 'pending',
-        'created_at': datetime.utcnow().isoformat()
-    }
+    if task.get('cached'):
+        logger.info(f"Task created from cache: {task['id']}")
+    else:
+        logger.info(f"Task created: {task['id']}")
     
-    with task_lock:
-        tasks[task_id] = task
-        stats['tasks_pending'] += 1
+    return jsonify(submission_response(task)), 201
+
+@app.route('/tasks/batch', methods=['POST'])
+def create_task_batch():
+    """Create many tasks in one request"""
+    client = request_client()
+    try:
+        specs = batch_specs(request.get_json())
+        new_tasks = [prepare_task(spec, client, result_cache, blob_store, python_envs) for spec in specs]
+    except RequestError as e:
+        return jsonify({'error': str(e)}), e.status
+    register_tasks(new_tasks)
     
-    task_queue.put(task_id)
-    logger.info(f"Task created: {task_id}")
+    cached = sum(1 for task in new_tasks if task.get('cached'))
+    logger.info(f"Batch created: {len(new_tasks)} tasks ({cached} from cache)")
     
-    return jsonify({
-        'id': task_id,
-        'status': 'pending',
-        'message': 'Task queued successfully'
-    }), 201
+    return jsonify(batch_response(new_tasks)), 201
+
+@app.route('/tasks/status', methods=['POST'])
+def get_task_batch_status():
+    """Look up many tasks by id in one request"""
+    try:
+        ids = batch_ids(request.get_json())
+    except RequestError as e:
+        return jsonify({'error': str(e)}), e.status
+    
+    records = tasks.load_many(ids)
+    positions = queue_positions([i for i, task in records.items() if task['status'] == 'pending'])
+    return jsonify(status_response(ids, records, positions))
+
+def lookup_task(task_id):
+    """A task's record and live output, falling back to the archive for evicted tasks"""
+    with task_lock:
+        task = tasks.get(task_id)
+        output = task_outputs.get(task_id)
+        if output is None and task is not None and task.get('coalesced_with'):
+            output = task_outputs.get(task['coalesced_with'])  # the run it shares
+    if task is None:
+        task = tasks.load(task_id)
+    return task, output
 
 @app.route('/tasks/<task_id>', methods=['GET'])
 def get_task(task_id):
-    """Get task status and result"""
+    """Get task status and result (?wait=<seconds> blocks until the task finishes)"""
+    wait = request.args.get('wait', 0, type=float)
+    if wait > 0:
+        wait_for_task(task_id, min(wait, MAX_WAIT_SECONDS))
+    
+    task, output = lookup_task(task_id)
+    
+    if not task:
+        return jsonify({'error': 'Task not found'}), 404
+    
+    if output is not None and task['status'] == 'processing':
+        task = dict(task, partial_output=output.snapshot())
+    elif task['status'] == 'pending':
+        queued_id = task.get('coalesced_with') or task_id
+        task = dict(task, queue_position=queue_positions([queued_id]).get(queued_id))
+    
+    return jsonify(task)
+
+@app.route('/tasks/<task_id>', methods=['DELETE'])
+def cancel_task(task_id):
+    """Cancel a queued task, or kill a running one with everything it started"""
+    cancel = None
     with task_lock:
         task = tasks.get(task_id)
+        status = task['status'] if task is not None else None
+        if status == 'pending':
+            task_queue.remove(task_id)
+            finish_task(task_id, 'cancelled', error='Task cancelled')
+        elif status == 'processing':
+            cancel = task_cancels.get(task_id)
+            if cancel is None:
+                # Running in another worker process, whose reaper polls for this
+                tasks.set_status(task_id, 'processing', cancel_requested=True)
+    
+    if task is None:
+        task = tasks.load(task_id)
+        if not task:
+            return jsonify({'error': 'Task not found'}), 404
+        status = task['status']
+    
+    if status == 'pending':
+        logger.info(f"Task {task_id} cancelled in queue")
+        return jsonify({'id': task_id, 'status': 'cancelled'})
+    if status == 'processing':
+        if cancel is not None:
+            cancel.cancel()
+        logger.info(f"Task {task_id} cancellation requested")
+        return jsonify({'id': task_id, 'status': 'cancelling'}), 202
+    return jsonify({'error': f'Task already {status}', 'status': status}), 409
+
+def sse_event(event, data):
+    """Format one Server-Sent Event"""
+    lines = ''.join(f"data: {line}\n" for line in data.split('\n'))
+    return f"event: {event}\n{lines}\n"
+
+@app.route('/tasks/<task_id>/stream', methods=['GET'])
+def stream_task(task_id):
+    """Stream task output as it is produced (SSE, or raw text with ?format=text)"""
+    task, output = lookup_task(task_id)
     
     if not task:
         return jsonify({'error': 'Task not found'}), 404
     
-    return jsonify(task)
+    raw = request.args.get('format') == 'text'
+    
+    def generate():
+        if output is not None:
+            for item in output.follow():
+                if item is None:
+                    if not raw:
+                        yield ": keepalive\n\n"
+                    continue
+                stream, text = item
+                yield text if raw else sse_event(stream, text)
+        else:
+            done = task
+            while done['status'] not in FINISHED_STATUSES:
+                # Running in another worker process: replay the result when it finishes
+                if not raw:
+                    yield ": keepalive\n\n"
+                wait_for_task(task_id, 15)
+                done = tasks.load(task_id) or done
+            # Already finished: replay the stored result
+            result = done.get('result') or {}
+            for stream in STREAMS:
+                if result.get(stream):
+                    yield result[stream] if raw else sse_event(stream, result[stream])
+        
+        if not raw:
+            final = lookup_task(task_id)[0] or task
+            yield sse_event('end', json.dumps({
+                'status': final['status'],
+                'returncode': (final.get('result') or {}).get('returncode'),
+                'error': final.get('error')
+            }))
+    
+    return Response(
+        generate(),
+        mimetype='text/plain' if raw else 'text/event-stream',
+        headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'}
+    )
+
+@app.route('/tasks/<task_id>/output', methods=['GET'])
+def get_task_output(task_id):
+    """Ranged read of a task's full stdout/stderr"""
+    try:
+        stream, offset, length = output_query(request.args)
+    except RequestError as e:
+        return jsonify({'error': str(e)}), e.status
+    
+    task, output = lookup_task(task_id)
+    if output is None:
+        with task_lock:
+            output = spilled_outputs.get(task_id)
+    
+    if not task:
+        return jsonify({'error': 'Task not found'}), 404
+    
+    if output is not None:
+        total = output.size(stream)
+        data = output.read(stream, offset, length)
+    else:
+        full = ((task.get('result') or {}).get(stream) or '').encode()
+        total = len(full)
+        data = full[offset:offset + length]
+    
+    return Response(data, mimetype='application/octet-stream', headers={
+        'X-Output-Size': str(total),
+        'X-Output-Offset': str(offset),
+        'X-Output-Complete': str(task['status'] in FINISHED_STATUSES).lower()
+    })
+
+@app.route('/blobs/<digest>', methods=['PUT'])
+def put_blob(digest):
+    """Upload a blob under its sha256; a no-op if it is already stored"""
+    try:
+        upload = blob_upload(blob_store, digest, request.content_length)
+        if upload is None:
+            return jsonify(blob_info(blob_store, digest))
+        try:
+            for chunk in iter(lambda: request.stream.read(CHUNK_SIZE), b''):
+                upload.write(chunk)
+            upload.commit()
+        finally:
+            upload.abort()
+    except (RequestError, BlobError) as e:
+        return jsonify({'error': str(e)}), e.status
+    
+    return jsonify(blob_info(blob_store, digest, created=True)), 201
+
+@app.route('/blobs/<digest>', methods=['GET'])
+def get_blob(digest):
+    """Download a blob; supports Range and conditional requests"""
+    try:
+        path = blob_path(blob_store, digest)
+    except RequestError as e:
+        return jsonify({'error': str(e)}), e.status
+    
+    return send_file(path, mimetype='application/octet-stream', conditional=True, etag=digest,
+                     max_age=86400)
 
 @app.route('/tasks', methods=['GET'])
 def list_tasks():
-    """List all tasks"""
-    with task_lock:
-        task_list = list(tasks.values())
+    """List tasks, newest first (?status=, ?limit=, ?cursor=, ?since=)"""
+    try:
+        status, cursor, since, limit = list_query(request.args)
+    except RequestError as e:
+        return jsonify({'error': str(e)}), e.status
     
-    task_list.sort(key=lambda x: x.get('created_at', ''), reverse=True)
+    task_list, total, next_cursor = tasks.list(status, cursor, since, limit)
     return jsonify({
-        'tasks': task_list[:100],
-        'total': len(task_list)
+        'tasks': task_list,
+        'total': total,
+        'next_cursor': next_cursor
     })
 
 @app.route('/stats', methods=['GET'])
 def get_stats():
     """Get worker statistics"""
-    with task_lock:
-        current_stats = stats.copy()
-        current_stats['total_tasks'] = len(tasks)
+    current_stats = task_counters(tasks.status_counts())
+    current_stats['total_tasks'] = tasks.total
+    current_stats['task_store'] = tasks.get_stats()
+    current_stats['queue'] = task_queue.get_stats()
+    
+    process_stats = stats.copy()
+    process_stats['execution_pool'] = pool.get_stats()
+    if result_cache is not None:
+        process_stats['result_cache'] = result_cache.get_stats()
+    if blob_store is not None:
+        process_stats['blob_store'] = blob_store.get_stats()
+    if python_envs is not None:
+        process_stats['python_envs'] = python_envs.get_stats()
+    process_stats.update(executor.get_stats())
+    process_stats['task_usage'] = task_usage.get_stats()
+    process_stats['monitoring'] = monitor.get_summary()
+    process_stats['logging'] = logger.get_stats()
     
-    current_stats['monitoring'] = monitor.get_summary()
+    if tasks.shared:
+        # Only the task counts, store and queue are shared; the rest describes
+        # the worker process that answered
+        current_stats['process'] = dict(process_stats, pid=os.getpid())
+    else:
+        current_stats.update(process_stats)
     return jsonify(current_stats)
 
 @app.route('/metrics', methods=['GET'])
 def get_metrics():
-    """Get detailed metrics"""
+    """Get detailed metrics (?resolution=1s|1m|1h returns downsampled history)"""
     limit = request.args.get('limit', 100, type=int)
+    try:
+        history = monitor.get_history(limit, request.args.get('resolution'))
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    
     return jsonify({
         'current': monitor.get_metrics(),
-        'history': monitor.get_history(limit),
+        'history': history,
         'summary': monitor.get_summary()
     })
 
+@app.route('/metrics/prometheus', methods=['GET'])
+def get_prometheus_metrics():
+    """Latency histograms and queue gauges in the Prometheus text format
+    (OpenMetrics if the Accept header asks for it)"""
+    body, content_type = worker_metrics.exposition(request.headers.get('Accept'))
+    return Response(body, content_type=content_type)
+
 @app.route('/logs', methods=['GET'])
 def get_logs():
     """Get application logs"""
@@ -0,0 +1,856 @@
+#!/usr/bin/env python3
+"""
+Async worker - the worker HTTP API as an asyncio (ASGI) application
+
+Same endpoints and responses as app.py, but tasks run as coroutines on one
+event loop instead of on a thread pool: cold code runs are asyncio
+subprocesses and sleeps are timers, so a single worker can hold thousands of
+in-flight tasks without a thread per task. Run with `python async_app.py`
+(uvicorn) or any ASGI server pointed at `async_app:app`.
+"""
+import asyncio
+import heapq
+import json
+import os
+import queue
+import sys
+import time
+from contextlib import ExitStack, aclosing
+from datetime import datetime
+from urllib.parse import parse_qs
+
+from monitoring import Monitor, Logger
+from execution_pool import TaskQueue, load_pool_config, load_client_weights
+from runner_pool import python_pool_from_env, node_pool_from_env
+from executors import AsyncCodeExecutor, CancelToken
+from output_capture import OutputCapture, STREAMS, load_output_config
+from blob_store import CHUNK_SIZE, BlobError, blob_store_from_env
+from python_envs import normalize_requirements, python_env_cache_from_env
+from resource_usage import UsageStats
+from result_cache import is_cacheable_result, result_cache_from_env
+from task_store import FINISHED_STATUSES, task_store_from_env
+from version import VERSION
+from worker_api import (
+    MAX_WAIT_SECONDS, DEFAULT_TIMEOUT, RequestError, service_info, health_info, client_identity,
+    prepare_task, can_follow, batch_specs, batch_ids, submission_response,
+    batch_response, status_response, list_query, output_query, task_counters,
+    blob_upload, blob_info, blob_path, byte_range, run_builtin_task, sleep_timeout, task_time_left,
+    WorkerMetrics, task_label, language_label
+)
+
+MAX_INFLIGHT = int(os.getenv('ASYNC_MAX_INFLIGHT', 4096))
+MAX_BODY_BYTES = int(os.getenv('MAX_BODY_MB', 64)) * 1024 * 1024
+
+print("=" * 50, file=sys.stderr)
+print(f"Starting Lightweight AI Worker v{VERSION} - Code Execution (asyncio)", file=sys.stderr)
+print("=" * 50, file=sys.stderr)
+
+# Initialize monitoring and logging
+logger = Logger('worker')
+monitor = Monitor(logger=logger)
+
+# Task queue and storage. Everything below is only touched from the event loop,
+# except the output captures, which pooled runs write from their I/O threads.
+task_queue = TaskQueue(load_client_weights())
+task_outputs = {}  # task_id -> OutputCapture while the task is queued or running
+spilled_outputs = {}  # task_id -> closed OutputCapture whose full output lives on disk
+output_config = load_output_config()
+result_cache = result_cache_from_env()
+blob_store = blob_store_from_env(logger)
+python_envs = python_env_cache_from_env(logger)
+task_waiters = {}  # task_id -> asyncio.Event set when the task finishes
+running_tasks = {}  # task_id -> asyncio.Task executing it
+task_deadlines = []  # heap of (deadline, task_id) for queued tasks that have a deadline
+coalescing = {}  # fingerprint -> id of the task whose run identical new tasks follow
+loop = None
+queue_ready = None  # asyncio.Event set when tasks are queued
+inflight = None  # asyncio.Semaphore bounding concurrently running tasks
+
+def release_evicted(task_ids):
+    """Delete spill files of tasks that were evicted from memory (task store thread)"""
+    if loop is not None:
+        loop.call_soon_threadsafe(discard_outputs, task_ids)
+
+def discard_outputs(task_ids):
+    for task_id in task_ids:
+        output = spilled_outputs.pop(task_id, None)
+        if output is not None:
+            output.discard()
+
+tasks = task_store_from_env(on_evict=release_evicted, logger=logger)
+
+# Latency histograms and queue gauges for GET /metrics/prometheus
+worker_metrics = WorkerMetrics(tasks, task_queue, lambda: len(running_tasks))
+
+# Worker stats
+stats = {
+    'started_at': datetime.utcnow().isoformat(),
+    'tasks_coalesced': 0
+}
+task_usage = UsageStats()  # CPU time, peak RSS and I/O of executed code
+
+async def run_task(task_id):
+    """Execute a single queued task and record its result"""
+    task = tasks.get(task_id)
+    if task is None or task['status'] != 'pending':
+        return  # cancelled or expired while queued
+    timeout = task_time_left(task)
+    if timeout <= 0:
+        finish_task(task_id, 'expired', error='Deadline passed before the task started')
+        return
+    started_at = datetime.utcnow()
+    tasks.set_status(task_id, 'processing', started_at=started_at.isoformat())
+    output = task_outputs.get(task_id)
+    worker_metrics.task_started(task, started_at)
+
+    task_type = task.get('type', 'default')
+    payload = task.get('payload', {})
+    started = time.monotonic()
+    status = 'failed'
+
+    try:
+        logger.info(f"Processing task {task_id}: {task_type}")
+
+        # Execute task based on type
+        result = await execute_task(task_type, payload, output, timeout, task.get('deadline'))
+        status = 'completed'
+        task_usage.add(task_label(task), language_label(task), result)
+
+        finish_task(task_id, 'completed', result=result)
+
+        if task.get('cache') and result_cache is not None and is_cacheable_result(result):
+            result_cache.put(task['fingerprint'], result)
+
+        logger.info(f"Task {task_id} completed")
+
+    except asyncio.CancelledError:
+        status = 'cancelled'
+        logger.info(f"Task {task_id} cancelled")
+        partial = output.snapshot() if output is not None else None
+        finish_task(task_id, 'cancelled', error='Task cancelled', result=partial)
+
+    except Exception as e:
+        logger.error(f"Task error: {e}")
+        finish_task(task_id, 'failed', error=str(e))
+
+    finally:
+        worker_metrics.task_finished(task, status, time.monotonic() - started)
+
+def finish_task(task_id, status, **fields):
+    """Record a task's final state and release what was tied to it"""
+    finish_output(task_id)
+    task = tasks.set_status(task_id, status, completed_at=datetime.utcnow().isoformat(), **fields)
+    event = task_waiters.pop(task_id, None)
+    if event is not None:
+        event.set()
+    if task is not None and task.get('fingerprint'):
+        if coalescing.get(task['fingerprint']) == task_id:
+            del coalescing[task['fingerprint']]
+        if task.get('followers'):
+            finish_followers(task, status, fields)
+
+def finish_followers(leader, status, fields):
+    """Give tasks coalesced onto a finished task its outcome.
+
+    Followers did not ask for a cancellation or expiry of the task they follow,
+    so in that case the first one still waiting is queued to run instead.
+    """
+    followers = [tasks.get(task_id) for task_id in leader['followers']]
+    waiting = [task for task in followers if task is not None and task['status'] == 'pending']
+    if status not in ('cancelled', 'expired'):
+        for task in waiting:
+            finish_task(task['id'], status, **fields)
+        return
+    if not waiting:
+        return
+    new_leader, rest = waiting[0], [task['id'] for task in waiting[1:]]
+    tasks.set_status(new_leader['id'], 'pending', coalesced_with=None, followers=rest)
+    for task_id in rest:
+        tasks.set_status(task_id, 'pending', coalesced_with=new_leader['id'])
+    coalescing[new_leader['fingerprint']] = new_leader['id']
+    task_outputs[new_leader['id']] = OutputCapture(new_leader['id'], **output_config)
+    task_queue.put(new_leader['id'], new_leader['client'], new_leader['priority'])
+    queue_ready.set()
+
+def finish_output(task_id):
+    """Close a task's live output once its record holds the result"""
+    output = task_outputs.pop(task_id, None)
+    if output is not None:
+        output.close()
+        if output.spilled:
+            output.drop_memory()
+            spilled_outputs[task_id] = output
+
+async def wait_for_task(task_id, timeout):
+    """Wait until a task finishes or `timeout` seconds pass"""
+    task = tasks.get(task_id)
+    if task is None or task['status'] in FINISHED_STATUSES:
+        return
+    event = task_waiters.setdefault(task_id, asyncio.Event())
+    try:
+        await asyncio.wait_for(event.wait(), timeout)
+    except asyncio.TimeoutError:
+        pass
+
+async def execute_task(task_type, payload, output=None, timeout=DEFAULT_TIMEOUT, deadline=None):
+    """Execute different types of tasks"""
+    if task_type == 'code':
+        # Code execution task
+        language = payload.get('language', 'python')
+        code = payload.get('code', '')
+        input_data = payload.get('input')
+        requirements = payload.get('requirements')
+        files, artifacts = payload.get('files'), payload.get('artifacts')
+
+        if not (requirements or files or artifacts):
+            return await executor.execute(language, code, input_data, output, timeout)
+
+        with ExitStack() as stack:
+            # Cached virtualenv with the requirements installed
+            python = None
+            if requirements:
+                lease = await acquire_python_env(normalize_requirements(requirements), deadline)
+                python = stack.enter_context(lease).python
+
+            # Inputs from / artifacts into the blob store
+            workspace = None
+            if files or artifacts:
+                workspace = stack.enter_context(blob_store.workspace(files, artifacts))
+
+            result = await executor.execute(language, code, input_data, output, timeout,
+                                            workspace.env if workspace else None, python)
+            if workspace is not None:
+                result = await asyncio.to_thread(workspace.finish, result)
+            return result
+
+    elif task_type == 'sleep':
+        duration = payload.get('duration', 1)
+        await asyncio.sleep(min(duration, max(timeout, 0)))
+        if duration > timeout:
+            raise sleep_timeout(duration, timeout)
+        return {'slept': duration}
+
+    elif task_type == 'compute':
+        # CPU-bound: keep it off the event loop
+        return await asyncio.to_thread(run_builtin_task, task_type, payload, timeout)
+
+    return run_builtin_task(task_type, payload, timeout)
+
+async def acquire_python_env(requirements, deadline=None):
+    """Lease a cached environment, building it on a thread if needed"""
+    cancel = CancelToken()
+    future = loop.run_in_executor(None, python_envs.acquire, requirements, cancel, deadline)
+    try:
+        return await asyncio.shield(future)
+    except asyncio.CancelledError:
+        cancel.cancel()  # stops a running pip install
+        try:
+            (await future).release()
+        except Exception:
+            pass
+        raise
+
+async def dispatcher():
+    """Start queued tasks as coroutines, at most MAX_INFLIGHT at a time"""
+    while True:
+        await inflight.acquire()
+        while True:
+            try:
+                task_id = task_queue.get(timeout=0)
+                break
+            except queue.Empty:
+                queue_ready.clear()
+                await queue_ready.wait()
+        job = running_tasks[task_id] = asyncio.create_task(run_task(task_id))
+        job.add_done_callback(lambda _, task_id=task_id: task_done(task_id))
+
+def task_done(task_id):
+    running_tasks.pop(task_id, None)
+    inflight.release()
+
+async def deadline_reaper():
+    """Drop queued tasks whose deadline passes before they start"""
+    while True:
+        await asyncio.sleep(0.5)
+        now = time.time()
+        while task_deadlines and task_deadlines[0][0] <= now:
+            _, task_id = heapq.heappop(task_deadlines)
+            task = tasks.get(task_id)
+            if task is not None and task['status'] == 'pending':
+                task_queue.remove(task_id)
+                finish_task(task_id, 'expired', error='Deadline passed before the task started')
+                logger.info(f"Task {task_id} expired in queue")
+
+# Start runner pools
+pool_config = load_pool_config()
+
+python_pool = python_pool_from_env(pool_config['language_limits']['python'], logger)
+if python_pool is not None:
+    python_pool.start()
+
+node_pool = node_pool_from_env(pool_config['language_limits']['javascript'], logger)
+if node_pool is not None:
+    try:
+        node_pool.start()
+    except OSError as e:
+        logger.warning(f"Node.js pool disabled: {e}")
+        node_pool = None
+
+executor = AsyncCodeExecutor(python_pool, node_pool, logger=logger)
+
+tasks.start()
+
+background = []
+
+async def startup():
+    """Start the dispatcher and background loops on the server's event loop"""
+    global loop, queue_ready, inflight
+    loop = asyncio.get_running_loop()
+    queue_ready = asyncio.Event()
+    inflight = asyncio.Semaphore(MAX_INFLIGHT)
+    for job in (dispatcher, deadline_reaper):
+        background.append(asyncio.create_task(job()))
+    monitor.start()
+    logger.info(f"Async dispatcher started with up to {MAX_INFLIGHT} in-flight tasks")
+
+# HTTP plumbing
+
+class ClientDisconnected(Exception):
+    """The client went away before sending the whole request body"""
+
+
+class Request:
+    """The parts of an ASGI HTTP request the handlers need"""
+
+    def __init__(self, scope, body, receive=None):
+        self.method = scope['method']
+        self.path = scope['path']
+        self.args = {key: values[0] for key, values in parse_qs(scope['query_string'].decode()).items()}
+        self.headers = Headers(scope['headers'])
+        client = scope.get('client')
+        self.remote_addr = client[0] if client else None
+        self.body = body
+        self.receive = receive
+
+    async def stream(self):
+        """Body chunks of a `stream_body` route as they arrive"""
+        while True:
+            message = await self.receive()
+            if message['type'] == 'http.disconnect':
+                raise ClientDisconnected()
+            if message.get('body'):
+                yield message['body']
+            if not message.get('more_body'):
+                return
+
+    def get_json(self):
+        """Parsed JSON body, None if empty; raises RequestError if malformed"""
+        if not self.body:
+            return None
+        try:
+            return json.loads(self.body)
+        except ValueError:
+            raise RequestError('Request body is not valid JSON')
+
+    def float_arg(self, name, default):
+        try:
+            return float(self.args.get(name, default))
+        except ValueError:
+            return default
+
+    def int_arg(self, name, default):
+        try:
+            return int(self.args.get(name, default))
+        except ValueError:
+            return default
+
+
+class Headers(dict):
+    """Case-insensitive view of ASGI header pairs"""
+
+    def __init__(self, pairs):
+        super().__init__((name.decode('latin-1').lower(), value.decode('latin-1')) for name, value in pairs)
+
+    def get(self, name, default=None):
+        return super().get(name.lower(), default)
+
+
+class Response:
+    """A complete response body"""
+
+    def __init__(self, body, status=200, content_type='application/json', headers=None):
+        self.body = body if isinstance(body, bytes) else body.encode()
+        self.status = status
+        self.content_type = content_type
+        self.headers = headers or {}
+
+    async def send(self, send):
+        headers = [(b'content-type', self.content_type.encode()),
+                   (b'content-length', str(len(self.body)).encode())]
+        headers += [(name.lower().encode(), value.encode()) for name, value in self.headers.items()]
+        await send({'type': 'http.response.start', 'status': self.status, 'headers': headers})
+        await send({'type': 'http.response.body', 'body': self.body})
+
+
+class StreamingResponse(Response):
+    """A response whose body is produced by an async generator of text"""
+
+    def __init__(self, chunks, content_type, headers=None):
+        super().__init__(b'', content_type=content_type, headers=headers)
+        self.chunks = chunks
+
+    async def send(self, send):
+        headers = [(b'content-type', self.content_type.encode())]
+        headers += [(name.lower().encode(), value.encode()) for name, value in self.headers.items()]
+        await send({'type': 'http.response.start', 'status': self.status, 'headers': headers})
+        async with aclosing(self.chunks) as chunks:
+            async for chunk in chunks:
+                await send({'type': 'http.response.body', 'body': chunk.encode(), 'more_body': True})
+        await send({'type': 'http.response.body', 'body': b''})
+
+
+class FileResponse(Response):
+    """Bytes [start, end) of a file, read off the event loop"""
+
+    def __init__(self, path, start, end, status=200, headers=None, send_body=True):
+        super().__init__(b'', status, 'application/octet-stream', headers)
+        self.path = path
+        self.start = start
+        self.end = end
+        self.send_body = send_body
+
+    async def send(self, send):
+        headers = [(b'content-type', self.content_type.encode()),
+                   (b'content-length', str(self.end - self.start).encode())]
+        headers += [(name.lower().encode(), value.encode()) for name, value in self.headers.items()]
+        await send({'type': 'http.response.start', 'status': self.status, 'headers': headers})
+        if self.send_body:
+            f = await asyncio.to_thread(open, self.path, 'rb')
+            try:
+                f.seek(self.start)
+                remaining = self.end - self.start
+                while remaining > 0:
+                    chunk = await asyncio.to_thread(f.read, min(CHUNK_SIZE, remaining))
+                    if not chunk:
+                        break
+                    remaining -= len(chunk)
+                    await send({'type': 'http.response.body', 'body': chunk, 'more_body': True})
+            finally:
+                f.close()
+        await send({'type': 'http.response.body', 'body': b''})
+
+
+def jsonify(data, status=200):
+    return Response(json.dumps(data, default=str), status)
+
+
+routes = []  # (method, path segments, handler); '<>' matches one segment
+
+def route(path, methods=('GET',), stream_body=False):
+    """Register a handler; `<name>` path segments are passed as arguments.
+
+    With `stream_body` the handler reads the body itself via Request.stream().
+    """
+    segments = tuple('<>' if part.startswith('<') else part for part in path.strip('/').split('/'))
+    def register(handler):
+        handler.stream_body = stream_body
+        handler.path = path  # route label of the latency histogram
+        for method in methods:
+            routes.append((method, segments, handler))
+        return handler
+    return register
+
+def resolve(method, path):
+    """(handler, path arguments) for a request, or (None, status)"""
+    parts = tuple(path.strip('/').split('/'))
+    allowed = False
+    for route_method, segments, handler in routes:
+        if len(segments) != len(parts):
+            continue
+        if any(s != '<>' and s != p for s, p in zip(segments, parts)):
+            continue
+        if route_method == method:
+            return handler, [p for s, p in zip(segments, parts) if s == '<>']
+        allowed = True
+    return None, 405 if allowed else 404
+
+async def read_body(receive):
+    body = bytearray()
+    while True:
+        message = await receive()
+        if message['type'] == 'http.disconnect':
+            return None
+        body += message.get('body', b'')
+        if len(body) > MAX_BODY_BYTES:
+            raise RequestError('Request body too large', 413)
+        if not message.get('more_body'):
+            return bytes(body)
+
+async def app(scope, receive, send):
+    """ASGI entry point"""
+    if scope['type'] == 'lifespan':
+        while True:
+            message = await receive()
+            if message['type'] == 'lifespan.startup':
+                await startup()
+                await send({'type': 'lifespan.startup.complete'})
+            elif message['type'] == 'lifespan.shutdown':
+                for job in background:
+                    job.cancel()
+                await send({'type': 'lifespan.shutdown.complete'})
+                return
+    if scope['type'] != 'http':
+        return
+
+    started = time.perf_counter()
+    handler, args = resolve(scope['method'], scope['path'])
+    try:
+        if handler is None:
+            response = jsonify({'error': 'Not found' if args == 404 else 'Method not allowed'}, args)
+        elif handler.stream_body:
+            response = await handler(Request(scope, b'', receive), *args)
+        else:
+            body = await read_body(receive)
+            if body is None:
+                return
+            response = await handler(Request(scope, body), *args)
+    except ClientDisconnected:
+        return
+    except RequestError as e:
+        response = jsonify({'error': str(e)}, e.status)
+    except Exception as e:
+        logger.error(f"Request error: {e}")
+        response = jsonify({'error': 'Internal server error'}, 500)
+    worker_metrics.request_handled(scope['method'], handler.path if handler else None, response.status,
+                                   time.perf_counter() - started)
+    await response.send(send)
+
+# Routes
+@route('/')
+async def root(request):
+    return jsonify(service_info('asyncio'))
+
+@route('/health')
+async def health(request):
+    return jsonify(health_info())
+
+@route('/ping')
+async def ping(request):
+    return jsonify({'pong': True, 'timestamp': datetime.utcnow().isoformat()})
+
+def register_tasks(new_tasks):
+    """Store tasks and queue the runnable ones"""
+    queued = []
+    tasks.add_many(new_tasks)
+    for task in new_tasks:
+        if task['status'] != 'completed':
+            if task.get('deadline') is not None:
+                heapq.heappush(task_deadlines, (task['deadline'], task['id']))
+            if task.get('coalesce') and follow_identical(task):
+                continue
+            task_outputs[task['id']] = OutputCapture(task['id'], **output_config)
+            queued.append((task['id'], task['client'], task['priority']))
+
+    task_queue.put_many(queued)
+    if queued:
+        queue_ready.set()
+
+def follow_identical(task):
+    """Attach a new task to an identical queued or running one, or make it the
+    one that others follow; True if attached"""
+    fingerprint = task['fingerprint']
+    leader_id = coalescing.get(fingerprint)
+    if leader_id is not None and can_follow(task, tasks.get(leader_id)) \
+            and tasks.add_follower(leader_id, task['id']):
+        tasks.set_status(task['id'], 'pending', coalesced_with=leader_id)
+        stats['tasks_coalesced'] += 1
+        return True
+    coalescing[fingerprint] = task['id']
+    return False
+
+def request_client(request):
+    """Fair-share identity of the caller"""
+    return client_identity(request.headers, request.remote_addr)
+
+@route('/tasks', methods=['POST'])
+async def create_task(request):
+    """Create a new task"""
+    data = request.get_json() or {}
+    task = prepare_task(data, request_client(request), result_cache, blob_store, python_envs)
+    register_tasks([task])
+
+    if task.get('cached'):
+        logger.info(f"Task created from cache: {task['id']}")
+    else:
+        logger.info(f"Task created: {task['id']}")
+
+    return jsonify(submission_response(task), 201)
+
+@route('/tasks/batch', methods=['POST'])
+async def create_task_batch(request):
+    """Create many tasks in one request"""
+    client = request_client(request)
+    specs = batch_specs(request.get_json())
+    new_tasks = [prepare_task(spec, client, result_cache, blob_store, python_envs) for spec in specs]
+    register_tasks(new_tasks)
+
+    cached = sum(1 for task in new_tasks if task.get('cached'))
+    logger.info(f"Batch created: {len(new_tasks)} tasks ({cached} from cache)")
+
+    return jsonify(batch_response(new_tasks), 201)
+
+@route('/tasks/status', methods=['POST'])
+async def get_task_batch_status(request):
+    """Look up many tasks by id in one request"""
+    ids = batch_ids(request.get_json())
+
+    records = await load_many(ids)
+    positions = task_queue.positions([i for i, task in records.items() if task['status'] == 'pending'])
+    return jsonify(status_response(ids, records, positions))
+
+async def load_many(task_ids):
+    """Records from memory, reading the archive off the event loop only when needed"""
+    if all(task_id in tasks for task_id in task_ids):
+        return tasks.load_many(task_ids)
+    return await asyncio.to_thread(tasks.load_many, task_ids)
+
+async def lookup_task(task_id):
+    """A task's record and live output, falling back to the archive for evicted tasks"""
+    task = tasks.get(task_id)
+    output = task_outputs.get(task_id)
+    if output is None and task is not None and task.get('coalesced_with'):
+        output = task_outputs.get(task['coalesced_with'])  # the run it shares
+    if task is None:
+        task = await asyncio.to_thread(tasks.load, task_id)
+    return task, output
+
+@route('/tasks/<task_id>')
+async def get_task(request, task_id):
+    """Get task status and result (?wait=<seconds> waits until the task finishes)"""
+    wait = request.float_arg('wait', 0)
+    if wait > 0:
+        await wait_for_task(task_id, min(wait, MAX_WAIT_SECONDS))
+
+    task, output = await lookup_task(task_id)
+
+    if not task:
+        return jsonify({'error': 'Task not found'}, 404)
+
+    if output is not None and task['status'] == 'processing':
+        task = dict(task, partial_output=output.snapshot())
+    elif task['status'] == 'pending':
+        queued_id = task.get('coalesced_with') or task_id
+        task = dict(task, queue_position=task_queue.positions([queued_id]).get(queued_id))
+
+    return jsonify(task)
+
+@route('/tasks/<task_id>', methods=['DELETE'])
+async def cancel_task(request, task_id):
+    """Cancel a queued task, or kill a running one with everything it started"""
+    task, _ = await lookup_task(task_id)
+    if not task:
+        return jsonify({'error': 'Task not found'}, 404)
+    status = task['status']
+
+    if status == 'pending':
+        task_queue.remove(task_id)
+        finish_task(task_id, 'cancelled', error='Task cancelled')
+        logger.info(f"Task {task_id} cancelled in queue")
+        return jsonify({'id': task_id, 'status': 'cancelled'})
+    if status == 'processing':
+        job = running_tasks.get(task_id)
+        if job is not None:
+            job.cancel()
+        logger.info(f"Task {task_id} cancellation requested")
+        return jsonify({'id': task_id, 'status': 'cancelling'}, 202)
+    return jsonify({'error': f'Task already {status}', 'status': status}, 409)
+
+def sse_event(event, data):
+    """Format one Server-Sent Event"""
+    lines = ''.join(f"data: {line}\n" for line in data.split('\n'))
+    return f"event: {event}\n{lines}\n"
+
+@route('/tasks/<task_id>/stream')
+async def stream_task(request, task_id):
+    """Stream task output as it is produced (SSE, or raw text with ?format=text)"""
+    task, output = await lookup_task(task_id)
+
+    if not task:
+        return jsonify({'error': 'Task not found'}, 404)
+
+    raw = request.args.get('format') == 'text'
+
+    async def generate():
+        if output is not None:
+            async with aclosing(output.follow_async()) as items:
+                async for item in items:
+                    if item is None:
+                        if not raw:
+                            yield ": keepalive\n\n"
+                        continue
+                    stream, text = item
+                    yield text if raw else sse_event(stream, text)
+        else:
+            # Already finished: replay the stored result
+            result = task.get('result') or {}
+            for stream in STREAMS:
+                if result.get(stream):
+                    yield result[stream] if raw else sse_event(stream, result[stream])
+
+        if not raw:
+            final, _ = await lookup_task(task_id)
+            final = final or task
+            yield sse_event('end', json.dumps({
+                'status': final['status'],
+                'returncode': (final.get('result') or {}).get('returncode'),
+                'error': final.get('error')
+            }))
+
+    return StreamingResponse(
+        generate(),
+        'text/plain' if raw else 'text/event-stream',
+        headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'}
+    )
+
+@route('/tasks/<task_id>/output')
+async def get_task_output(request, task_id):
+    """Ranged read of a task's full stdout/stderr"""
+    stream, offset, length = output_query(request.args)
+
+    task, output = await lookup_task(task_id)
+    if output is None:
+        output = spilled_outputs.get(task_id)
+
+    if not task:
+        return jsonify({'error': 'Task not found'}, 404)
+
+    if output is not None:
+        total = output.size(stream)
+        data = await asyncio.to_thread(output.read, stream, offset, length)
+    else:
+        full = ((task.get('result') or {}).get(stream) or '').encode()
+        total = len(full)
+        data = full[offset:offset + length]
+
+    return Response(data, content_type='application/octet-stream', headers={
+        'X-Output-Size': str(total),
+        'X-Output-Offset': str(offset),
+        'X-Output-Complete': str(task['status'] in FINISHED_STATUSES).lower()
+    })
+
+@route('/blobs/<digest>', methods=('PUT',), stream_body=True)
+async def put_blob(request, digest):
+    """Upload a blob under its sha256; a no-op if it is already stored"""
+    length = request.headers.get('content-length')
+    upload = blob_upload(blob_store, digest, int(length) if length and length.isdigit() else None)
+    if upload is None:
+        return jsonify(blob_info(blob_store, digest))
+    try:
+        pending = bytearray()
+        async for chunk in request.stream():
+            pending += chunk
+            if len(pending) >= CHUNK_SIZE:
+                await asyncio.to_thread(upload.write, bytes(pending))
+                pending.clear()
+        await asyncio.to_thread(upload.write, bytes(pending))
+        await asyncio.to_thread(upload.commit)
+    except BlobError as e:
+        raise RequestError(str(e), e.status)
+    finally:
+        upload.abort()
+
+    return jsonify(blob_info(blob_store, digest, created=True), 201)
+
+@route('/blobs/<digest>', methods=('GET', 'HEAD'))
+async def get_blob(request, digest):
+    """Download a blob; supports Range and conditional requests"""
+    path = blob_path(blob_store, digest)
+    size = os.path.getsize(path)
+    headers = {'Accept-Ranges': 'bytes', 'ETag': f'"{digest}"', 'Cache-Control': 'public, max-age=86400'}
+    if request.headers.get('if-none-match') == f'"{digest}"':
+        return Response(b'', 304, headers=headers)
+    try:
+        span = byte_range(request.headers.get('range'), size)
+    except RequestError as e:
+        return Response(json.dumps({'error': str(e)}), e.status, headers={'Content-Range': f'bytes */{size}'})
+
+    start, end = span or (0, size)
+    if span is not None:
+        headers['Content-Range'] = f'bytes {start}-{end - 1}/{size}'
+    return FileResponse(path, start, end, 206 if span else 200, headers, send_body=request.method == 'GET')
+
+@route('/tasks')
+async def list_tasks(request):
+    """List tasks, newest first (?status=, ?limit=, ?cursor=, ?since=)"""
+    status, cursor, since, limit = list_query(request.args)
+
+    task_list, total, next_cursor = tasks.list(status, cursor, since, limit)
+    return jsonify({
+        'tasks': task_list,
+        'total': total,
+        'next_cursor': next_cursor
+    })
+
+@route('/stats')
+async def get_stats(request):
+    """Get worker statistics"""
+    current_stats = stats.copy()
+    current_stats.update(task_counters(tasks.status_counts()))
+    current_stats['total_tasks'] = tasks.total
+    current_stats['task_store'] = tasks.get_stats()
+    current_stats['queue'] = task_queue.get_stats()
+    current_stats['execution_pool'] = {
+        'mode': 'asyncio',
+        'max_inflight': MAX_INFLIGHT,
+        'running_tasks': len(running_tasks)
+    }
+    if result_cache is not None:
+        current_stats['result_cache'] = result_cache.get_stats()
+    if blob_store is not None:
+        current_stats['blob_store'] = blob_store.get_stats()
+    if python_envs is not None:
+        current_stats['python_envs'] = python_envs.get_stats()
+    current_stats.update(executor.get_stats())
+    current_stats['task_usage'] = task_usage.get_stats()
+    current_stats['monitoring'] = monitor.get_summary()
+    current_stats['logging'] = logger.get_stats()
+    return jsonify(current_stats)
+
+@route('/metrics')
+async def get_metrics(request):
+    """Get detailed metrics (?resolution=1s|1m|1h returns downsampled history)"""
+    limit = request.int_arg('limit', 100)
+    try:
+        history = monitor.get_history(limit, request.args.get('resolution'))
+    except ValueError as e:
+        return jsonify({'error': str(e)}, 400)
+
+    return jsonify({
+        'current': monitor.get_metrics(),
+        'history': history,
+        'summary': monitor.get_summary()
+    })
+
+@route('/metrics/prometheus')
+async def get_prometheus_metrics(request):
+    """Latency histograms and queue gauges in the Prometheus text format
+    (OpenMetrics if the Accept header asks for it)"""
+    body, content_type = worker_metrics.exposition(request.headers.get('Accept'))
+    return Response(body, content_type=content_type)
+
+@route('/logs')
+async def get_logs(request):
+    """Get application logs"""
+    level = request.args.get('level')
+    limit = request.int_arg('limit', 100)
+    return jsonify({
+        'logs': logger.get_logs(level, limit)
+    })
+
+if __name__ == '__main__':
+    import uvicorn
+
+    port = int(os.getenv('PORT', 8080))
+    logger.info(f"Starting asyncio server on 0.0.0.0:{port}")
+    logger.info("Code execution support: Python, JavaScript, Bash")
+    uvicorn.run(app, host='0.0.0.0', port=port, log_level='warning')
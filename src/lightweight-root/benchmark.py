@@ -0,0 +1,259 @@
+#!/usr/bin/env python3
+"""
+Worker benchmark harness - measures code execution paths locally
+
+Usage:
+    python benchmark.py [section ...] [--iterations N]
+
+Sections:
+    delivery   cold execution latency per code delivery mode (memfd/stdin/tempfile)
+               compared with the warm runner pools
+    server     the same HTTP endpoints served by the threaded (app.py) and the
+               asyncio (async_app.py) worker: request latency and time, threads
+               and memory to drain many in-flight sleep and subprocess tasks
+    compute    compute tasks one operation per task versus one batched task,
+               on each available backend (NumPy, pure Python)
+"""
+import argparse
+import io
+import os
+import random
+import socket
+import subprocess
+import sys
+import time
+from contextlib import redirect_stdout
+
+import psutil
+import requests
+
+from compute import BACKENDS, run_compute
+from executors import CODE_DELIVERY_MODES, CodeExecutor
+from runner_pool import python_pool_from_env, node_pool_from_env
+
+SNIPPETS = {
+    'python': 'print(sum(range(100)))',
+    'javascript': 'console.log([...Array(100).keys()].reduce((a, b) => a + b, 0))',
+    'bash': 'echo $((99 * 100 / 2))'
+}
+
+
+def percentile(values, pct):
+    """Nearest-rank percentile of a list of numbers"""
+    if not values:
+        return 0
+    ordered = sorted(values)
+    index = min(len(ordered) - 1, max(0, int(round(pct / 100 * len(ordered))) - 1))
+    return ordered[index]
+
+
+def time_calls(func, iterations):
+    """Run func repeatedly and return per-call latencies in milliseconds"""
+    latencies = []
+    # Executors print debug lines; keep them out of the report
+    with redirect_stdout(io.StringIO()):
+        func()  # warm-up
+        for _ in range(iterations):
+            start = time.perf_counter()
+            result = func()
+            latencies.append((time.perf_counter() - start) * 1000)
+            if result.get('error') or not result.get('success'):
+                raise RuntimeError(f"benchmark task failed: {result}")
+    return latencies
+
+
+def print_row(label, latencies, baseline=None):
+    avg = sum(latencies) / len(latencies)
+    line = (f"  {label:<22} avg={avg:8.2f}ms  p50={percentile(latencies, 50):8.2f}ms"
+            f"  p95={percentile(latencies, 95):8.2f}ms")
+    if baseline:
+        line += f"  ({avg - baseline:+.2f}ms vs tempfile)"
+    print(line)
+    return avg
+
+
+def bench_delivery(iterations):
+    """Compare cold delivery modes and warm pools for each language"""
+    print("=" * 60)
+    print(f"Code delivery ({iterations} iterations per row)")
+    print("=" * 60)
+
+    python_pool = python_pool_from_env(1)
+    node_pool = node_pool_from_env(1)
+    for runner_pool in (python_pool, node_pool):
+        if runner_pool is not None:
+            runner_pool.start()
+
+    try:
+        for language, snippet in SNIPPETS.items():
+            print(f"\n{language}:")
+            averages = {}
+            for mode in reversed(CODE_DELIVERY_MODES):
+                executor = CodeExecutor(delivery=mode)
+                latencies = time_calls(lambda: executor.execute(language, snippet), iterations)
+                averages[mode] = print_row(mode, latencies, averages.get('tempfile'))
+
+            runner_pool = {'python': python_pool, 'javascript': node_pool}.get(language)
+            if runner_pool is not None:
+                executor = CodeExecutor(python_pool, node_pool)
+                latencies = time_calls(lambda: executor.execute(language, snippet), iterations)
+                print_row('warm pool', latencies, averages.get('tempfile'))
+    finally:
+        for runner_pool in (python_pool, node_pool):
+            if runner_pool is not None:
+                runner_pool.close()
+
+
+SERVER_MODES = {
+    'threaded': 'app.py',
+    'asyncio': 'async_app.py'
+}
+IN_FLIGHT_SLEEPS = 500
+IN_FLIGHT_PROCESSES = 200
+DRAIN_TIMEOUT = 300
+
+
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+
+def start_server(script, port):
+    """Launch a worker in its own process and wait until it answers"""
+    env = dict(os.environ, PORT=str(port), TASK_STORE_DB='')
+    proc = subprocess.Popen(
+        [sys.executable, script],
+        cwd=os.path.dirname(os.path.abspath(__file__)),
+        env=env,
+        stdout=subprocess.DEVNULL,
+        stderr=subprocess.DEVNULL
+    )
+    base = f'http://127.0.0.1:{port}'
+    deadline = time.time() + 30
+    while time.time() < deadline:
+        try:
+            requests.get(f'{base}/health', timeout=1)
+            return proc, base
+        except requests.RequestException:
+            time.sleep(0.2)
+    proc.kill()
+    raise RuntimeError(f"{script} did not start")
+
+
+def tree_rss(process):
+    """Resident memory of a process and its children in bytes"""
+    total = 0
+    for member in [process] + process.children(recursive=True):
+        try:
+            total += member.memory_info().rss
+        except psutil.NoSuchProcess:
+            pass  # exited since it was listed
+    return total
+
+
+def drain(session, base, server, specs):
+    """Submit tasks in one batch and wait for all of them; returns (seconds, peak threads, peak RSS MB)"""
+    start = time.perf_counter()
+    ids = session.post(f'{base}/tasks/batch', json=specs).json()['ids']
+    peak_threads, peak_rss = 0, 0
+    while time.perf_counter() - start < DRAIN_TIMEOUT:
+        peak_threads = max(peak_threads, server.num_threads())
+        peak_rss = max(peak_rss, tree_rss(server))
+        counts = session.post(f'{base}/tasks/status', json=ids).json()['counts']
+        if counts['pending'] == counts['processing'] == 0:
+            if counts['completed'] != len(ids):
+                raise RuntimeError(f"benchmark tasks failed: {counts}")
+            return time.perf_counter() - start, peak_threads, peak_rss / 1024 / 1024
+        time.sleep(0.05)
+    raise RuntimeError(f"tasks did not finish within {DRAIN_TIMEOUT}s")
+
+
+def bench_server(iterations):
+    """Compare the threaded and asyncio servers on the same endpoints"""
+    print("=" * 60)
+    print(f"Server modes ({iterations} iterations per latency row)")
+    print("=" * 60)
+
+    sleeps = [{'type': 'sleep', 'payload': {'duration': 0.2}}] * IN_FLIGHT_SLEEPS
+    processes = [{'type': 'code', 'payload': {'language': 'bash', 'code': 'sleep 0.2'}}] * IN_FLIGHT_PROCESSES
+
+    for mode, script in SERVER_MODES.items():
+        proc, base = start_server(script, free_port())
+        session = requests.Session()
+        try:
+            print(f"\n{mode} ({script}):")
+            server = psutil.Process(proc.pid)
+
+            def echo_round_trip():
+                task_id = session.post(f'{base}/tasks', json={'type': 'echo'}).json()['id']
+                task = session.get(f'{base}/tasks/{task_id}', params={'wait': 5}).json()
+                return {'success': task['status'] == 'completed'}
+
+            print_row('echo submit+wait', time_calls(echo_round_trip, iterations))
+            print_row('GET /health', time_calls(
+                lambda: {'success': session.get(f'{base}/health').ok}, iterations))
+
+            for label, specs in ((f'{IN_FLIGHT_SLEEPS} x sleep 0.2s', sleeps),
+                                 (f'{IN_FLIGHT_PROCESSES} x bash sleep 0.2', processes)):
+                seconds, threads, rss = drain(session, base, server, specs)
+                print(f"  {label:<22} drained in {seconds:6.2f}s  "
+                      f"peak threads={threads:4d}  peak RSS={rss:7.1f}MB")
+        finally:
+            session.close()
+            proc.terminate()
+            proc.wait()
+
+
+def bench_compute(iterations):
+    """Compare per-task compute calls with batched, vectorized ones"""
+    print("=" * 60)
+    print(f"Compute ({iterations} iterations per row)")
+    print("=" * 60)
+
+    rows = [[random.randint(0, 1000) for _ in range(3)] for _ in range(1000)]
+    matrix = [[random.random() for _ in range(100)] for _ in range(100)]
+    values = [random.random() for _ in range(100000)]
+    workloads = [
+        ('1000 sums, 1 per task', lambda backend: [
+            run_compute({'operation': 'add', 'numbers': row}, backend) for row in rows]),
+        ('1000 sums, batched', lambda backend: run_compute(
+            {'operation': 'sum', 'numbers': rows, 'axis': 1}, backend)),
+        ('100 factorials', lambda backend: run_compute(
+            {'operation': 'factorial', 'numbers': list(range(100))}, backend)),
+        ('100x100 matmul', lambda backend: run_compute(
+            {'operation': 'matmul', 'a': matrix, 'b': matrix}, backend)),
+        ('std of 100k values', lambda backend: run_compute(
+            {'operation': 'std', 'numbers': values}, backend)),
+    ]
+
+    for backend in BACKENDS:
+        print(f"\n{backend}:")
+        for label, workload in workloads:
+            print_row(label, time_calls(lambda: workload(backend) and {'success': True}, iterations))
+
+
+SECTIONS = {
+    'delivery': bench_delivery,
+    'server': bench_server,
+    'compute': bench_compute
+}
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Lightweight AI Worker benchmarks')
+    parser.add_argument('sections', nargs='*', default=list(SECTIONS),
+                        help=f"one or more of: {', '.join(SECTIONS)}")
+    parser.add_argument('--iterations', type=int, default=20)
+    args = parser.parse_args()
+
+    unknown = [name for name in args.sections if name not in SECTIONS]
+    if unknown:
+        parser.error(f"unknown section(s): {', '.join(unknown)}")
+
+    for name in args.sections:
+        SECTIONS[name](args.iterations)
+
+
+if __name__ == '__main__':
+    main()
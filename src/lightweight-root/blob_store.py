@@ -0,0 +1,300 @@
+#!/usr/bin/env python3
+"""
+Blob store - content-addressed files for large task inputs and outputs
+
+Blobs are uploaded once under their SHA-256 (PUT /blobs/<sha256>) and stored
+read-only at <dir>/<first two hex digits>/<sha256>. A code task that lists
+blobs in `payload['files']` gets its own copy of each in $INPUT_DIR (a reflink
+sharing the blob's blocks where the filesystem supports it), so writing to an
+input cannot change the stored blob; with `payload['artifacts']` every file it
+writes to $OUTPUT_DIR is moved
+into the store and returned as a hash that GET /blobs/<sha256> serves. Least
+recently used blobs are deleted once the store outgrows its size limit.
+"""
+import fcntl
+import hashlib
+import os
+import re
+import shutil
+import tempfile
+import threading
+import time
+from contextlib import contextmanager
+
+CHUNK_SIZE = 1024 * 1024
+FICLONE = 0x40049409  # ioctl from linux/fs.h: share another file's blocks copy-on-write
+MAX_ARTIFACTS = 1000
+BLOB_ID = re.compile(r'^[0-9a-f]{64}$')
+
+
+class BlobError(ValueError):
+    """Invalid or missing blob, with the HTTP status to answer it with"""
+
+    def __init__(self, message, status=400):
+        super().__init__(message)
+        self.status = status
+
+
+def is_blob_id(digest):
+    return isinstance(digest, str) and BLOB_ID.match(digest) is not None
+
+
+def copy_file(source, target):
+    """Create `target` as a separate, read-only copy of `source`: a reflink where
+    the filesystem supports it (btrfs, XFS), otherwise an in-kernel copy"""
+    with open(source, 'rb') as src, open(target, 'xb') as dst:
+        try:
+            fcntl.ioctl(dst.fileno(), FICLONE, src.fileno())
+        except OSError:
+            try:
+                remaining = os.fstat(src.fileno()).st_size
+                while remaining > 0:
+                    copied = os.copy_file_range(src.fileno(), dst.fileno(), remaining)
+                    if not copied:
+                        break
+                    remaining -= copied
+            except (AttributeError, OSError):  # not Linux, or not between these filesystems
+                src.seek(0)
+                dst.seek(0)
+                dst.truncate()
+                shutil.copyfileobj(src, dst, CHUNK_SIZE)
+    os.chmod(target, 0o444)
+
+
+def is_file_name(name):
+    """A plain file name a task may be given an input under"""
+    return (isinstance(name, str) and 0 < len(name) <= 255 and name not in ('.', '..')
+            and '/' not in name and '\0' not in name)
+
+
+class BlobUpload:
+    """A blob being written; it only becomes visible if its content matches its id"""
+
+    def __init__(self, store, digest):
+        self.store = store
+        self.digest = digest
+        self.size = 0
+        self._hash = hashlib.sha256()
+        fd, self._temp_path = tempfile.mkstemp(dir=store.temp_dir)
+        self._file = os.fdopen(fd, 'wb')
+
+    def write(self, data):
+        self.size += len(data)
+        if self.size > self.store.max_blob_bytes:
+            self.abort()
+            raise BlobError(f'Blob too large (max {self.store.max_blob_bytes} bytes)', 413)
+        self._hash.update(data)
+        self._file.write(data)
+
+    def commit(self):
+        """Store the blob; raises BlobError if the data does not hash to its id"""
+        self._file.close()
+        if self._hash.hexdigest() != self.digest:
+            os.unlink(self._temp_path)
+            raise BlobError(f'Content does not match sha256 {self.digest}')
+        self.store._add(self._temp_path, self.digest, self.size)
+
+    def abort(self):
+        if not self._file.closed:
+            self._file.close()
+            os.unlink(self._temp_path)
+
+
+class TaskWorkspace:
+    """Input and output directories of one task run"""
+
+    def __init__(self, store, root):
+        self.store = store
+        self.root = root
+        self.env = {}
+        self.output_dir = None
+
+    def copy_inputs(self, files):
+        input_dir = os.path.join(self.root, 'input')
+        os.mkdir(input_dir)
+        for name, digest in files.items():
+            path = self.store.get(digest)
+            if path is None:
+                raise BlobError(f'Blob not found: {digest}', 404)
+            try:
+                # Not a hard link: the task could write through it into the store
+                copy_file(path, os.path.join(input_dir, name))
+            except FileNotFoundError:
+                raise BlobError(f'Blob not found: {digest}', 404)  # evicted meanwhile
+        self.env['INPUT_DIR'] = input_dir
+
+    def create_output_dir(self):
+        self.output_dir = os.path.join(self.root, 'output')
+        os.mkdir(self.output_dir)
+        self.env['OUTPUT_DIR'] = self.output_dir
+
+    def finish(self, result):
+        """Move the files the task wrote into the store and list them in `result`"""
+        if self.output_dir is None or not isinstance(result, dict):
+            return result
+        artifacts = {}
+        for path in self._output_files():
+            if len(artifacts) >= MAX_ARTIFACTS:
+                result['artifacts_truncated'] = True
+                break
+            relative = os.path.relpath(path, self.output_dir)
+            size = os.path.getsize(path)
+            if size > self.store.max_blob_bytes:
+                artifacts[relative] = {'size': size, 'error': 'Artifact too large'}
+                continue
+            artifacts[relative] = {'sha256': self.store.add_file(path), 'size': size}
+        result['artifacts'] = artifacts
+        return result
+
+    def _output_files(self):
+        for directory, _, names in os.walk(self.output_dir):
+            for name in sorted(names):
+                path = os.path.join(directory, name)
+                if not os.path.islink(path) and os.path.isfile(path):
+                    yield path
+
+
+class BlobStore:
+    """Content-addressed files on local disk, shared by every worker process using the directory"""
+
+    def __init__(self, root, max_bytes=1024 * 1024 * 1024, max_blob_bytes=512 * 1024 * 1024,
+                 min_age=900, logger=None):
+        self.root = root
+        self.max_bytes = max_bytes
+        self.max_blob_bytes = max_blob_bytes
+        self.min_age = min_age  # blobs used more recently than this are never evicted
+        self.logger = logger
+        self.temp_dir = os.path.join(root, 'tmp')
+        self.work_dir = os.path.join(root, 'work')
+        os.makedirs(self.temp_dir, exist_ok=True)
+        os.makedirs(self.work_dir, exist_ok=True)
+        self._lock = threading.Lock()
+        self._stats = {'uploads': 0, 'duplicates': 0, 'artifacts': 0, 'evictions': 0}
+        self._count, self._bytes = 0, 0
+        for _, size, _ in self._scan():
+            self._count += 1
+            self._bytes += size
+
+    def path(self, digest):
+        return os.path.join(self.root, digest[:2], digest)
+
+    def get(self, digest):
+        """Path of a stored blob, marking it recently used; None if absent"""
+        if not is_blob_id(digest):
+            return None
+        path = self.path(digest)
+        try:
+            os.utime(path)
+        except OSError:
+            return None
+        return path
+
+    def upload(self, digest):
+        """BlobUpload for a new blob, or None if it is already stored"""
+        if not is_blob_id(digest):
+            raise BlobError('Blob id must be a lowercase hex sha256')
+        if self.get(digest) is not None:
+            with self._lock:
+                self._stats['duplicates'] += 1
+            return None
+        return BlobUpload(self, digest)
+
+    def add_file(self, path):
+        """Move a file into the store; returns its sha256"""
+        digest = hashlib.sha256()
+        size = 0
+        with open(path, 'rb') as f:
+            for chunk in iter(lambda: f.read(CHUNK_SIZE), b''):
+                digest.update(chunk)
+                size += len(chunk)
+        digest = digest.hexdigest()
+        if self.get(digest) is not None:
+            os.unlink(path)
+        else:
+            self._add(path, digest, size, artifact=True)
+        return digest
+
+    def _add(self, temp_path, digest, size, artifact=False):
+        os.chmod(temp_path, 0o444)
+        os.makedirs(os.path.dirname(self.path(digest)), exist_ok=True)
+        os.replace(temp_path, self.path(digest))
+        with self._lock:
+            self._stats['artifacts' if artifact else 'uploads'] += 1
+            self._count += 1
+            self._bytes += size
+            over = self._bytes > self.max_bytes
+        if over:
+            self._evict()
+
+    def _scan(self):
+        """(path, size, last used) of every stored blob"""
+        for prefix in os.scandir(self.root):
+            if len(prefix.name) != 2 or not prefix.is_dir():
+                continue
+            for entry in os.scandir(prefix.path):
+                try:
+                    stat = entry.stat()
+                except OSError:
+                    continue  # evicted by another process
+                yield entry.path, stat.st_size, stat.st_mtime
+
+    def _evict(self):
+        """Delete least recently used blobs until the store fits its limit"""
+        blobs = sorted(self._scan(), key=lambda blob: blob[2])
+        total = sum(size for _, size, _ in blobs)
+        count = len(blobs)
+        cutoff = time.time() - self.min_age
+        evicted = 0
+        for path, size, used_at in blobs:
+            if total <= self.max_bytes or used_at > cutoff:
+                break
+            try:
+                os.unlink(path)
+            except OSError:
+                continue
+            total -= size
+            count -= 1
+            evicted += 1
+        with self._lock:
+            self._count, self._bytes = count, total
+            self._stats['evictions'] += evicted
+        if evicted and self.logger:
+            self.logger.info(f"Blob store: evicted {evicted} blobs")
+
+    @contextmanager
+    def workspace(self, files=None, artifacts=False):
+        """Directories for one task run, removed afterwards"""
+        workspace = TaskWorkspace(self, tempfile.mkdtemp(prefix='task-', dir=self.work_dir))
+        try:
+            if files:
+                workspace.copy_inputs(files)
+            if artifacts:
+                workspace.create_output_dir()
+            yield workspace
+        finally:
+            shutil.rmtree(workspace.root, ignore_errors=True)
+
+    def get_stats(self):
+        with self._lock:
+            stats = dict(self._stats)
+            stats.update(blobs=self._count, bytes=self._bytes, max_bytes=self.max_bytes)
+        return stats
+
+
+def blob_store_from_env(logger=None):
+    """Build the blob store from BLOB_* settings, or None if BLOB_STORE_DIR is empty"""
+    root = os.getenv('BLOB_STORE_DIR', 'data/blobs')
+    if not root:
+        return None
+    try:
+        return BlobStore(
+            root,
+            max_bytes=int(float(os.getenv('BLOB_STORE_MB', 1024)) * 1024 * 1024),
+            max_blob_bytes=int(float(os.getenv('BLOB_MAX_MB', 512)) * 1024 * 1024),
+            min_age=float(os.getenv('BLOB_MIN_AGE', 900)),
+            logger=logger
+        )
+    except OSError as e:
+        if logger:
+            logger.warning(f"Blob store disabled: {e}")
+        return None
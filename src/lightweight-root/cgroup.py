@@ -0,0 +1,113 @@
+#!/usr/bin/env python3
+"""
+Cgroup - container-level CPU, memory, task and I/O accounting from cgroup v2
+
+The kernel already sums every process of a cgroup: cpu.stat, memory.current,
+memory.peak, pids.current and io.stat describe the whole container in a few
+small file reads, however many processes it runs and without racing their
+exits. The cgroup is found from /proc/self/cgroup under /sys/fs/cgroup;
+outside a cgroup v2 hierarchy (cgroup v1, macOS) there is none and callers
+fall back to walking processes.
+"""
+import os
+
+CGROUP_ROOT = '/sys/fs/cgroup'
+IO_FIELDS = ('rbytes', 'wbytes', 'rios', 'wios')
+
+
+class Cgroup:
+    """A cgroup v2 directory with the cpu and memory controllers enabled"""
+
+    def __init__(self, path):
+        self.path = path
+
+    @classmethod
+    def find(cls, root=CGROUP_ROOT):
+        """The cgroup of this process, or None if it cannot be read"""
+        try:
+            with open('/proc/self/cgroup') as f:
+                lines = f.read().splitlines()
+        except OSError:
+            return None
+        relative = next((line[3:] for line in lines if line.startswith('0::')), None)
+        if relative is None:
+            return None  # cgroup v1 only
+        # Without a cgroup namespace the path is relative to the host's hierarchy,
+        # which the container may only see as its own root
+        for path in (os.path.normpath(os.path.join(root, relative.lstrip('/'))), root):
+            if all(os.path.exists(os.path.join(path, name)) for name in ('cpu.stat', 'memory.current')):
+                return cls(path)
+        return None
+
+    def _read(self, name):
+        with open(os.path.join(self.path, name)) as f:
+            return f.read()
+
+    def _read_int(self, name):
+        """A single-value file, or None if the controller does not provide it"""
+        try:
+            value = self._read(name).strip()
+        except OSError:
+            return None
+        return None if value == 'max' else int(value)
+
+    def _read_keyed(self, name):
+        """'key value' lines -> {key: int}"""
+        values = {}
+        for line in self._read(name).splitlines():
+            key, _, value = line.partition(' ')
+            if value.isdigit():
+                values[key] = int(value)
+        return values
+
+    def _lines(self, name):
+        try:
+            return len(self._read(name).split())
+        except OSError:
+            return None
+
+    def io(self):
+        """io.stat summed over devices: {rbytes, wbytes, rios, wios}"""
+        totals = dict.fromkeys(IO_FIELDS, 0)
+        try:
+            lines = self._read('io.stat').splitlines()
+        except OSError:
+            return totals
+        for line in lines:
+            for pair in line.split()[1:]:  # 'MAJ:MIN rbytes=.. wbytes=.. rios=.. wios=.. ...'
+                key, _, value = pair.partition('=')
+                if key in totals:
+                    totals[key] += int(value)
+        return totals
+
+    def read(self):
+        """One snapshot of the cgroup's counters; memory values in bytes, CPU in microseconds.
+
+        Raises OSError if the cgroup cannot be read.
+        """
+        cpu = self._read_keyed('cpu.stat')
+        memory_stat = self._read_keyed('memory.stat')
+        current = int(self._read('memory.current'))
+        tasks = self._read_int('pids.current')
+        return {
+            'cpu_usage_usec': cpu.get('usage_usec', 0),
+            'cpu_throttled_usec': cpu.get('throttled_usec', 0),
+            'memory_current': current,
+            # Working set, as `docker stats` shows it: reclaimable file cache is not counted
+            'memory_working_set': max(0, current - memory_stat.get('inactive_file', 0)),
+            'memory_peak': self._read_int('memory.peak'),  # Linux 5.19+
+            'memory_max': self._read_int('memory.max'),
+            'tasks': tasks if tasks is not None else self._lines('cgroup.threads'),
+            'processes': self._lines('cgroup.procs'),
+            'io': self.io()
+        }
+
+
+def cgroup_from_env():
+    """The cgroup to monitor: CGROUP_PATH, else this process's; none with METRICS_SOURCE=psutil"""
+    if os.getenv('METRICS_SOURCE', 'auto').lower() == 'psutil':
+        return None
+    path = os.getenv('CGROUP_PATH')
+    if path:
+        return Cgroup(path)
+    return Cgroup.find()
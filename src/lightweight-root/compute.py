@@ -0,0 +1,399 @@
+#!/usr/bin/env python3
+"""
+Compute engine - numeric operations for the `compute` task type
+
+Operands are numbers or (nested) lists of numbers. Operations run vectorized
+on NumPy arrays when NumPy is installed and fall back to pure Python
+otherwise, with the same results (NumPy-style broadcasting, ints stay exact
+ints). One task can carry many operations in `operations`.
+
+Payload:
+    {"operation": "add", "numbers": [1, 2, 3]}              reduction (sum)
+    {"operation": "add", "a": [1, 2], "b": [[10], [20]]}    element-wise, broadcast
+    {"operation": "sqrt", "a": [1, 4, 9]}                   element-wise, one operand
+    {"operation": "mean", "numbers": [[1, 2], [3, 4]], "axis": 0}
+    {"operation": "matmul", "a": [[1, 2], [3, 4]], "b": [[5], [6]]}
+    {"operation": "factorial", "numbers": [5, 10, 20]}
+    {"operations": [{...}, {...}]}                          batch
+"""
+import functools
+import math
+import operator
+import os
+import sys
+import time
+
+try:
+    import numpy as np
+except ImportError:  # optional: everything has a pure-Python fallback
+    np = None
+
+BACKENDS = ('numpy', 'python') if np is not None else ('python',)
+MAX_ELEMENTS = int(os.getenv('COMPUTE_MAX_ELEMENTS', 10_000_000))
+MAX_BATCH_OPERATIONS = int(os.getenv('COMPUTE_MAX_OPERATIONS', 10000))
+# Results must convert to JSON text, and Python refuses to print ints longer than
+# sys.get_int_max_str_digits() (4300 digits by default; 0 or older Pythons: no limit)
+MAX_INT_DIGITS = getattr(sys, 'get_int_max_str_digits', lambda: 0)() or 300_000
+MAX_INT_BITS = int(MAX_INT_DIGITS * math.log2(10))
+NUMPY_MIN_ELEMENTS = 64  # below this, array conversion costs more than it saves
+INT64_SAFE = 2 ** 62  # integer results at or beyond this are recomputed exactly in Python
+RAGGED_ERROR = 'operands must be regular arrays (all rows of the same length)'
+
+
+class ComputeError(ValueError):
+    """Invalid compute request"""
+
+
+# The scalar helpers follow NumPy's floating-point results (inf / nan instead of
+# Python's ZeroDivisionError, OverflowError or complex numbers)
+
+def _py_divide(x, y):
+    try:
+        return x / y
+    except ZeroDivisionError:
+        return math.copysign(math.inf, x) * math.copysign(1, y) if x and x == x else math.nan
+
+
+def _odd(y):
+    return (isinstance(y, int) or y.is_integer()) and int(y) % 2 == 1
+
+
+def _py_power(x, y):
+    if isinstance(x, int) and isinstance(y, int) and y > 0 and abs(x) > 1 \
+            and y * math.log2(abs(x)) > MAX_INT_BITS:
+        raise ComputeError(f'integer power result too large (max {MAX_INT_DIGITS} digits)')
+    try:
+        result = x ** y
+    except ZeroDivisionError:  # 0 to a negative power
+        return math.copysign(math.inf, x) if _odd(y) else math.inf
+    except OverflowError:
+        return -math.inf if x < 0 and _odd(y) else math.inf
+    return math.nan if isinstance(result, complex) else result
+
+
+def _py_exp(x):
+    try:
+        return math.exp(x)
+    except OverflowError:
+        return math.inf
+
+
+def _py_log(x):
+    if x > 0:
+        return math.log(x)
+    return -math.inf if x == 0 else math.nan
+
+
+def _py_sqrt(x):
+    return math.sqrt(x) if x >= 0 else math.nan
+
+
+def _py_maximum(x, y):
+    return x if x != x or x >= y else y  # nan wins, as in NumPy
+
+
+def _py_minimum(x, y):
+    return x if x != x or x <= y else y
+
+
+def _py_var(values):
+    mean = sum(values) / len(values)
+    return sum((v - mean) ** 2 for v in values) / len(values)
+
+
+# name -> (numpy function, pure-Python function)
+BINARY_OPS = {
+    'add': ('add', operator.add),
+    'subtract': ('subtract', operator.sub),
+    'multiply': ('multiply', operator.mul),
+    'divide': ('true_divide', _py_divide),
+    'power': ('power', _py_power),
+    'maximum': ('maximum', _py_maximum),
+    'minimum': ('minimum', _py_minimum),
+}
+UNARY_OPS = {
+    'negative': ('negative', operator.neg),
+    'abs': ('abs', abs),
+    'square': ('square', lambda x: x * x),
+    'sqrt': ('sqrt', _py_sqrt),
+    'exp': ('exp', _py_exp),
+    'log': ('log', _py_log),
+}
+REDUCTIONS = {
+    'sum': ('sum', sum),
+    'prod': ('prod', math.prod),
+    'mean': ('mean', lambda values: sum(values) / len(values)),
+    'min': ('min', lambda values: functools.reduce(_py_minimum, values)),
+    'max': ('max', lambda values: functools.reduce(_py_maximum, values)),
+    'var': ('var', _py_var),
+    'std': ('std', lambda values: math.sqrt(_py_var(values))),
+}
+# Legacy names: with only `numbers`, these reduce instead of mapping
+REDUCTION_ALIASES = {'add': 'sum', 'multiply': 'prod'}
+# Results that can leave the int64 range for integer inputs
+GROWING_OPS = ('add', 'subtract', 'multiply', 'power', 'negative', 'abs', 'square', 'sum', 'prod', 'matmul')
+
+
+def run_compute(payload, backend=None, deadline=None):
+    """Result of a compute task: {'result': ...}, or {'results': [...]} for a batch.
+
+    Raises TimeoutError once time.monotonic() passes `deadline`; a batch is
+    stopped between operations.
+    """
+    backend = backend or BACKENDS[0]
+    if 'operations' in payload:
+        specs = payload['operations']
+        if not isinstance(specs, list) or not all(isinstance(spec, dict) for spec in specs):
+            raise ComputeError('operations must be a list of operation objects')
+        if len(specs) > MAX_BATCH_OPERATIONS:
+            raise ComputeError(f'Too many operations (max {MAX_BATCH_OPERATIONS})')
+        results = []
+        for spec in specs:
+            _check_deadline(deadline)
+            try:
+                results.append(compute(spec, backend))
+            except (ArithmeticError, TypeError, ValueError) as e:
+                results.append({'error': str(e)})
+        _check_deadline(deadline)
+        return {'results': results}
+    result = compute(payload, backend)
+    _check_deadline(deadline)
+    return {'result': result}
+
+
+def _check_deadline(deadline):
+    if deadline is not None and time.monotonic() > deadline:
+        raise TimeoutError('compute task exceeded its timeout')
+
+
+def compute(spec, backend=None):
+    """Evaluate one operation spec and return a JSON-compatible value"""
+    backend = backend or BACKENDS[0]
+    operation = spec.get('operation', 'add')
+
+    if operation == 'factorial':
+        if 'numbers' in spec:
+            return [_factorial(n) for n in spec['numbers']]
+        return _factorial(spec.get('number', 5))
+
+    if operation in ('matmul', 'dot'):
+        a, b = _operand(spec, 'a'), _operand(spec, 'b')
+        size = math.prod(_shape(a)) * (_shape(b) or (1,))[-1]
+        return _dispatch(backend, 'matmul', size, _np_matmul, _py_matmul, a, b)
+
+    if operation in UNARY_OPS:
+        numpy_name, py_func = UNARY_OPS[operation]
+        a = _operand(spec, 'a', 'numbers')
+        size = _check_size(_shape(a))
+        return _dispatch(backend, operation, size,
+                         lambda x: getattr(np, numpy_name)(x),
+                         lambda x: _py_map1(py_func, x), a)
+
+    if operation in BINARY_OPS and 'a' in spec:
+        numpy_name, py_func = BINARY_OPS[operation]
+        a, b = _operand(spec, 'a'), _operand(spec, 'b')
+        size = _check_size(_broadcast_shape(_shape(a), _shape(b)))
+        return _dispatch(backend, operation, size,
+                         lambda x, y: getattr(np, numpy_name)(x, y),
+                         lambda x, y: _py_map2(py_func, x, y), a, b)
+
+    operation = REDUCTION_ALIASES.get(operation, operation)
+    if operation in REDUCTIONS:
+        numpy_name, py_func = REDUCTIONS[operation]
+        values = spec.get('numbers', spec.get('a', [1, 2, 3]))
+        axis = spec.get('axis')
+        if axis is not None and (isinstance(axis, bool) or not isinstance(axis, int)):
+            raise ComputeError('axis must be an integer')
+        shape = _shape(values)
+        if axis is not None and not -len(shape) <= axis < len(shape):
+            raise ComputeError(f'axis {axis} is out of bounds for an array of dimension {len(shape)}')
+        size = _check_size(shape)
+        return _dispatch(backend, operation, size,
+                         lambda x: getattr(np, numpy_name)(x, axis=axis),
+                         lambda x: _py_reduce(py_func, x, axis), values)
+
+    raise ComputeError(f'Unknown operation: {operation}')
+
+
+def _factorial(n):
+    if isinstance(n, bool) or not isinstance(n, int) or n < 0:
+        raise ComputeError('factorial needs non-negative integers')
+    if n > 10000:
+        raise ComputeError('factorial argument too large (max 10000)')
+    return _check_int_size(math.factorial(n))
+
+
+def _operand(spec, *names):
+    for name in names:
+        if name in spec:
+            return spec[name]
+    raise ComputeError(f"'{spec.get('operation', 'add')}' needs operand '{names[0]}'")
+
+
+def _check_size(shape):
+    """Number of elements of `shape`, which must not exceed MAX_ELEMENTS"""
+    size = math.prod(shape)
+    if size > MAX_ELEMENTS:
+        raise ComputeError(f'Result too large (max {MAX_ELEMENTS} elements)')
+    return size
+
+
+def _dispatch(backend, operation, size, np_func, py_func, *operands):
+    """Run on NumPy when possible; use Python for small or non-numeric input
+    and wherever NumPy's integer arithmetic differs from Python's: results that
+    could overflow int64, ints beyond int64 (uint64 / object arrays) and
+    integers to negative integer powers"""
+    if backend == 'numpy' and np is not None and size >= NUMPY_MIN_ELEMENTS:
+        try:
+            arrays = [np.asarray(x) for x in operands]
+        except ValueError:
+            raise ComputeError(RAGGED_ERROR) from None
+        if not all(arr.dtype.kind in 'bif' for arr in arrays):
+            arrays = []
+        # JSON booleans are Python ints: True + True == 2
+        arrays = [arr.astype(np.int64) if arr.dtype.kind == 'b' else arr for arr in arrays]
+        if operation == 'power' and arrays and all(arr.dtype.kind == 'i' for arr in arrays) \
+                and (arrays[1] < 0).any():
+            arrays = []  # NumPy refuses these, Python returns floats
+        if arrays:
+            with np.errstate(all='ignore'):
+                result = np_func(*arrays)
+                if operation in GROWING_OPS and result.dtype.kind in 'iu':
+                    bound = np_func(*[arr.astype(np.float64) for arr in arrays])
+                    if not np.all(np.abs(bound) < INT64_SAFE):
+                        result = None
+            if result is not None:
+                return result.tolist() if isinstance(result, np.ndarray) else result.item()
+    for x in operands:
+        _check_regular(x)
+    result = py_func(*operands)
+    return _check_int_size(result) if operation in GROWING_OPS else result
+
+
+def _check_int_size(value):
+    """Reject integers (in a nested list) too long to be returned as JSON"""
+    if isinstance(value, list):
+        for item in value:
+            _check_int_size(item)
+    elif isinstance(value, int) and value.bit_length() > MAX_INT_BITS:
+        raise ComputeError(f'integer result too large (max {MAX_INT_DIGITS} digits)')
+    return value
+
+
+# Pure-Python fallback
+
+def _shape(x):
+    shape = []
+    while isinstance(x, list):
+        shape.append(len(x))
+        if not x:
+            break
+        x = x[0]
+    return tuple(shape)
+
+
+def _check_regular(x, shape=None):
+    """Reject ragged nested lists, which NumPy cannot turn into an array"""
+    if shape is None:
+        shape = _shape(x)
+    if not shape:
+        if isinstance(x, list):
+            raise ComputeError(RAGGED_ERROR)
+        return
+    if not isinstance(x, list) or len(x) != shape[0]:
+        raise ComputeError(RAGGED_ERROR)
+    for item in x:
+        _check_regular(item, shape[1:])
+
+
+def _broadcast_shape(a, b):
+    shape = []
+    for i in range(1, max(len(a), len(b)) + 1):
+        x = a[-i] if i <= len(a) else 1
+        y = b[-i] if i <= len(b) else 1
+        if x != y and 1 not in (x, y):
+            raise ComputeError(f'operands could not be broadcast together with shapes {a} {b}')
+        shape.append(max(x, y) if 0 not in (x, y) else 0)
+    return tuple(reversed(shape))
+
+
+def _number(x):
+    if isinstance(x, (int, float)):
+        return x
+    raise ComputeError(f'not a number: {x!r}')
+
+
+def _py_map1(func, x):
+    if isinstance(x, list):
+        return [_py_map1(func, item) for item in x]
+    return func(_number(x))
+
+
+def _py_map2(func, a, b):
+    """Apply `func` element-wise with NumPy broadcasting rules"""
+    da, db = len(_shape(a)), len(_shape(b))
+    if da > db:
+        return [_py_map2(func, x, b) for x in a]
+    if db > da:
+        return [_py_map2(func, a, y) for y in b]
+    if not da:
+        return func(_number(a), _number(b))
+    if len(a) == len(b):
+        return [_py_map2(func, x, y) for x, y in zip(a, b)]
+    if len(a) == 1:
+        return [_py_map2(func, a[0], y) for y in b]
+    if len(b) == 1:
+        return [_py_map2(func, x, b[0]) for x in a]
+    raise ComputeError(f'operands could not be broadcast together with shapes {_shape(a)} {_shape(b)}')
+
+
+def _flatten(x):
+    if not isinstance(x, list):
+        yield _number(x)
+        return
+    for item in x:
+        yield from _flatten(item)
+
+
+def _py_reduce(func, x, axis=None):
+    if axis is None or not isinstance(x, list):
+        values = list(_flatten(x))
+        if not values and func not in (sum, math.prod):
+            raise ComputeError('reduction of an empty array')
+        return func(values)
+    ndim = len(_shape(x))
+    if axis < 0:
+        axis += ndim
+    if not 0 <= axis < ndim:
+        raise ComputeError(f'axis {axis} is out of bounds for an array of dimension {ndim}')
+    if axis > 0:
+        return [_py_reduce(func, item, axis - 1) for item in x]
+    if ndim == 1:
+        return _py_reduce(func, x)
+    return [_py_reduce(func, [item[i] for item in x], 0) for i in range(len(x[0]))]
+
+
+def _py_matmul(a, b):
+    da, db = len(_shape(a)), len(_shape(b))
+    if not (1 <= da <= 2 and 1 <= db <= 2):
+        raise ComputeError('matmul needs 1-D or 2-D operands')
+    rows = a if da == 2 else [a]
+    cols = list(zip(*b)) if db == 2 else [b]
+    if not rows or not cols:
+        raise ComputeError('matmul of an empty array')
+    if len(rows[0]) != len(cols[0]):
+        raise ComputeError(f'matmul shape mismatch: {_shape(a)} x {_shape(b)}')
+    _check_size((len(rows), len(cols)))
+    result = [[sum(_number(x) * _number(y) for x, y in zip(row, col)) for col in cols] for row in rows]
+    if db == 1:
+        result = [row[0] for row in result]
+    return result[0] if da == 1 else result
+
+
+def _np_matmul(a, b):
+    if not (1 <= a.ndim <= 2 and 1 <= b.ndim <= 2):
+        raise ComputeError('matmul needs 1-D or 2-D operands')
+    if a.shape[-1] != b.shape[0]:
+        raise ComputeError(f'matmul shape mismatch: {a.shape} x {b.shape}')
+    _check_size((a.shape[0] if a.ndim == 2 else 1, b.shape[1] if b.ndim == 2 else 1))
+    return np.matmul(a, b)
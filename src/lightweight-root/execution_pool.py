@@ -0,0 +1,301 @@
+#!/usr/bin/env python3
+"""
+Execution pool - runs queued tasks on a fixed set of worker threads with a
+global concurrency limit plus per-language limits for code tasks
+"""
+import heapq
+import itertools
+import os
+import queue
+import threading
+import time
+from bisect import bisect_left
+
+LANGUAGE_ALIASES = {
+    'python': 'python',
+    'javascript': 'javascript',
+    'node': 'javascript',
+    'bash': 'bash',
+    'shell': 'bash'
+}
+
+
+PRIORITIES = ('high', 'normal', 'low')
+
+
+class TaskQueue:
+    """Task queue with strict priorities and weighted fair sharing between clients.
+
+    Higher priorities are always served first. Within a priority, each client's
+    tasks are stamped with virtual finish times (start-time fair queuing with
+    unit cost), so clients are served in proportion to their weights and a
+    burst from one client cannot push another client's tasks to the back.
+    Entries are removed lazily, so `remove` is O(1).
+    """
+
+    def __init__(self, weights=None, default_weight=1.0):
+        self.weights = dict(weights or {})
+        self.default_weight = default_weight
+        self._cond = threading.Condition()
+        self._heaps = {priority: [] for priority in PRIORITIES}  # (finish, seq, task_id)
+        self._entries = {}  # task_id -> (priority, finish, seq, start, client)
+        self._vtime = {priority: 0.0 for priority in PRIORITIES}
+        self._last_finish = {priority: {} for priority in PRIORITIES}  # client -> finish tag
+        self._seq = itertools.count()
+
+    def __len__(self):
+        with self._cond:
+            return len(self._entries)
+
+    def put(self, task_id, client=None, priority='normal'):
+        self.put_many([(task_id, client, priority)])
+
+    def put_many(self, items):
+        """Enqueue (task_id, client, priority) tuples under one lock acquisition"""
+        items = list(items)
+        if not items:
+            return
+        with self._cond:
+            for task_id, client, priority in items:
+                self._push(task_id, client, priority or 'normal')
+            self._cond.notify(len(items))
+
+    def _push(self, task_id, client, priority):
+        finishes = self._last_finish[priority]
+        start = max(self._vtime[priority], finishes.get(client, 0.0))
+        finish = start + 1.0 / self.weights.get(client, self.default_weight)
+        finishes[client] = finish
+        seq = next(self._seq)
+        self._entries[task_id] = (priority, finish, seq, start, client)
+        heapq.heappush(self._heaps[priority], (finish, seq, task_id))
+
+    def get(self, timeout=None):
+        """Next task id to run; raises queue.Empty after `timeout` seconds"""
+        with self._cond:
+            if not self._entries:
+                self._cond.wait(timeout)
+            for priority in PRIORITIES:
+                heap = self._heaps[priority]
+                while heap:
+                    _, seq, task_id = heapq.heappop(heap)
+                    entry = self._entries.get(task_id)
+                    if entry is None or entry[2] != seq:
+                        continue  # removed
+                    del self._entries[task_id]
+                    self._vtime[priority] = entry[3]
+                    self._forget_idle_clients(priority)
+                    return task_id
+            raise queue.Empty
+
+    def _forget_idle_clients(self, priority):
+        """Drop finish tags that no longer affect scheduling"""
+        finishes = self._last_finish[priority]
+        if len(finishes) > 1024:
+            vtime = self._vtime[priority]
+            for client in [c for c, f in finishes.items() if f <= vtime]:
+                del finishes[client]
+
+    def remove(self, task_id):
+        """Take a queued task out of the queue; False if it is not queued"""
+        with self._cond:
+            return self._entries.pop(task_id, None) is not None
+
+    def positions(self, task_ids):
+        """0-based dispatch order of the given queued tasks, as {task_id: position}"""
+        with self._cond:
+            wanted = [task_id for task_id in task_ids if task_id in self._entries]
+            if not wanted:
+                return {}
+            rank = {priority: i for i, priority in enumerate(PRIORITIES)}
+            key = lambda entry: (rank[entry[0]], entry[1], entry[2])
+            order = sorted(key(entry) for entry in self._entries.values())
+            return {task_id: bisect_left(order, key(self._entries[task_id])) for task_id in wanted}
+
+    def get_stats(self):
+        with self._cond:
+            depth = {priority: 0 for priority in PRIORITIES}
+            clients = {}
+            for priority, _, _, _, client in self._entries.values():
+                depth[priority] += 1
+                clients[client] = clients.get(client, 0) + 1
+            busiest = sorted(clients.items(), key=lambda item: -item[1])[:10]
+            return {
+                'queued': len(self._entries),
+                'by_priority': depth,
+                'clients': len(clients),
+                'top_clients': dict(busiest)
+            }
+
+
+def load_client_weights():
+    """Per-client fair-share weights from CLIENT_WEIGHTS ("client:weight,...")"""
+    weights = {}
+    for item in os.getenv('CLIENT_WEIGHTS', '').split(','):
+        if ':' in item:
+            client, weight = item.rsplit(':', 1)
+            weights[client.strip()] = max(0.01, float(weight))
+    return weights
+
+
+def task_language(task):
+    """Return the normalised language of a code task, or None"""
+    if task.get('type') != 'code':
+        return None
+    language = (task.get('payload') or {}).get('language', 'python')
+    return LANGUAGE_ALIASES.get(language)
+
+
+def load_pool_config():
+    """Read pool limits from the environment"""
+    cpus = os.cpu_count() or 1
+    max_workers = int(os.getenv('WORKER_CONCURRENCY', cpus * 2))
+    language_default = int(os.getenv('LANGUAGE_CONCURRENCY', cpus))
+    return {
+        'max_workers': max(1, max_workers),
+        'language_limits': {
+            'python': max(1, int(os.getenv('PYTHON_CONCURRENCY', language_default))),
+            'javascript': max(1, int(os.getenv('JAVASCRIPT_CONCURRENCY', language_default))),
+            'bash': max(1, int(os.getenv('BASH_CONCURRENCY', language_default)))
+        }
+    }
+
+
+class ExecutionPool:
+    """Fixed-size thread pool draining a task queue.
+
+    A thread that pulls a code task whose language is at its limit parks the
+    task in a per-language backlog and goes back to the queue, so a saturated
+    language never holds threads that could serve other task types. When a
+    language slot is released, the releasing thread picks up the next parked
+    task for that language itself.
+
+    Each backlog is a TaskQueue with the task queue's client weights: parked
+    tasks are ordered by priority and fair share like queued ones, with a
+    virtual time that only advances as parked tasks start, so a client that
+    floods one language cannot push other clients' tasks behind its own.
+    """
+
+    def __init__(self, task_queue, run_task, get_task, max_workers=4,
+                 language_limits=None, logger=None, on_error=None):
+        self.task_queue = task_queue
+        self.run_task = run_task
+        self.get_task = get_task
+        self.on_error = on_error  # (task_id, exception) for a task whose run_task raised
+        self.max_workers = max_workers
+        self.language_limits = dict(language_limits or {})
+        self.logger = logger
+        self._lock = threading.Lock()
+        self._active = {lang: 0 for lang in self.language_limits}
+        weights = getattr(task_queue, 'weights', None)
+        default_weight = getattr(task_queue, 'default_weight', 1.0)
+        self._backlog = {lang: TaskQueue(weights, default_weight) for lang in self.language_limits}
+        self._busy = 0
+        self._threads = []
+
+    def start(self):
+        """Start the worker threads"""
+        for i in range(self.max_workers):
+            thread = threading.Thread(
+                target=self._worker_loop,
+                name=f'task-worker-{i}',
+                daemon=True
+            )
+            thread.start()
+            self._threads.append(thread)
+        if self.logger:
+            self.logger.info(
+                f"Execution pool started with {self.max_workers} workers",
+                language_limits=self.language_limits
+            )
+
+    def _acquire(self, language, task):
+        """Take a language slot, or park the task if the language is saturated"""
+        with self._lock:
+            if self._active[language] < self.language_limits[language]:
+                self._active[language] += 1
+                return True
+            self._backlog[language].put(task['id'], task.get('client'), task.get('priority'))
+            return False
+
+    def _release(self, language):
+        """Hand the slot to the next parked task, or free it"""
+        with self._lock:
+            try:
+                return self._backlog[language].get(timeout=0)
+            except queue.Empty:
+                self._active[language] -= 1
+                return None
+
+    def positions(self, task_ids):
+        """0-based order of the given parked tasks among the tasks waiting for a
+        slot of the same language, as {task_id: position}"""
+        task_ids = list(task_ids)
+        found = {}
+        for backlog in self._backlog.values():
+            found.update(backlog.positions(task_ids))
+        return found
+
+    def _worker_loop(self):
+        while True:
+            task_id = None
+            try:
+                task_id = self.task_queue.get(timeout=1)
+                task = self.get_task(task_id)
+            except queue.Empty:
+                continue
+            except Exception as e:
+                # E.g. a locked shared-state database: keep the thread alive
+                if task_id is not None:
+                    self._task_error(task_id, e)
+                else:
+                    self._log_error(f"Task queue error: {e}")
+                    time.sleep(1)
+                continue
+            if task is None:
+                continue
+
+            language = task_language(task)
+            if language in self.language_limits and not self._acquire(language, task):
+                continue
+
+            while task_id is not None:
+                with self._lock:
+                    self._busy += 1
+                try:
+                    self.run_task(task_id)
+                except Exception as e:
+                    self._task_error(task_id, e)
+                finally:
+                    with self._lock:
+                        self._busy -= 1
+                task_id = self._release(language) if language in self.language_limits else None
+
+    def _task_error(self, task_id, error):
+        """A claimed task raised outside run_task's own handling: report it and mark it failed"""
+        self._log_error(f"Task {task_id} error: {error}")
+        if self.on_error is None:
+            return
+        try:
+            self.on_error(task_id, error)
+        except Exception as e:
+            self._log_error(f"Could not mark task {task_id} failed: {e}")
+
+    def _log_error(self, message):
+        if self.logger:
+            self.logger.error(message)
+
+    def get_stats(self):
+        """Current pool utilisation"""
+        with self._lock:
+            return {
+                'max_workers': self.max_workers,
+                'busy_workers': self._busy,
+                'languages': {
+                    lang: {
+                        'limit': self.language_limits[lang],
+                        'active': self._active[lang],
+                        'waiting': len(self._backlog[lang])
+                    }
+                    for lang in self.language_limits
+                }
+            }
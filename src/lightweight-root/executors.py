@@ -0,0 +1,590 @@
+#!/usr/bin/env python3
+"""
+Code executors - run code tasks on warm runner pools or cold subprocesses
+
+CodeExecutor blocks the calling thread; AsyncCodeExecutor does the same work
+on an asyncio event loop. Cold subprocesses receive their source through one
+of three delivery modes:
+  memfd     - an anonymous in-memory file passed as /dev/fd/N (Linux)
+  stdin     - the interpreter reads the program from a pipe
+  tempfile  - a NamedTemporaryFile on disk (portable fallback)
+"""
+import asyncio
+import os
+import selectors
+import signal
+import subprocess
+import tempfile
+import threading
+import time
+from collections import namedtuple
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+
+from output_capture import OutputCapture, OutputLimitExceeded
+from resource_usage import resource_usage
+from runner_pool import RunnerError
+
+READ_SIZE = 65536
+
+CODE_DELIVERY_MODES = ('memfd', 'stdin', 'tempfile')
+
+# The command a pooled task appears to run as: the runners present the code
+# under these script names (SCRIPT_NAME in python_runner.py and node_runner.js)
+POOLED_PYTHON_COMMAND = ['python3', '/tmp/task.py']
+POOLED_NODE_COMMAND = ['node', '/tmp/task.js']
+
+# How an interpreter should find the program: a path argument, extra fds to
+# inherit, and text to feed on stdin.
+CodeSource = namedtuple('CodeSource', ['path', 'pass_fds', 'input'])
+
+
+def default_delivery():
+    """Delivery mode from CODE_DELIVERY, preferring memfd where supported"""
+    mode = os.getenv('CODE_DELIVERY')
+    if mode in CODE_DELIVERY_MODES:
+        return mode
+    return 'memfd' if hasattr(os, 'memfd_create') else 'tempfile'
+
+
+@contextmanager
+def code_source(code, suffix, delivery):
+    """Make `code` available to a child process without touching disk if possible"""
+    if delivery == 'memfd':
+        try:
+            fd = os.memfd_create(f'task{suffix}', 0)
+        except (AttributeError, OSError):
+            delivery = 'tempfile'
+        else:
+            try:
+                data = code.encode()
+                while data:
+                    data = data[os.write(fd, data):]
+                yield CodeSource(f'/dev/fd/{fd}', (fd,), None)
+            finally:
+                os.close(fd)
+            return
+
+    if delivery == 'stdin':
+        yield CodeSource('-', (), code)
+        return
+
+    with tempfile.NamedTemporaryFile(mode='w', suffix=suffix, delete=False) as f:
+        f.write(code)
+        temp_file = f.name
+    try:
+        yield CodeSource(temp_file, (), None)
+    finally:
+        os.unlink(temp_file)
+
+
+class TaskCancelled(Exception):
+    """The task was cancelled while it was running"""
+
+
+class CancelToken:
+    """Cancellation signal for one running task.
+
+    Executors register callbacks that kill whatever is running the task;
+    `cancel()` may be called from any thread.
+    """
+
+    def __init__(self):
+        self._event = threading.Event()
+        self._lock = threading.Lock()
+        self._callbacks = []
+
+    @property
+    def cancelled(self):
+        return self._event.is_set()
+
+    def cancel(self):
+        with self._lock:
+            if self._event.is_set():
+                return
+            self._event.set()
+            callbacks = list(self._callbacks)
+        for callback in callbacks:
+            callback()
+
+    def on_cancel(self, callback):
+        """Call `callback` on cancellation (at once if already cancelled); returns an unregister function"""
+        with self._lock:
+            if not self._event.is_set():
+                self._callbacks.append(callback)
+                return lambda: self._unregister(callback)
+        callback()
+        return lambda: None
+
+    def _unregister(self, callback):
+        with self._lock:
+            if callback in self._callbacks:
+                self._callbacks.remove(callback)
+
+    def wait(self, timeout):
+        """Sleep up to `timeout` seconds; True if the task was cancelled meanwhile"""
+        return self._event.wait(timeout)
+
+
+def kill_process_group(proc):
+    """SIGKILL a child started with start_new_session=True and all its descendants"""
+    try:
+        os.killpg(proc.pid, signal.SIGKILL)
+    except OSError:
+        pass
+
+
+def runner_env(extra=None, input_data=None):
+    """Variables a task adds to its process environment"""
+    env = dict(extra or {})
+    if input_data:
+        env['INPUT_DATA'] = str(input_data)
+    return env
+
+
+def process_env(extra=None, input_data=None):
+    """Environment for a cold run (None inherits the worker's)"""
+    env = runner_env(extra, input_data)
+    if not env:
+        return None
+    return dict(os.environ, **env)
+
+
+def javascript_code(code, input_data):
+    if input_data:
+        code = f"const INPUT_DATA = {input_data};\n{code}"
+    return code
+
+
+def node_command(source):
+    command = ['node', source.path]
+    if source.pass_fds:
+        # Node resolves the main module's real path, which a memfd lacks
+        command.insert(1, '--preserve-symlinks-main')
+    return command
+
+
+def bash_script(code, input_data):
+    script = '#!/bin/bash\n'
+    if input_data:
+        script += f'INPUT_DATA="{input_data}"\n'
+    return script + code
+
+
+def bash_command(source):
+    if source.path == '-':
+        return ['/bin/bash', '-s']
+    if not source.pass_fds:
+        os.chmod(source.path, 0o755)
+    return ['/bin/bash', source.path]
+
+
+def completed_result(returncode, output, usage=None):
+    """Result shape shared by every executor"""
+    result = {
+        'stdout': output.text('stdout'),
+        'stderr': output.text('stderr'),
+        'returncode': returncode,
+        'success': returncode == 0
+    }
+    result.update(output.summary())
+    if usage is not None:
+        result['usage'] = usage
+    return result
+
+
+def error_result(error):
+    """Result of a run that failed, with the resources it used if they are known"""
+    result = {'error': str(error)}
+    if getattr(error, 'usage', None) is not None:
+        result['usage'] = error.usage
+    return result
+
+
+def reap(proc):
+    """proc.wait() that also returns the child's resource usage (None if unknown)"""
+    if proc.returncode is not None:
+        return proc.returncode, None
+    try:
+        _, status, rusage = os.wait4(proc.pid, 0)
+    except ChildProcessError:
+        return proc.wait(), None
+    proc.returncode = os.waitstatus_to_exitcode(status)
+    return proc.returncode, resource_usage(rusage)
+
+
+async def wait_process(proc):
+    """Async reap(): waits on a pidfd where the kernel has them, else on a thread"""
+    try:
+        pidfd = os.pidfd_open(proc.pid)
+    except (AttributeError, OSError):
+        return await asyncio.to_thread(reap, proc)
+    loop = asyncio.get_running_loop()
+    exited = loop.create_future()
+    loop.add_reader(pidfd, lambda: exited.done() or exited.set_result(None))
+    try:
+        await exited
+    finally:
+        loop.remove_reader(pidfd)
+        os.close(pidfd)
+    return reap(proc)
+
+
+def pump_process(proc, output, input_text=None, timeout=30):
+    """Feed stdin and copy the child's stdout/stderr into `output` as it arrives;
+    returns the exit code and resource usage"""
+    selector = selectors.DefaultSelector()
+    streams = {}
+    for stream in ('stdout', 'stderr'):
+        pipe = getattr(proc, stream)
+        streams[pipe.fileno()] = stream
+        selector.register(pipe.fileno(), selectors.EVENT_READ)
+
+    pending_input = memoryview(input_text.encode()) if input_text is not None else None
+    if pending_input is not None:
+        selector.register(proc.stdin.fileno(), selectors.EVENT_WRITE)
+
+    deadline = time.monotonic() + timeout
+    try:
+        while selector.get_map():
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                kill_process_group(proc)
+                error = subprocess.TimeoutExpired(proc.args, timeout)
+                _, error.usage = reap(proc)
+                raise error
+            for key, events in selector.select(remaining):
+                if events & selectors.EVENT_WRITE:
+                    try:
+                        written = os.write(key.fd, pending_input[:READ_SIZE])
+                    except BrokenPipeError:
+                        written = len(pending_input)
+                    pending_input = pending_input[written:]
+                    if not pending_input:
+                        selector.unregister(key.fd)
+                        proc.stdin.close()
+                    continue
+                data = os.read(key.fd, READ_SIZE)
+                if data:
+                    output.write(streams[key.fd], data)
+                else:
+                    selector.unregister(key.fd)
+    except OutputLimitExceeded as e:
+        kill_process_group(proc)
+        _, e.usage = reap(proc)
+        raise
+    finally:
+        selector.close()
+        for pipe in (proc.stdin, proc.stdout, proc.stderr):
+            if pipe is not None and not pipe.closed:
+                pipe.close()
+
+    return reap(proc)
+
+
+class CodeExecutor:
+    """Runs code tasks, preferring warm runner pools over cold subprocesses"""
+
+    def __init__(self, python_pool=None, node_pool=None, delivery=None, logger=None):
+        self.python_pool = python_pool
+        self.node_pool = node_pool
+        self.delivery = delivery or default_delivery()
+        self.logger = logger
+
+    def execute(self, language, code, input_data=None, output=None, timeout=30, cancel=None, env=None,
+                python=None):
+        """Execute code in specified language, streaming its output into `output`.
+
+        `env` adds variables to the process environment; `python` is the
+        interpreter for Python code (default: the warm pool or python3).
+        Raises TaskCancelled if `cancel` fires while the code is running.
+        """
+        if output is None:
+            output = OutputCapture()
+        try:
+            if language == 'python':
+                return self.execute_python(code, input_data, output, timeout, cancel, env, python)
+            elif language == 'javascript' or language == 'node':
+                return self.execute_javascript(code, input_data, output, timeout, cancel, env)
+            elif language == 'bash' or language == 'shell':
+                return self.execute_bash(code, input_data, output, timeout, cancel, env)
+            else:
+                return {'error': f'Unsupported language: {language}'}
+        except TaskCancelled:
+            raise
+        except OutputLimitExceeded as e:
+            result = completed_result(-signal.SIGKILL, output, getattr(e, 'usage', None))
+            result['error'] = str(e)
+            return result
+        except Exception as e:
+            return error_result(e)
+
+    def _fallback_or_raise(self, error, message):
+        """Allow a cold rerun only if the request never reached a runner.
+
+        Once delivered, the code may have had side effects before its runner
+        died (e.g. process.kill() or running out of heap), so running it again
+        could do them twice; the task fails instead.
+        """
+        if error.delivered:
+            raise error
+        if self.logger:
+            self.logger.warning(message)
+
+    def _run(self, command, source, output, env=None, timeout=30, cancel=None):
+        # Own session, so a timeout or cancellation can kill every descendant
+        proc = subprocess.Popen(
+            command,
+            stdin=subprocess.PIPE if source.input is not None else None,
+            stdout=subprocess.PIPE,
+            stderr=subprocess.PIPE,
+            pass_fds=source.pass_fds,
+            env=env,
+            start_new_session=True
+        )
+        unregister = cancel.on_cancel(lambda: kill_process_group(proc)) if cancel is not None else None
+        try:
+            returncode, usage = pump_process(proc, output, source.input, timeout)
+        finally:
+            if unregister is not None:
+                unregister()
+        if cancel is not None and cancel.cancelled:
+            raise TaskCancelled()
+        return completed_result(returncode, output, usage)
+
+    def execute_pooled(self, runner_pool, request, command, output, timeout=30, cancel=None):
+        """Execute code on a runner from a pool and shape the result like subprocess.run;
+        `command` is what the task reports in errors, as if it ran cold"""
+        on_event = lambda event: output.write(event['stream'], event['data'])
+        try:
+            response = runner_pool.run(dict(request, timeout=timeout), timeout, on_event, cancel)
+        except RunnerError:
+            if cancel is not None and cancel.cancelled:
+                raise TaskCancelled()
+            raise
+        if 'error' in response:
+            raise RunnerError(response['error'])
+        if response.get('timeout'):
+            error = subprocess.TimeoutExpired(command, timeout)
+            error.usage = response.get('usage')
+            raise error
+        return completed_result(response['returncode'], output, response.get('usage'))
+
+    def execute_python(self, code, input_data, output, timeout=30, cancel=None, env=None, python=None):
+        """Execute Python code"""
+        if self.python_pool is not None and python is None:
+            request = {'code': code, 'env': runner_env(env, input_data)}
+            try:
+                return self.execute_pooled(self.python_pool, request, POOLED_PYTHON_COMMAND, output,
+                                           timeout, cancel)
+            except RunnerError as e:
+                self._fallback_or_raise(e, f"Python pool unavailable, running cold: {e}")
+
+        with code_source(code, '.py', self.delivery) as source:
+            return self._run([python or 'python3', source.path], source, output,
+                             process_env(env, input_data), timeout, cancel)
+
+    def execute_javascript(self, code, input_data, output, timeout=30, cancel=None, env=None):
+        """Execute JavaScript code"""
+        code = javascript_code(code, input_data)
+
+        if self.node_pool is not None:
+            try:
+                return self.execute_pooled(self.node_pool, {'code': code, 'env': runner_env(env)},
+                                           POOLED_NODE_COMMAND, output, timeout, cancel)
+            except RunnerError as e:
+                self._fallback_or_raise(e, f"Node.js pool unavailable, running cold: {e}")
+
+        with code_source(code, '.js', self.delivery) as source:
+            try:
+                return self._run(node_command(source), source, output, process_env(env), timeout, cancel)
+            except FileNotFoundError:
+                return {'error': 'Node.js not installed'}
+
+    def execute_bash(self, code, input_data, output, timeout=30, cancel=None, env=None):
+        """Execute Bash script"""
+        with code_source(bash_script(code, input_data), '.sh', self.delivery) as source:
+            return self._run(bash_command(source), source, output, process_env(env), timeout, cancel)
+
+    def get_stats(self):
+        stats = {'code_delivery': self.delivery}
+        if self.python_pool is not None:
+            stats['python_pool'] = self.python_pool.get_stats()
+        if self.node_pool is not None:
+            stats['node_pool'] = self.node_pool.get_stats()
+        return stats
+
+
+class AsyncCodeExecutor:
+    """asyncio counterpart of CodeExecutor, used by the ASGI server.
+
+    Cold runs are subprocesses whose pipes are read by the event loop and that
+    are reaped through pidfds (with their resource usage), so thousands can be
+    in flight without a thread each. Pooled runs speak the blocking runner
+    protocol on a small thread pool sized to the runner pools. Cancelling the
+    awaiting task kills the subprocess group or the runner.
+    """
+
+    def __init__(self, python_pool=None, node_pool=None, delivery=None, logger=None):
+        self.sync = CodeExecutor(python_pool, node_pool, delivery, logger)
+        self.python_pool = python_pool
+        self.node_pool = node_pool
+        self.delivery = self.sync.delivery
+        self.logger = logger
+        pools = [pool for pool in (python_pool, node_pool) if pool is not None]
+        self._slots = {pool.name: asyncio.Semaphore(pool.size) for pool in pools}
+        self._threads = ThreadPoolExecutor(
+            max_workers=max(1, sum(pool.size for pool in pools)),
+            thread_name_prefix='runner-io'
+        )
+
+    async def execute(self, language, code, input_data=None, output=None, timeout=30, env=None, python=None):
+        """Execute code in specified language, streaming its output into `output`"""
+        if output is None:
+            output = OutputCapture()
+        try:
+            if language == 'python':
+                return await self.execute_python(code, input_data, output, timeout, env, python)
+            elif language == 'javascript' or language == 'node':
+                return await self.execute_javascript(code, input_data, output, timeout, env)
+            elif language == 'bash' or language == 'shell':
+                return await self.execute_bash(code, input_data, output, timeout, env)
+            else:
+                return {'error': f'Unsupported language: {language}'}
+        except OutputLimitExceeded as e:
+            result = completed_result(-signal.SIGKILL, output, getattr(e, 'usage', None))
+            result['error'] = str(e)
+            return result
+        except Exception as e:
+            return error_result(e)
+
+    async def _run(self, command, source, output, env=None, timeout=30):
+        # A plain Popen rather than an asyncio subprocess, so that we reap the
+        # child ourselves (wait4) and get its resource usage
+        proc = subprocess.Popen(
+            command,
+            stdin=subprocess.PIPE if source.input is not None else None,
+            stdout=subprocess.PIPE,
+            stderr=subprocess.PIPE,
+            pass_fds=source.pass_fds,
+            env=env,
+            start_new_session=True
+        )
+        try:
+            returncode, usage = await asyncio.wait_for(self._communicate(proc, output, source.input), timeout)
+        except asyncio.TimeoutError:
+            kill_process_group(proc)
+            error = subprocess.TimeoutExpired(command, timeout)
+            _, error.usage = await wait_process(proc)
+            raise error
+        except OutputLimitExceeded as e:
+            kill_process_group(proc)
+            _, e.usage = await wait_process(proc)
+            raise
+        except BaseException:
+            # Cancellation of the awaiting task
+            kill_process_group(proc)
+            await wait_process(proc)
+            raise
+        finally:
+            for pipe in (proc.stdin, proc.stdout, proc.stderr):
+                if pipe is not None and not pipe.closed:
+                    pipe.close()
+        return completed_result(returncode, output, usage)
+
+    async def _communicate(self, proc, output, input_text):
+        loop = asyncio.get_running_loop()
+
+        async def copy(pipe, stream):
+            reader = asyncio.StreamReader(limit=READ_SIZE)
+            transport, _ = await loop.connect_read_pipe(lambda: asyncio.StreamReaderProtocol(reader), pipe)
+            try:
+                while True:
+                    data = await reader.read(READ_SIZE)
+                    if not data:
+                        return
+                    output.write(stream, data)
+            finally:
+                transport.close()
+
+        async def feed():
+            transport, protocol = await loop.connect_write_pipe(
+                lambda: asyncio.StreamReaderProtocol(asyncio.StreamReader()), proc.stdin)
+            writer = asyncio.StreamWriter(transport, protocol, None, loop)
+            try:
+                writer.write(input_text.encode())
+                await writer.drain()
+            except (BrokenPipeError, ConnectionResetError):
+                pass
+            finally:
+                writer.close()
+
+        jobs = [copy(proc.stdout, 'stdout'), copy(proc.stderr, 'stderr')]
+        if input_text is not None:
+            jobs.append(feed())
+        jobs = [asyncio.ensure_future(job) for job in jobs]
+        try:
+            await asyncio.gather(*jobs)
+        finally:
+            # On an output limit the other copies are still reading; stop them
+            # so their transports let go of the pipes before _run closes them
+            for job in jobs:
+                job.cancel()
+            await asyncio.gather(*jobs, return_exceptions=True)
+        return await wait_process(proc)
+
+    async def execute_pooled(self, runner_pool, request, command, output, timeout=30):
+        """Run on a pooled runner without blocking the event loop"""
+        cancel = CancelToken()
+        async with self._slots[runner_pool.name]:
+            future = asyncio.get_running_loop().run_in_executor(
+                self._threads, self.sync.execute_pooled, runner_pool, request, command, output, timeout, cancel
+            )
+            try:
+                return await asyncio.shield(future)
+            except asyncio.CancelledError:
+                cancel.cancel()
+                try:
+                    await future
+                except Exception:
+                    pass
+                raise
+
+    async def execute_python(self, code, input_data, output, timeout=30, env=None, python=None):
+        """Execute Python code"""
+        if self.python_pool is not None and python is None:
+            request = {'code': code, 'env': runner_env(env, input_data)}
+            try:
+                return await self.execute_pooled(self.python_pool, request, POOLED_PYTHON_COMMAND, output,
+                                                 timeout)
+            except RunnerError as e:
+                self.sync._fallback_or_raise(e, f"Python pool unavailable, running cold: {e}")
+
+        with code_source(code, '.py', self.delivery) as source:
+            return await self._run([python or 'python3', source.path], source, output,
+                                   process_env(env, input_data), timeout)
+
+    async def execute_javascript(self, code, input_data, output, timeout=30, env=None):
+        """Execute JavaScript code"""
+        code = javascript_code(code, input_data)
+
+        if self.node_pool is not None:
+            try:
+                return await self.execute_pooled(self.node_pool, {'code': code, 'env': runner_env(env)},
+                                                 POOLED_NODE_COMMAND, output, timeout)
+            except RunnerError as e:
+                self.sync._fallback_or_raise(e, f"Node.js pool unavailable, running cold: {e}")
+
+        with code_source(code, '.js', self.delivery) as source:
+            try:
+                return await self._run(node_command(source), source, output, process_env(env), timeout)
+            except FileNotFoundError:
+                return {'error': 'Node.js not installed'}
+
+    async def execute_bash(self, code, input_data, output, timeout=30, env=None):
+        """Execute Bash script"""
+        with code_source(bash_script(code, input_data), '.sh', self.delivery) as source:
+            return await self._run(bash_command(source), source, output, process_env(env), timeout)
+
+    def get_stats(self):
+        return self.sync.get_stats()
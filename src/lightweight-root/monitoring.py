@@ -3,131 +3,394 @@
 Enhanced Monitoring Module - Tracks Main Process + Child Processes
 Version 2.2 - Improved to capture all resource usage including subprocesses
 """
+import atexit
+import json
+import random
+import sys
 import time
 import psutil
 import os
+import threading
 from datetime import datetime
 from collections import deque
+from timeseries import MetricHistory, RESOLUTIONS
+from cgroup import cgroup_from_env
+
+METRICS = ('cpu_percent', 'memory_mb', 'threads', 'child_processes')
+COUNTS = ('threads', 'child_processes')
+
+def mb(value):
+    """Bytes -> MB rounded to 2 places; None stays None (no limit, not reported)"""
+    return round(value / 1024 / 1024, 2) if value is not None else None
 
 class Monitor:
-    """Monitor main process and all child processes"""
-    def __init__(self, max_history=100):
+    """Monitor main process and all child processes.
+
+    A background thread samples once per interval. In a cgroup v2 container the
+    sample is the cgroup's own totals (a few file reads, exact for the whole
+    container); elsewhere every process is walked with psutil. CPU usage is the
+    delta of CPU time since the previous sample, so nothing sleeps while
+    sampling. Readers get the latest snapshot without sampling.
+    """
+    def __init__(self, max_history=2880, interval=None, logger=None, cgroup=None):
         self.max_history = max_history
-        self.metrics_history = deque(maxlen=max_history)
+        self.metrics_history = MetricHistory(METRICS, capacity=max_history)
+        self.interval = interval if interval is not None else float(os.getenv('METRICS_INTERVAL', 10))
+        self.logger = logger
         self.start_time = time.time()
         self.process = psutil.Process(os.getpid())
+        self.cgroup = cgroup if cgroup is not None else cgroup_from_env()
+        self._cgroup_cpu = None  # (time, cpu.stat usage_usec) at the previous sample
+        self._processes = {}  # pid -> psutil.Process, kept so CPU deltas survive between samples
+        self._cpu_times = {}  # pid -> CPU seconds at the previous sample
+        self._sampled_at = None
+        self._latest = None
+        self._summary = {}
+        self._lock = threading.Lock()
+        self._thread = None
+    
+    def start(self):
+        """Sample in a daemon thread every `interval` seconds"""
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._run, daemon=True, name='metrics-sampler')
+            self._thread.start()
+    
+    def _run(self):
+        while True:
+            self.collect_metrics()
+            time.sleep(self.interval)
     
     def get_all_processes(self):
         """Get main process and all children"""
         processes = [self.process]
         try:
             children = self.process.children(recursive=True)
-            processes.extend(children)
         except psutil.NoSuchProcess:
-            pass
+            children = []
+        for child in children:
+            # Reuse the Process object of a known pid (unless the pid was recycled)
+            known = self._processes.get(child.pid)
+            processes.append(known if known is not None and known == child else child)
         return processes
     
     def collect_metrics(self):
-        """Collect metrics from all processes (main + children)"""
+        """Take one sample of the container or of all processes (main + children) and record it"""
         try:
-            processes = self.get_all_processes()
-            
-            # DEBUG: Log process count
-            print(f"[MONITOR DEBUG] Found {len(processes)} total processes (1 main + {len(processes)-1} children)", flush=True)
-            
-            # Aggregate metrics from all processes
-            total_cpu = 0
-            total_memory = 0
-            total_threads = 0
-            child_count = len(processes) - 1
-            
-            proc_details = []
-            
-            for proc in processes:
+            now = time.time()
+            metrics = None
+            if self.cgroup is not None:
                 try:
-                    cpu = proc.cpu_percent(interval=0.1)
+                    metrics = self._cgroup_metrics(now)
+                except (OSError, ValueError) as e:
+                    if self.logger:
+                        self.logger.warning(f"cgroup {self.cgroup.path} unreadable, falling back to psutil: {e}")
+                    self.cgroup = None
+            if metrics is None:
+                metrics = self._process_metrics(now)
+            metrics['uptime_seconds'] = int(now - self.start_time)
+        except Exception as e:
+            if self.logger:
+                self.logger.error(f"collect_metrics failed: {e}")
+            return {'error': str(e)}
+        
+        with self._lock:
+            self.metrics_history.add(now, {name: metrics[name] for name in METRICS})
+            self._latest = metrics
+            self._summary = self._summarize()
+        return metrics
+    
+    def _cgroup_metrics(self, now):
+        """Container totals from the cgroup's counters"""
+        stats = self.cgroup.read()
+        usage = stats['cpu_usage_usec']
+        if self._cgroup_cpu is None:
+            cpu = 0.0  # no earlier reading to take the delta from
+        else:
+            since, previous = self._cgroup_cpu
+            cpu = max(0.0, (usage - previous) / 1e6 / max(now - since, 1e-3) * 100)
+        self._cgroup_cpu = (now, usage)
+        io = stats['io']
+        
+        return {
+            'timestamp': datetime.utcnow().isoformat(),
+            'source': 'cgroup',
+            'cpu_percent': round(cpu, 2),
+            'memory_mb': mb(stats['memory_working_set']),
+            'threads': stats['tasks'] or 0,
+            'child_processes': max(0, (stats['processes'] or 1) - 1),
+            'process_details': [],
+            'cgroup': {
+                'path': self.cgroup.path,
+                'memory_current_mb': mb(stats['memory_current']),
+                'memory_peak_mb': mb(stats['memory_peak']),
+                'memory_limit_mb': mb(stats['memory_max']),
+                'cpu_throttled_seconds': round(stats['cpu_throttled_usec'] / 1e6, 3),
+                'io_read_bytes': io['rbytes'],
+                'io_write_bytes': io['wbytes'],
+                'io_read_ops': io['rios'],
+                'io_write_ops': io['wios']
+            }
+        }
+    
+    def _process_metrics(self, now):
+        """Totals of this process and its children, one psutil query per process"""
+        processes = self.get_all_processes()
+        since = self._sampled_at
+        
+        # Aggregate metrics from all processes
+        total_cpu = 0
+        total_memory = 0
+        total_threads = 0
+        child_count = len(processes) - 1
+        
+        proc_details = []
+        cpu_times = {}
+        live = {}
+        
+        for proc in processes:
+            try:
+                with proc.oneshot():
+                    times = proc.cpu_times()
                     memory = proc.memory_info().rss / 1024 / 1024
                     threads = proc.num_threads()
-                    
-                    # DEBUG: Log each process
-                    print(f"[MONITOR DEBUG] PID {proc.pid}: CPU={cpu:.2f}%, Memory={memory:.2f}MB, Threads={threads}", flush=True)
-                    
-                    total_cpu += cpu
-                    total_memory += memory
-                    total_threads += threads
-                    
-                    proc_details.append({
-                        'pid': proc.pid,
-                        'parent_pid': proc.ppid(),
-                        'cpu_percent': round(cpu, 2),
-                        'memory_mb': round(memory, 2),
-                        'threads': threads
-                    })
-                except (psutil.NoSuchProcess, psutil.AccessDenied) as e:
-                    print(f"[MONITOR DEBUG] Error accessing process: {e}", flush=True)
+                    parent_pid = proc.ppid()
+                    created = proc.create_time()
+            except (psutil.NoSuchProcess, psutil.AccessDenied, psutil.ZombieProcess):
+                continue
             
-            # DEBUG: Log aggregated metrics
-            print(f"[MONITOR DEBUG] Total: CPU={total_cpu:.2f}%, Memory={total_memory:.2f}MB, Children={child_count}", flush=True)
+            used = times.user + times.system
+            previous = self._cpu_times.get(proc.pid)
+            if previous is None:
+                # New since the last sample: all its CPU time falls in this interval
+                previous, start = 0.0, max(created, since or created)
+            else:
+                start = since
+            cpu = max(0.0, (used - previous) / max(now - start, 1e-3) * 100)
+            cpu_times[proc.pid] = used
+            live[proc.pid] = proc
             
-            metrics = {
-                'timestamp': datetime.utcnow().isoformat(),
-                'cpu_percent': round(total_cpu, 2),
-                'memory_mb': round(total_memory, 2),
-                'threads': total_threads,
-                'child_processes': child_count,
-                'process_details': proc_details[:10],  # Limit to top 10
-                'uptime_seconds': int(time.time() - self.start_time)
-            }
+            total_cpu += cpu
+            total_memory += memory
+            total_threads += threads
             
-            self.metrics_history.append(metrics)
-            return metrics
-        except Exception as e:
-            print(f"[MONITOR ERROR] collect_metrics failed: {e}", flush=True)
-            return {'error': str(e)}
+            proc_details.append({
+                'pid': proc.pid,
+                'parent_pid': parent_pid,
+                'cpu_percent': round(cpu, 2),
+                'memory_mb': round(memory, 2),
+                'threads': threads
+            })
+        
+        self._cpu_times, self._processes, self._sampled_at = cpu_times, live, now
+        proc_details.sort(key=lambda detail: detail['cpu_percent'], reverse=True)
+        
+        return {
+            'timestamp': datetime.utcnow().isoformat(),
+            'source': 'psutil',
+            'cpu_percent': round(total_cpu, 2),
+            'memory_mb': round(total_memory, 2),
+            'threads': total_threads,
+            'child_processes': child_count,
+            'process_details': proc_details[:10]  # Limit to top 10
+        }
     
     def get_metrics(self):
-        """Get current metrics"""
-        return self.collect_metrics()
+        """Get the latest sample (taken now if there is none yet)"""
+        latest = self._latest
+        if latest is None:
+            return self.collect_metrics()
+        return latest
     
-    def get_history(self, limit=None):
-        """Get metrics history"""
-        if limit:
-            return list(self.metrics_history)[-limit:]
-        return list(self.metrics_history)
+    def get_history(self, limit=None, resolution=None):
+        """Get metrics history: raw samples, or '1s'/'1m'/'1h' rollups with avg/min/max.
+
+        Raises ValueError for an unknown resolution.
+        """
+        if resolution in (None, 'raw'):
+            with self._lock:
+                points = self.metrics_history.points(limit=limit)
+            return [
+                {'timestamp': datetime.utcfromtimestamp(timestamp).isoformat(),
+                 **{name: int(value) if name in COUNTS else round(value, 2) for name, value in values.items()}}
+                for timestamp, values in points
+            ]
+        if resolution not in RESOLUTIONS:
+            raise ValueError(f"resolution must be one of {['raw'] + list(RESOLUTIONS)}")
+        with self._lock:
+            points = self.metrics_history.points(RESOLUTIONS[resolution], limit)
+        return [
+            {'timestamp': datetime.utcfromtimestamp(timestamp).isoformat(), 'samples': count,
+             **{name: {'avg': round(mean, 2), 'min': round(low, 2), 'max': round(high, 2)}
+                for name, (mean, low, high) in stats.items()}}
+            for timestamp, count, stats in points
+        ]
     
     def get_summary(self):
         """Get metrics summary"""
-        if not self.metrics_history:
+        summary = self._summary
+        if not summary:
             return {}
-        
-        cpu_values = [m['cpu_percent'] for m in self.metrics_history if 'cpu_percent' in m]
-        mem_values = [m['memory_mb'] for m in self.metrics_history if 'memory_mb' in m]
-        child_counts = [m['child_processes'] for m in self.metrics_history if 'child_processes' in m]
+        return {'uptime_seconds': int(time.time() - self.start_time), **summary}
+    
+    def _summarize(self):
+        """Summary of the retained samples from the history's running aggregates (call with _lock held)"""
+        cpu, cpu_avg, cpu_max = self.metrics_history.summary('cpu_percent')
+        memory, memory_avg, memory_max = self.metrics_history.summary('memory_mb')
+        children, _, children_max = self.metrics_history.summary('child_processes')
         
         return {
-            'uptime_seconds': int(time.time() - self.start_time),
             'cpu': {
-                'current': cpu_values[-1] if cpu_values else 0,
-                'avg': round(sum(cpu_values) / len(cpu_values), 2) if cpu_values else 0,
-                'max': max(cpu_values) if cpu_values else 0
+                'current': round(cpu, 2),
+                'avg': round(cpu_avg, 2),
+                'max': round(cpu_max, 2)
             },
             'memory': {
-                'current_mb': mem_values[-1] if mem_values else 0,
-                'avg_mb': round(sum(mem_values) / len(mem_values), 2) if mem_values else 0,
-                'max_mb': max(mem_values) if mem_values else 0
+                'current_mb': round(memory, 2),
+                'avg_mb': round(memory_avg, 2),
+                'max_mb': round(memory_max, 2)
             },
             'child_processes': {
-                'current': child_counts[-1] if child_counts else 0,
-                'max': max(child_counts) if child_counts else 0
+                'current': int(children),
+                'max': int(children_max)
             },
-            'samples': len(self.metrics_history)
+            'samples': len(self.metrics_history),
+            'history_bytes': self.metrics_history.nbytes
         }
 
+class LogSink:
+    """Background writer of log entries as batched lines.
+
+    `emit` only appends to a bounded deque (atomic under the GIL, no lock);
+    a writer thread drains it every `flush_interval` seconds and writes each
+    batch with one write+flush, to stdout or to a size-rotated file. Entries
+    arriving while the buffer is full are dropped and counted.
+    """
+    def __init__(self, path=None, max_buffer=10000, flush_interval=0.2, fmt='json',
+                 sample_rates=None, max_bytes=50 * 1024 * 1024, backups=3):
+        self.path = path
+        self.max_buffer = max_buffer
+        self.flush_interval = flush_interval
+        self.fmt = fmt
+        self.sample_rates = sample_rates or {}  # level -> fraction of entries written
+        self.max_bytes = max_bytes
+        self.backups = backups
+        self._buffer = deque()
+        self._stats = {'written': 0, 'dropped': 0, 'sampled_out': 0, 'write_errors': 0}
+        self._file = None
+        self._thread = None
+        self._pid = None
+        self._start_lock = threading.Lock()
+        self._write_lock = threading.Lock()
+    
+    def emit(self, entry):
+        """Queue an entry for writing; never blocks"""
+        rate = self.sample_rates.get(entry['level'])
+        if rate is not None and random.random() >= rate:
+            self._stats['sampled_out'] += 1
+            return
+        if len(self._buffer) >= self.max_buffer:
+            self._stats['dropped'] += 1
+            return
+        self._buffer.append(entry)
+        if self._pid != os.getpid():  # first entry in this process (or after a fork)
+            self._start()
+    
+    def _start(self):
+        with self._start_lock:
+            if self._pid == os.getpid():
+                return
+            self._pid = os.getpid()
+            self._thread = threading.Thread(target=self._run, daemon=True, name='log-writer')
+            self._thread.start()
+            atexit.register(self.flush)
+    
+    def _run(self):
+        while True:
+            time.sleep(self.flush_interval)
+            self.flush()
+    
+    def flush(self):
+        """Write everything queued so far"""
+        with self._write_lock:
+            lines = []
+            try:
+                while True:
+                    lines.append(self._format(self._buffer.popleft()))
+            except IndexError:
+                pass
+            if not lines:
+                return
+            data = '\n'.join(lines) + '\n'
+            try:
+                if self.path:
+                    self._write_file(data)
+                else:
+                    sys.stdout.write(data)
+                    sys.stdout.flush()
+                self._stats['written'] += len(lines)
+            except (OSError, ValueError):
+                self._stats['write_errors'] += 1
+    
+    def _format(self, entry):
+        if self.fmt == 'text':
+            return f"[{entry['level']}] {entry['message']}"
+        return json.dumps(entry, default=str)
+    
+    def _write_file(self, data):
+        if self._file is None:
+            self._file = open(self.path, 'a', encoding='utf-8')
+        self._file.write(data)
+        self._file.flush()
+        if self._file.tell() >= self.max_bytes:
+            self._rotate()
+    
+    def _rotate(self):
+        """path -> path.1 -> ... -> path.<backups>"""
+        self._file.close()
+        self._file = None
+        for index in range(self.backups - 1, 0, -1):
+            if os.path.exists(f'{self.path}.{index}'):
+                os.replace(f'{self.path}.{index}', f'{self.path}.{index + 1}')
+        if self.backups > 0:
+            os.replace(self.path, f'{self.path}.1')
+        else:
+            os.remove(self.path)
+    
+    def get_stats(self):
+        return dict(self._stats, buffered=len(self._buffer), output=self.path or 'stdout')
+
+
+def parse_sample_rates(spec):
+    """'INFO=0.1,WARNING=0.5' -> {'INFO': 0.1, 'WARNING': 0.5}"""
+    rates = {}
+    for part in spec.split(','):
+        level, _, rate = part.partition('=')
+        try:
+            rates[level.strip().upper()] = min(1.0, max(0.0, float(rate)))
+        except ValueError:
+            continue
+    return rates
+
+
+def log_sink_from_env():
+    """Build the log sink from LOG_* settings"""
+    return LogSink(
+        path=os.getenv('LOG_FILE') or None,
+        max_buffer=int(os.getenv('LOG_BUFFER', 10000)),
+        flush_interval=float(os.getenv('LOG_FLUSH_INTERVAL', 0.2)),
+        fmt=os.getenv('LOG_FORMAT', 'json'),
+        sample_rates=parse_sample_rates(os.getenv('LOG_SAMPLING', '')),
+        max_bytes=int(float(os.getenv('LOG_MAX_MB', 50)) * 1024 * 1024),
+        backups=int(os.getenv('LOG_BACKUPS', 3))
+    )
+
+
 class Logger:
-    """Simple structured logger"""
-    def __init__(self, name='app'):
+    """Simple structured logger; entries go to /logs and, batched, to a LogSink"""
+    def __init__(self, name='app', sink=None):
         self.name = name
         self.logs = deque(maxlen=1000)
+        self.sink = sink if sink is not None else log_sink_from_env()
     
     def log(self, level, message, **kwargs):
         """Log a message"""
@@ -139,7 +402,7 @@ class Logger:
             **kwargs
         }
         self.logs.append(log_entry)
-        print(f"[{level}] {message}", flush=True)
+        self.sink.emit(log_entry)
         return log_entry
     
     def info(self, message, **kwargs):
@@ -157,3 +420,6 @@ class Logger:
         if level:
             logs = [l for l in logs if l['level'] == level]
         return logs[-limit:]
+    
+    def get_stats(self):
+        return self.sink.get_stats()
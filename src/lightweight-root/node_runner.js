@@ -0,0 +1,340 @@
+#!/usr/bin/env node
+/*
+ * Persistent Node.js runner used by the worker's JavaScript pool.
+ *
+ * Reads one JSON request per line on stdin. Output is forwarded on stdout as
+ * `{"event": "output", ...}` lines while the submission runs, followed by one
+ * JSON result line. Each submission runs in a fresh `vm` context with its own console,
+ * process.stdout/stderr and timers, so the ~40 ms Node startup is paid once per
+ * runner instead of once per task.
+ */
+'use strict';
+
+const fs = require('fs');
+const Module = require('module');
+const net = require('net');
+const readline = require('readline');
+const util = require('util');
+const vm = require('vm');
+
+const SCRIPT_NAME = '/tmp/task.js';
+
+// Node globals that are not part of a bare vm context
+const NODE_GLOBALS = [
+  'Buffer', 'URL', 'URLSearchParams', 'TextEncoder', 'TextDecoder',
+  'AbortController', 'AbortSignal', 'EventTarget', 'Event', 'queueMicrotask',
+  'structuredClone', 'atob', 'btoa', 'fetch', 'Headers', 'Request', 'Response',
+  'FormData', 'Blob', 'performance', 'crypto'
+];
+
+class ExitSignal {
+  constructor(code) {
+    this.code = code === undefined ? 0 : Number(code) || 0;
+  }
+}
+
+// Drop the runner's own frames so traces look like a plain `node task.js` run
+function taskStack(err) {
+  return err.stack
+    .split('\n')
+    .filter((line) => !line.includes(__filename) && !line.includes('node:vm'))
+    .join('\n');
+}
+
+const SLEEP = new Int32Array(new SharedArrayBuffer(4));
+
+// The protocol channel, moved off fds 0/1 by main()
+let protoIn = 0;
+let protoOut = 1;
+
+// Protocol writes are synchronous so output from a busy synchronous loop is
+// delivered (and back-pressured) immediately instead of piling up in memory.
+function send(message) {
+  const buffer = Buffer.from(`${JSON.stringify(message)}\n`);
+  let offset = 0;
+  while (offset < buffer.length) {
+    try {
+      offset += fs.writeSync(protoOut, buffer, offset);
+    } catch (err) {
+      if (err.code !== 'EAGAIN') {
+        throw err;
+      }
+      Atomics.wait(SLEEP, 0, 0, 1);
+    }
+  }
+}
+
+class TaskState {
+  constructor() {
+    this.exitCode = null;
+    this.finished = false;
+    this.timers = new Map();
+    this.process = null;
+  }
+
+  fail(err) {
+    if (this.finished) {
+      return;
+    }
+    if (err instanceof ExitSignal) {
+      this.exitCode = err.code;
+    } else {
+      const text = err && err.stack ? taskStack(err) : `Uncaught ${util.inspect(err)}`;
+      this.emit('stderr', `${text}\n`);
+      this.exitCode = 1;
+    }
+    this.finished = true;
+  }
+
+  emit(stream, data) {
+    if (!this.finished && data) {
+      send({ event: 'output', stream, data });
+    }
+  }
+
+  clearTimers() {
+    for (const [handle, clear] of this.timers) {
+      clear(handle);
+    }
+    this.timers.clear();
+  }
+}
+
+let current = null;
+
+process.on('uncaughtException', (err) => {
+  if (current) {
+    current.fail(err);
+  } else {
+    process.stderr.write(`node runner: ${err && err.stack}\n`);
+    process.exit(1);
+  }
+});
+
+process.on('unhandledRejection', (reason) => {
+  if (current) {
+    current.fail(reason);
+  }
+});
+
+function makeStream(task, stream) {
+  return {
+    isTTY: false,
+    write(chunk, encoding, callback) {
+      task.emit(stream, typeof chunk === 'string' ? chunk : Buffer.from(chunk).toString());
+      if (typeof encoding === 'function') {
+        encoding();
+      } else if (typeof callback === 'function') {
+        callback();
+      }
+      return true;
+    }
+  };
+}
+
+function makeConsole(task) {
+  const out = (...args) => { task.emit('stdout', `${util.format(...args)}\n`); };
+  const err = (...args) => { task.emit('stderr', `${util.format(...args)}\n`); };
+  return {
+    log: out,
+    info: out,
+    debug: out,
+    dir: (obj, options) => { task.emit('stdout', `${util.inspect(obj, options)}\n`); },
+    table: out,
+    error: err,
+    warn: err,
+    trace: (...args) => { err(`Trace: ${util.format(...args)}\n${new Error().stack}`); },
+    assert: (value, ...args) => {
+      if (!value) {
+        err(`Assertion failed${args.length ? `: ${util.format(...args)}` : ''}`);
+      }
+    },
+    time: () => {},
+    timeEnd: () => {},
+    group: () => {},
+    groupEnd: () => {}
+  };
+}
+
+function wrapTimer(task, schedule, clear, repeat) {
+  return (fn, ...args) => {
+    const handle = schedule((...cbArgs) => {
+      if (!repeat) {
+        task.timers.delete(handle);
+      }
+      if (task.finished) {
+        return;
+      }
+      try {
+        fn(...cbArgs);
+      } catch (err) {
+        task.fail(err);
+      }
+    }, ...args);
+    task.timers.set(handle, clear);
+    return handle;
+  };
+}
+
+function buildContext(task, request) {
+  const sandboxProcess = Object.create(process, {
+    stdout: { value: makeStream(task, 'stdout') },
+    stderr: { value: makeStream(task, 'stderr') },
+    argv: { value: [process.execPath, SCRIPT_NAME] },
+    env: { value: { ...process.env, ...(request.env || {}) } },
+    exitCode: { value: undefined, writable: true },
+    exit: { value: (code) => { throw new ExitSignal(code === undefined ? sandboxProcess.exitCode : code); } }
+  });
+
+  task.process = sandboxProcess;
+
+  const untrack = (clear) => (handle) => {
+    task.timers.delete(handle);
+    clear(handle);
+  };
+
+  const sandbox = {
+    console: makeConsole(task),
+    process: sandboxProcess,
+    require: Module.createRequire(SCRIPT_NAME),
+    module: { exports: {} },
+    __filename: SCRIPT_NAME,
+    __dirname: '/tmp',
+    setTimeout: wrapTimer(task, setTimeout, clearTimeout, false),
+    setInterval: wrapTimer(task, setInterval, clearInterval, true),
+    setImmediate: wrapTimer(task, setImmediate, clearImmediate, false),
+    clearTimeout: untrack(clearTimeout),
+    clearInterval: untrack(clearInterval),
+    clearImmediate: untrack(clearImmediate)
+  };
+  sandbox.exports = sandbox.module.exports;
+  for (const name of NODE_GLOBALS) {
+    if (name in globalThis) {
+      sandbox[name] = globalThis[name];
+    }
+  }
+  sandbox.global = sandbox;
+  return vm.createContext(sandbox);
+}
+
+// What the submission used, in the shape the worker gets from wait4(). All
+// submissions share the runner's heap, so a peak RSS is only reported when
+// this one raised the runner's peak; otherwise max_rss_kb is left out.
+function taskUsage(before, after) {
+  return {
+    cpu_user_seconds: (after.userCPUTime - before.userCPUTime) / 1e6,
+    cpu_system_seconds: (after.systemCPUTime - before.systemCPUTime) / 1e6,
+    max_rss_kb: after.maxRSS > before.maxRSS ? after.maxRSS : undefined,
+    block_reads: after.fsRead - before.fsRead,
+    block_writes: after.fsWrite - before.fsWrite,
+    voluntary_context_switches: after.voluntaryContextSwitches - before.voluntaryContextSwitches,
+    involuntary_context_switches: after.involuntaryContextSwitches - before.involuntaryContextSwitches
+  };
+}
+
+function tick(delay) {
+  return new Promise((resolve) => {
+    if (delay > 0) {
+      setTimeout(resolve, delay);
+    } else {
+      setImmediate(resolve);
+    }
+  });
+}
+
+async function runTask(request) {
+  const timeoutMs = Math.max(1, Math.round((request.timeout || 30) * 1000));
+  const deadline = Date.now() + timeoutMs;
+  const task = new TaskState();
+  const baseline = process.getActiveResourcesInfo().length;
+  const usageBefore = process.resourceUsage();
+  let timedOut = false;
+
+  current = task;
+  try {
+    const context = buildContext(task, request);
+    const script = new vm.Script(request.code || '', { filename: SCRIPT_NAME });
+    script.runInContext(context, { timeout: timeoutMs, displayErrors: false });
+  } catch (err) {
+    if (err && err.code === 'ERR_SCRIPT_EXECUTION_TIMEOUT') {
+      timedOut = true;
+    } else {
+      task.fail(err);
+    }
+  }
+
+  // Wait for timers, I/O and promises started by the submission to settle.
+  let delay = 0;
+  while (!task.finished && !timedOut) {
+    await tick(delay);
+    if (task.timers.size === 0 && process.getActiveResourcesInfo().length <= baseline) {
+      break;
+    }
+    if (Date.now() >= deadline) {
+      timedOut = true;
+    }
+    delay = Math.min(delay + 1, 10);
+  }
+
+  task.finished = true;
+  task.clearTimers();
+  current = null;
+
+  const exitCode = task.exitCode !== null ? task.exitCode : Number(task.process && task.process.exitCode) || 0;
+  const response = {
+    returncode: exitCode,
+    rss_mb: Math.round(process.memoryUsage().rss / 1024 / 1024),
+    usage: taskUsage(usageBefore, process.resourceUsage())
+  };
+  if (timedOut) {
+    // Anything still pending belongs to a dead submission; start fresh.
+    response.timeout = true;
+    response.recycle = true;
+  }
+  return response;
+}
+
+// Keep the protocol channel off fds 0/1 so nothing a submission writes there
+// (fs.writeSync(1, ...), children spawned with stdio: 'inherit') can corrupt
+// it. Node has no dup(), so the pipes are reopened through /dev/fd and fds 0/1
+// are then closed and reopened on /dev/null, which takes the lowest free fds.
+function moveProtocolFds() {
+  protoIn = fs.openSync('/dev/fd/0', fs.constants.O_RDONLY);
+  protoOut = fs.openSync('/dev/fd/1', fs.constants.O_WRONLY);
+  fs.closeSync(0);
+  fs.closeSync(1);
+  const stdin = fs.openSync('/dev/null', fs.constants.O_RDONLY);
+  const stdout = fs.openSync('/dev/null', fs.constants.O_WRONLY);
+  if (stdin !== 0 || stdout !== 1) {
+    throw new Error(`could not reopen stdio on /dev/null (got fds ${stdin}, ${stdout})`);
+  }
+}
+
+function main() {
+  moveProtocolFds();
+
+  // stdio handles are created lazily and would show up as new active
+  // resources mid-task; make sure they exist before the first baseline.
+  void process.stderr;
+
+  const input = new net.Socket({ fd: protoIn, readable: true, writable: false });
+  const rl = readline.createInterface({ input, terminal: false });
+  let chain = Promise.resolve();
+
+  rl.on('line', (line) => {
+    chain = chain.then(async () => {
+      let response;
+      try {
+        response = await runTask(JSON.parse(line));
+      } catch (err) {
+        response = { error: String(err && err.message ? err.message : err) };
+      }
+      send(response);
+    });
+  });
+  rl.on('close', () => {
+    chain.then(() => process.exit(0));
+  });
+}
+
+main();
@@ -0,0 +1,306 @@
+#!/usr/bin/env python3
+"""
+Output capture - incrementally collected stdout/stderr of a running task
+
+Executors append output as it arrives from the child's pipes; readers can take
+snapshots of the output so far or follow it live until the task finishes.
+
+Memory use is bounded per stream: small outputs are kept whole, larger ones
+keep only a head and a tail in memory while the full output is spilled to a
+file that can be read back by offset. A per-task limit stops runaway output.
+"""
+import asyncio
+import codecs
+import os
+import tempfile
+import threading
+
+STREAMS = ('stdout', 'stderr')
+READ_SIZE = 65536
+
+
+class OutputLimitExceeded(Exception):
+    """A task produced more output than it is allowed to"""
+
+
+def load_output_config():
+    """Read output limits from the environment"""
+    return {
+        'head_bytes': int(os.getenv('OUTPUT_HEAD_BYTES', 32 * 1024)),
+        'tail_bytes': int(os.getenv('OUTPUT_TAIL_BYTES', 32 * 1024)),
+        'max_bytes': int(os.getenv('OUTPUT_MAX_BYTES', 64 * 1024 * 1024)),
+        'spill_dir': os.getenv('OUTPUT_SPILL_DIR', os.path.join(tempfile.gettempdir(), 'worker-output'))
+    }
+
+
+class StreamBuffer:
+    """One output stream: whole in memory until it outgrows head+tail, then spilled"""
+
+    def __init__(self, head_bytes, tail_bytes, spill_path):
+        self.head_bytes = head_bytes
+        self.tail_bytes = tail_bytes
+        self.spill_path = spill_path
+        self.size = 0
+        self.head = bytearray()
+        self.tail = bytearray()
+        self.spilled = False
+        self._fd = None
+
+    def append(self, data):
+        if not self.spilled and self.size + len(data) > self.head_bytes + self.tail_bytes:
+            os.makedirs(os.path.dirname(self.spill_path), exist_ok=True)
+            self._fd = os.open(self.spill_path, os.O_RDWR | os.O_CREAT | os.O_TRUNC, 0o600)
+            self._write(self.head)
+            self.tail = self.head[self.head_bytes:]
+            del self.head[self.head_bytes:]
+            self.spilled = True
+
+        if not self.spilled:
+            self.head += data
+        else:
+            self._write(data)
+            if len(self.head) < self.head_bytes:
+                self.head += data[:self.head_bytes - len(self.head)]
+            self.tail += data
+            if len(self.tail) > self.tail_bytes:
+                del self.tail[:len(self.tail) - self.tail_bytes]
+        self.size += len(data)
+
+    def _write(self, data):
+        view = memoryview(data)
+        while view:
+            view = view[os.write(self._fd, view):]
+
+    def read(self, offset, length):
+        """Bytes [offset, offset+length) of the full stream"""
+        length = max(0, min(length, self.size - offset))
+        if not length:
+            return b''
+        if not self.spilled:
+            return bytes(self.head[offset:offset + length])
+        if self._fd is not None:
+            return os.pread(self._fd, length, offset)
+        with open(self.spill_path, 'rb') as f:
+            f.seek(offset)
+            return f.read(length)
+
+    def text(self):
+        """The stream as text, with the middle elided if it was spilled"""
+        if not self.spilled:
+            return self.head.decode('utf-8', 'replace')
+        skipped = self.size - len(self.head) - len(self.tail)
+        return (self.head.decode('utf-8', 'replace')
+                + f"\n... [{skipped} bytes omitted, see /output] ...\n"
+                + self.tail.decode('utf-8', 'replace'))
+
+    def close(self):
+        if self._fd is not None:
+            os.close(self._fd)
+            self._fd = None
+
+    def drop_memory(self):
+        """Forget the in-memory copy once the spill file is the source of truth"""
+        if self.spilled:
+            self.head = bytearray()
+            self.tail = bytearray()
+
+    def discard(self):
+        self.close()
+        if self.spilled:
+            try:
+                os.unlink(self.spill_path)
+            except FileNotFoundError:
+                pass
+
+
+class OutputCapture:
+    """Bounded stdout/stderr buffers with blocking readers"""
+
+    def __init__(self, name='task', head_bytes=32 * 1024, tail_bytes=32 * 1024,
+                 max_bytes=64 * 1024 * 1024, spill_dir=None):
+        spill_dir = spill_dir or os.path.join(tempfile.gettempdir(), 'worker-output')
+        self._cond = threading.Condition()
+        self._buffers = {
+            stream: StreamBuffer(head_bytes, tail_bytes, os.path.join(spill_dir, f'{name}.{stream}'))
+            for stream in STREAMS
+        }
+        self.max_bytes = max_bytes
+        self.truncated = False
+        self.closed = False
+        self._listeners = []
+
+    def write(self, stream, data):
+        """Append output; `data` may be bytes or text.
+
+        Raises OutputLimitExceeded once the task's total output passes
+        `max_bytes`; anything beyond the limit is dropped.
+        """
+        if isinstance(data, str):
+            data = data.encode('utf-8', 'replace')
+        if not data:
+            return
+        with self._cond:
+            if self.truncated:
+                raise OutputLimitExceeded(f"Output limit of {self.max_bytes} bytes exceeded")
+            room = self.max_bytes - sum(b.size for b in self._buffers.values())
+            if len(data) > room:
+                data = data[:max(0, room)]
+                self.truncated = True
+            if data:
+                self._buffers[stream].append(data)
+            self._cond.notify_all()
+        self._notify()
+        if self.truncated:
+            raise OutputLimitExceeded(f"Output limit of {self.max_bytes} bytes exceeded")
+
+    def close(self):
+        """Mark the output as complete and wake all followers"""
+        with self._cond:
+            self.closed = True
+            for buffer in self._buffers.values():
+                buffer.close()
+            self._cond.notify_all()
+        self._notify()
+
+    def add_listener(self, callback):
+        """Call `callback()` after every write and on close; returns a function
+        that removes it. Callbacks run on the writing thread and must not block."""
+        with self._cond:
+            self._listeners.append(callback)
+
+        def remove():
+            with self._cond:
+                if callback in self._listeners:
+                    self._listeners.remove(callback)
+        return remove
+
+    def _notify(self):
+        with self._cond:
+            listeners = list(self._listeners)
+        for callback in listeners:
+            callback()
+
+    @property
+    def spilled(self):
+        return any(buffer.spilled for buffer in self._buffers.values())
+
+    def size(self, stream):
+        with self._cond:
+            return self._buffers[stream].size
+
+    def read(self, stream, offset=0, length=None):
+        """Raw bytes of one stream, from memory or the spill file"""
+        with self._cond:
+            buffer = self._buffers[stream]
+            if length is None:
+                length = buffer.size - offset
+            return buffer.read(offset, length)
+
+    def text(self, stream):
+        """Decoded contents of one stream (head and tail only if spilled)"""
+        with self._cond:
+            return self._buffers[stream].text()
+
+    def snapshot(self):
+        """Output captured so far"""
+        return {stream: self.text(stream) for stream in STREAMS}
+
+    def summary(self):
+        """Result fields describing output that did not fit in memory"""
+        with self._cond:
+            if not self.spilled and not self.truncated:
+                return {}
+            return {
+                'output_bytes': {stream: b.size for stream, b in self._buffers.items()},
+                'output_spilled': self.spilled,
+                'output_truncated': self.truncated
+            }
+
+    def drop_memory(self):
+        """Release head/tail copies after the result has been recorded"""
+        with self._cond:
+            for buffer in self._buffers.values():
+                buffer.drop_memory()
+
+    def discard(self):
+        """Delete spill files"""
+        with self._cond:
+            for buffer in self._buffers.values():
+                buffer.discard()
+
+    def follow(self, keepalive=15):
+        """Yield (stream, text) chunks as they arrive until the capture is closed.
+
+        Yields None after `keepalive` seconds without new output so callers can
+        keep idle connections open.
+        """
+        reader = _FollowReader(self)
+        while True:
+            with self._cond:
+                if not reader.pending() and not self.closed:
+                    self._cond.wait(keepalive)
+                chunks, finished = reader.take()
+            yield from reader.decode(chunks, finished)
+            if finished:
+                return
+
+    async def follow_async(self, keepalive=15):
+        """Async generator counterpart of `follow` for the asyncio server"""
+        loop = asyncio.get_running_loop()
+        changed = asyncio.Event()
+        remove = self.add_listener(lambda: loop.call_soon_threadsafe(changed.set))
+        reader = _FollowReader(self)
+        try:
+            while True:
+                changed.clear()
+                with self._cond:
+                    chunks, finished = reader.take()
+                if not chunks and not finished:
+                    try:
+                        await asyncio.wait_for(changed.wait(), keepalive)
+                        continue
+                    except asyncio.TimeoutError:
+                        pass
+                for item in reader.decode(chunks, finished):
+                    yield item
+                if finished:
+                    return
+        finally:
+            remove()
+
+
+class _FollowReader:
+    """Read position and decoders of one follower of an OutputCapture"""
+
+    def __init__(self, capture):
+        self.capture = capture
+        self.offsets = {stream: 0 for stream in STREAMS}
+        self.decoders = {stream: codecs.getincrementaldecoder('utf-8')('replace') for stream in STREAMS}
+
+    def pending(self):
+        buffers = self.capture._buffers
+        return any(buffers[s].size > self.offsets[s] for s in STREAMS)
+
+    def take(self):
+        """New (stream, bytes) chunks and whether the output is complete (call with the lock held)"""
+        chunks = []
+        for stream in STREAMS:
+            data = self.capture._buffers[stream].read(self.offsets[stream], READ_SIZE)
+            if data:
+                chunks.append((stream, data))
+                self.offsets[stream] += len(data)
+        return chunks, self.capture.closed and not self.pending()
+
+    def decode(self, chunks, finished):
+        """Yield (stream, text) items for `chunks`, or None for a keepalive"""
+        if not chunks and not finished:
+            yield None
+        for stream, data in chunks:
+            text = self.decoders[stream].decode(data)
+            if text:
+                yield stream, text
+        if finished:
+            for stream in STREAMS:
+                tail = self.decoders[stream].decode(b'', final=True)
+                if tail:
+                    yield stream, tail
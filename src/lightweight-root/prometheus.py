@@ -0,0 +1,154 @@
+#!/usr/bin/env python3
+"""
+Prometheus - metrics in the Prometheus text / OpenMetrics exposition format
+
+A small, dependency-free subset of a Prometheus client: counters, gauges and
+histograms with labels, collected into a Registry that renders
+GET /metrics/prometheus. Histograms keep per-bucket counts, so an observation
+is one bisect and one increment; quantiles (p50/p99) are computed by
+Prometheus from the buckets with histogram_quantile().
+
+Gauges and counters can also be read from a `collect` callback at scrape time
+(queue depth, task counts), so the code being measured needs no hooks.
+Values are per process: with several worker processes every process is
+scraped as its own target.
+"""
+import bisect
+import math
+import threading
+
+# Task queue wait and run time: 5 ms to 10 min
+DURATION_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300, 600)
+# HTTP handlers and dispatch: 1 ms to 30 s
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30)
+
+TEXT_CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+OPENMETRICS_CONTENT_TYPE = 'application/openmetrics-text; version=1.0.0; charset=utf-8'
+
+
+class Metric:
+    """A named family of labelled series"""
+    type = 'untyped'
+
+    def __init__(self, name, help, labels=(), collect=None):
+        self.name = name
+        self.help = help
+        self.labels = tuple(labels)
+        self.collect = collect  # () -> {label values: value} (or a number without labels)
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def samples(self):
+        """(suffix, label pairs, value) of every series"""
+        if self.collect is not None:
+            values = self.collect()
+            if not isinstance(values, dict):
+                values = {(): values}
+        else:
+            with self._lock:
+                values = dict(self._values)
+        for key, value in sorted(values.items()):
+            if not isinstance(key, tuple):
+                key = (key,)
+            yield '', tuple(zip(self.labels, key)), value
+
+
+class Counter(Metric):
+    """Monotonic count; the name ends in _total"""
+    type = 'counter'
+
+    def inc(self, *label_values, amount=1):
+        with self._lock:
+            self._values[label_values] = self._values.get(label_values, 0) + amount
+
+
+class Gauge(Metric):
+    """Value that goes up and down"""
+    type = 'gauge'
+
+    def set(self, value, *label_values):
+        with self._lock:
+            self._values[label_values] = value
+
+
+class Histogram(Metric):
+    """Distribution of observations in cumulative `le` buckets"""
+    type = 'histogram'
+
+    def __init__(self, name, help, labels=(), buckets=DURATION_BUCKETS):
+        super().__init__(name, help, labels)
+        self.buckets = tuple(sorted(buckets))
+
+    def observe(self, value, *label_values):
+        index = bisect.bisect_left(self.buckets, value)  # the first bucket with value <= le
+        with self._lock:
+            series = self._values.get(label_values)
+            if series is None:
+                # Per-bucket counts (the last one is +Inf), then the sum
+                series = self._values[label_values] = [0] * (len(self.buckets) + 1) + [0.0]
+            series[index] += 1
+            series[-1] += value
+
+    def samples(self):
+        with self._lock:
+            values = {key: list(series) for key, series in self._values.items()}
+        bounds = [format_value(bound) for bound in self.buckets] + ['+Inf']
+        for key, series in sorted(values.items()):
+            labels = tuple(zip(self.labels, key))
+            count = 0
+            for bound, n in zip(bounds, series):
+                count += n
+                yield '_bucket', labels + (('le', bound),), count
+            yield '_sum', labels, series[-1]
+            yield '_count', labels, count
+
+
+class Registry:
+    """Metrics exposed together by one endpoint"""
+
+    def __init__(self):
+        self.metrics = []
+
+    def register(self, metric):
+        self.metrics.append(metric)
+        return metric
+
+    def render(self, openmetrics=False):
+        lines = []
+        for metric in self.metrics:
+            name = metric.name
+            if openmetrics and metric.type == 'counter' and name.endswith('_total'):
+                name = name[:-len('_total')]  # OpenMetrics names the family without the suffix
+            lines.append(f'# HELP {name} {escape(metric.help)}')
+            lines.append(f'# TYPE {name} {metric.type}')
+            for suffix, labels, value in metric.samples():
+                if labels:
+                    pairs = ','.join(f'{label}="{escape(str(v), quote=True)}"' for label, v in labels)
+                    lines.append(f'{metric.name}{suffix}{{{pairs}}} {format_value(value)}')
+                else:
+                    lines.append(f'{metric.name}{suffix} {format_value(value)}')
+        if openmetrics:
+            lines.append('# EOF')
+        return '\n'.join(lines) + '\n'
+
+    def exposition(self, accept=None):
+        """(body, content type) for a scrape, OpenMetrics if the Accept header asks for it"""
+        openmetrics = 'application/openmetrics-text' in (accept or '')
+        return self.render(openmetrics), OPENMETRICS_CONTENT_TYPE if openmetrics else TEXT_CONTENT_TYPE
+
+
+def escape(text, quote=False):
+    text = text.replace('\\', '\\\\').replace('\n', '\\n')
+    return text.replace('"', '\\"') if quote else text
+
+
+def format_value(value):
+    if isinstance(value, bool):
+        return '1' if value else '0'
+    if isinstance(value, int):
+        return str(value)
+    if math.isinf(value):
+        return '+Inf' if value > 0 else '-Inf'
+    if math.isnan(value):
+        return 'NaN'
+    return repr(float(value))
@@ -0,0 +1,255 @@
+#!/usr/bin/env python3
+"""
+Python environments - cached virtualenvs for code tasks with `requirements`
+
+A task's requirement list is normalized and hashed; the hash names a
+virtualenv under PYTHON_ENV_DIR that is built once (venv + pip install) and
+reused by every later task with the same requirements. Environments are
+evicted least-recently-used under a disk budget. File locks make this safe
+across worker processes: a build holds its environment's lock exclusively,
+running tasks hold it shared, and eviction skips locked environments. Waiting
+for a lock gives up when the task is cancelled or reaches its deadline.
+"""
+import fcntl
+import hashlib
+import json
+import os
+import re
+import shutil
+import subprocess
+import sys
+import threading
+import time
+
+from executors import TaskCancelled, kill_process_group
+
+MAX_REQUIREMENTS = 100
+LOCK_POLL = 0.1  # seconds between attempts to take a contended environment lock
+# A requirement specifier, never a pip option, URL or path
+REQUIREMENT = re.compile(r'^[A-Za-z0-9][A-Za-z0-9._\-]*(\[[A-Za-z0-9._,\- ]*\])?\s*([<>=!~]=?[^\s;,]+\s*(,\s*[<>=!~]=?[^\s;,]+\s*)*)?$')
+
+
+class EnvironmentBuildError(RuntimeError):
+    """Building a task's Python environment failed"""
+
+
+def normalize_requirements(requirements):
+    """Sorted, de-duplicated requirement strings, or None if malformed"""
+    if isinstance(requirements, str):
+        requirements = requirements.splitlines()
+    if not isinstance(requirements, list) or not all(isinstance(r, str) for r in requirements):
+        return None
+    normalized = sorted({r.strip() for r in requirements if r.strip()})
+    if len(normalized) > MAX_REQUIREMENTS or not all(REQUIREMENT.match(r) for r in normalized):
+        return None
+    return normalized
+
+
+def requirements_key(requirements):
+    """Name of the environment for a normalized requirement list"""
+    key = f'{sys.version_info[0]}.{sys.version_info[1]}\n' + '\n'.join(requirements)
+    return hashlib.sha256(key.encode()).hexdigest()[:24]
+
+
+class EnvLease:
+    """Use of a built environment; it cannot be evicted until released"""
+
+    def __init__(self, path, lock_file):
+        self.path = path
+        self.python = os.path.join(path, 'bin', 'python')
+        self._lock_file = lock_file
+
+    def release(self):
+        if not self._lock_file.closed:
+            self._lock_file.close()  # drops the shared flock
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.release()
+
+
+class PythonEnvCache:
+    """Virtualenvs keyed by requirement set, LRU-evicted under a disk budget"""
+
+    def __init__(self, root, max_bytes=2 * 1024 * 1024 * 1024, install_timeout=300, logger=None):
+        self.root = root
+        self.max_bytes = max_bytes
+        self.install_timeout = install_timeout
+        self.logger = logger
+        os.makedirs(root, exist_ok=True)
+        self._lock = threading.Lock()
+        self._stats = {'hits': 0, 'builds': 0, 'build_failures': 0, 'evictions': 0, 'build_seconds': 0.0}
+
+    def acquire(self, requirements, cancel=None, deadline=None):
+        """EnvLease for `requirements` (normalized), building the environment if needed.
+
+        Raises EnvironmentBuildError if pip fails, TaskCancelled if `cancel` fires
+        and TimeoutError if the task's `deadline` (Unix time) passes while waiting
+        for another task's build.
+        """
+        key = requirements_key(requirements)
+        path = os.path.join(self.root, key)
+        marker = os.path.join(path, '.ready')
+        lock_file = open(path + '.lock', 'a')
+        built = False
+        try:
+            while True:
+                self._wait_lock(lock_file, fcntl.LOCK_SH, cancel, deadline)
+                if os.path.exists(marker):
+                    break
+                # flock cannot upgrade atomically: waiting for LOCK_EX while
+                # holding LOCK_SH would also wait for every task using the
+                # environment once another task has built it
+                fcntl.flock(lock_file, fcntl.LOCK_UN)
+                self._wait_lock(lock_file, fcntl.LOCK_EX, cancel, deadline)
+                if not os.path.exists(marker):  # not built by another task meanwhile
+                    self._build(path, requirements, cancel)
+                    built = True
+                # Back to shared; the marker is checked again as the lock is
+                # briefly dropped on the way
+            os.utime(marker)
+        except BaseException:
+            lock_file.close()
+            raise
+        if built:
+            self._evict(keep=key)
+        else:
+            with self._lock:
+                self._stats['hits'] += 1
+        return EnvLease(path, lock_file)
+
+    def _wait_lock(self, lock_file, operation, cancel, deadline):
+        """flock() that gives up on cancellation, at the deadline or after install_timeout"""
+        give_up = time.monotonic() + self.install_timeout
+        while True:
+            try:
+                fcntl.flock(lock_file, operation | fcntl.LOCK_NB)
+                return
+            except BlockingIOError:
+                pass
+            if deadline is not None and time.time() >= deadline:
+                raise TimeoutError('Deadline passed while waiting for the Python environment')
+            if time.monotonic() >= give_up:
+                raise EnvironmentBuildError(
+                    f'Waiting for the Python environment timed out after {self.install_timeout:g}s')
+            if cancel is None:
+                time.sleep(LOCK_POLL)
+            elif cancel.wait(LOCK_POLL):
+                raise TaskCancelled()
+
+    def _build(self, path, requirements, cancel):
+        started = time.monotonic()
+        shutil.rmtree(path, ignore_errors=True)  # left over from an interrupted build
+        try:
+            self._run([sys.executable, '-m', 'venv', '--without-pip', path], cancel)
+            if requirements:
+                self._run([sys.executable, '-m', 'pip', '--python', os.path.join(path, 'bin', 'python'),
+                           'install', '--no-input', '--disable-pip-version-check', '--quiet',
+                           '--', *requirements], cancel)
+        except BaseException:
+            shutil.rmtree(path, ignore_errors=True)
+            with self._lock:
+                self._stats['build_failures'] += 1
+            raise
+        size = directory_size(path)
+        with open(os.path.join(path, '.ready'), 'w') as f:
+            json.dump({'requirements': requirements, 'size': size}, f)
+        elapsed = time.monotonic() - started
+        with self._lock:
+            self._stats['builds'] += 1
+            self._stats['build_seconds'] += elapsed
+        if self.logger:
+            self.logger.info(f"Built Python environment {os.path.basename(path)} "
+                             f"({len(requirements)} requirements, {size // 1024} KB) in {elapsed:.1f}s")
+
+    def _run(self, command, cancel):
+        proc = subprocess.Popen(command, stdout=subprocess.PIPE, stderr=subprocess.STDOUT,
+                                stdin=subprocess.DEVNULL, start_new_session=True)
+        unregister = cancel.on_cancel(lambda: kill_process_group(proc)) if cancel is not None else None
+        try:
+            output, _ = proc.communicate(timeout=self.install_timeout)
+        except subprocess.TimeoutExpired:
+            kill_process_group(proc)
+            proc.wait()
+            raise EnvironmentBuildError(f'Installing requirements timed out after {self.install_timeout:g}s')
+        finally:
+            if unregister is not None:
+                unregister()
+        if cancel is not None and cancel.cancelled:
+            raise TaskCancelled()
+        if proc.returncode != 0:
+            message = output.decode(errors='replace').strip()[-2000:]
+            raise EnvironmentBuildError(f'Installing requirements failed: {message}')
+
+    def _environments(self):
+        """(last used, size, key) of every built environment"""
+        for entry in os.scandir(self.root):
+            marker = os.path.join(entry.path, '.ready')
+            try:
+                used_at = os.stat(marker).st_mtime
+                with open(marker) as f:
+                    size = json.load(f)['size']
+            except (OSError, ValueError, KeyError):
+                continue
+            yield used_at, size, entry.name
+
+    def _evict(self, keep):
+        """Delete least recently used environments that no task is using until under budget"""
+        environments = sorted(self._environments())
+        total = sum(size for _, size, _ in environments)
+        for _, size, key in environments:
+            if total <= self.max_bytes:
+                break
+            if key == keep:
+                continue
+            path = os.path.join(self.root, key)
+            with open(path + '.lock', 'a') as lock_file:
+                try:
+                    fcntl.flock(lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+                except OSError:
+                    continue  # in use or being rebuilt
+                os.remove(os.path.join(path, '.ready'))
+                shutil.rmtree(path, ignore_errors=True)
+            total -= size
+            with self._lock:
+                self._stats['evictions'] += 1
+
+    def get_stats(self):
+        environments = list(self._environments())
+        with self._lock:
+            stats = dict(self._stats)
+        stats['build_seconds'] = round(stats['build_seconds'], 2)
+        stats.update(environments=len(environments), bytes=sum(size for _, size, _ in environments),
+                     max_bytes=self.max_bytes)
+        return stats
+
+
+def directory_size(path):
+    total = 0
+    for directory, _, names in os.walk(path):
+        for name in names:
+            try:
+                total += os.lstat(os.path.join(directory, name)).st_size
+            except OSError:
+                pass
+    return total
+
+
+def python_env_cache_from_env(logger=None):
+    """Build the environment cache from PYTHON_ENV_* settings, or None if PYTHON_ENV_DIR is empty"""
+    root = os.getenv('PYTHON_ENV_DIR', 'data/python-envs')
+    if not root:
+        return None
+    try:
+        return PythonEnvCache(
+            os.path.abspath(root),
+            max_bytes=int(float(os.getenv('PYTHON_ENV_MB', 2048)) * 1024 * 1024),
+            install_timeout=float(os.getenv('PYTHON_ENV_INSTALL_TIMEOUT', 300)),
+            logger=logger
+        )
+    except OSError as e:
+        if logger:
+            logger.warning(f"Python environment cache disabled: {e}")
+        return None
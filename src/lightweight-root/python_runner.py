@@ -0,0 +1,181 @@
+#!/usr/bin/env python3
+"""
+Warm Python runner - fork server used by the worker's Python pool
+
+Reads one JSON request per line on stdin and forks a child per request that
+runs the code as __main__. The child's output is forwarded as output events
+while it runs, followed by one JSON result line with the exit status. The fork
+happens from an already-initialised interpreter, so each task skips Python
+startup and the preloaded imports.
+"""
+import atexit
+import builtins
+import codecs
+import io
+import json
+import linecache
+import os
+import selectors
+import signal
+import sys
+import threading
+import time
+import traceback
+import types
+
+from resource_usage import resource_usage
+
+SCRIPT_NAME = '/tmp/task.py'
+RUNNER_DIR = os.path.dirname(os.path.abspath(__file__))
+READ_SIZE = 65536
+
+
+def preload(modules):
+    """Import commonly used modules so forked children inherit them"""
+    for name in modules:
+        try:
+            __import__(name)
+        except ImportError:
+            pass
+
+
+def run_child(code, env):
+    """Body of the forked child: behave like `python3 script.py`"""
+    os.environ.update(env)
+    sys.argv = [SCRIPT_NAME]
+    # Resolve imports from the script's directory, not the worker's source,
+    # and forget the worker modules this runner imported itself
+    sys.path[0] = os.path.dirname(SCRIPT_NAME)
+    for name, module in list(sys.modules.items()):
+        if os.path.dirname(getattr(module, '__file__', None) or '') == RUNNER_DIR:
+            del sys.modules[name]
+    sys.stdin = io.TextIOWrapper(io.FileIO(0, 'r', closefd=False))
+    sys.stdout = io.TextIOWrapper(io.FileIO(1, 'w', closefd=False))
+    sys.stderr = io.TextIOWrapper(io.FileIO(2, 'w', closefd=False),
+                                  errors='backslashreplace', line_buffering=True)
+
+    main = types.ModuleType('__main__')
+    main.__file__ = SCRIPT_NAME
+    main.__builtins__ = builtins
+    sys.modules['__main__'] = main
+    linecache.cache[SCRIPT_NAME] = (len(code), None, code.splitlines(True), SCRIPT_NAME)
+
+    exit_code = 0
+    try:
+        exec(compile(code, SCRIPT_NAME, 'exec'), main.__dict__)
+    except SystemExit as e:
+        if e.code is None:
+            exit_code = 0
+        elif isinstance(e.code, int):
+            exit_code = e.code
+        else:
+            print(e.code, file=sys.stderr)
+            exit_code = 1
+    except BaseException as e:
+        # Drop this frame so the traceback starts at the user's script
+        traceback.print_exception(type(e), e, e.__traceback__.tb_next)
+        exit_code = 1
+
+    # Finish the way the interpreter does at exit: join non-daemon threads,
+    # run atexit handlers, then flush
+    try:
+        threading._shutdown()
+    except BaseException:
+        pass
+    atexit._run_exitfuncs()
+    for stream in (sys.stdout, sys.stderr):
+        try:
+            stream.flush()
+        except Exception:
+            pass
+    os._exit(exit_code & 0xff)
+
+
+def send(writer, message):
+    writer.write(json.dumps(message).encode() + b'\n')
+    writer.flush()
+
+
+def run_request(request, writer, proto_fds):
+    """Fork a child for one request and forward its output"""
+    out_r, out_w = os.pipe()
+    err_r, err_w = os.pipe()
+    pid = os.fork()
+    if pid == 0:
+        try:
+            for fd in proto_fds:
+                os.close(fd)
+            os.close(out_r)
+            os.close(err_r)
+            devnull = os.open(os.devnull, os.O_RDONLY)
+            os.dup2(devnull, 0)
+            os.dup2(out_w, 1)
+            os.dup2(err_w, 2)
+            signal.signal(signal.SIGINT, signal.SIG_DFL)
+            run_child(request.get('code', ''), request.get('env') or {})
+        finally:
+            os._exit(1)
+
+    os.close(out_w)
+    os.close(err_w)
+
+    streams = {out_r: 'stdout', err_r: 'stderr'}
+    decoders = {fd: codecs.getincrementaldecoder('utf-8')('replace') for fd in streams}
+    selector = selectors.DefaultSelector()
+    selector.register(out_r, selectors.EVENT_READ)
+    selector.register(err_r, selectors.EVENT_READ)
+    deadline = time.monotonic() + float(request.get('timeout', 30))
+    timed_out = False
+
+    while selector.get_map():
+        remaining = deadline - time.monotonic()
+        if remaining <= 0:
+            timed_out = True
+            break
+        for key, _ in selector.select(remaining):
+            data = os.read(key.fd, READ_SIZE)
+            if not data:
+                selector.unregister(key.fd)
+            text = decoders[key.fd].decode(data, final=not data)
+            if text:
+                send(writer, {'event': 'output', 'stream': streams[key.fd], 'data': text})
+
+    if timed_out:
+        os.kill(pid, signal.SIGKILL)
+    selector.close()
+    os.close(out_r)
+    os.close(err_r)
+    _, status, rusage = os.wait4(pid, 0)
+
+    response = {'returncode': os.waitstatus_to_exitcode(status), 'usage': resource_usage(rusage, forked=True)}
+    if timed_out:
+        # Replacing the runner kills its process group, including anything
+        # the task left running in the background.
+        response['timeout'] = True
+        response['recycle'] = True
+    return response
+
+
+def main():
+    # Keep the protocol channel off fds 0/1 so nothing printed by this process
+    # or inherited by children can corrupt it.
+    proto_in = os.dup(0)
+    proto_out = os.dup(1)
+    devnull = os.open(os.devnull, os.O_RDWR)
+    os.dup2(devnull, 0)
+    os.dup2(devnull, 1)
+
+    preload([m for m in os.getenv('PYTHON_POOL_PRELOAD', '').split(',') if m])
+
+    reader = os.fdopen(proto_in, 'rb')
+    writer = os.fdopen(proto_out, 'wb')
+    for line in reader:
+        try:
+            response = run_request(json.loads(line), writer, (proto_in, proto_out))
+        except Exception as e:
+            response = {'error': str(e)}
+        send(writer, response)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,88 @@
+#!/usr/bin/env python3
+"""
+Resource usage - per-task CPU time, peak memory and I/O of executed code
+
+Cold runs and the Python runner's forked children are reaped with wait4(),
+whose rusage covers the process and every descendant it waited for; the
+Node.js runner reports the difference of process.resourceUsage() across the
+task. The usage is returned in the task's result as `usage` and summed per
+task type and language for GET /stats.
+
+Peak RSS: a forked child that does not exec starts its peak from the pages it
+shares with its parent, so ru_maxrss is its own. A child that execs is charged
+the peak of the process it was started from (exec keeps the old address
+space's peak, and vfork shares the parent's), so its own peak is only known
+when it is higher. The process is gone by the time it can be reaped, so
+/proc/<pid>/status (VmHWM) cannot be read instead; `max_rss_kb` is left out
+when the peak is unknown.
+"""
+import resource
+import sys
+import threading
+
+USAGE_FIELDS = ('cpu_user_seconds', 'cpu_system_seconds', 'max_rss_kb', 'block_reads', 'block_writes',
+                'voluntary_context_switches', 'involuntary_context_switches')
+SUMMED_FIELDS = tuple(field for field in USAGE_FIELDS if field != 'max_rss_kb')
+
+
+def resource_usage(rusage, forked=False):
+    """Task `usage` from the rusage of a child of this process (os.wait4);
+    `forked` if the child ran without exec, so that its peak RSS is its own"""
+    max_rss = rusage.ru_maxrss
+    if sys.platform == 'darwin':
+        max_rss //= 1024  # bytes there, kilobytes on Linux
+    usage = {
+        'cpu_user_seconds': round(rusage.ru_utime, 6),
+        'cpu_system_seconds': round(rusage.ru_stime, 6),
+        'max_rss_kb': max_rss,
+        'block_reads': rusage.ru_inblock,
+        'block_writes': rusage.ru_oublock,
+        'voluntary_context_switches': rusage.ru_nvcsw,
+        'involuntary_context_switches': rusage.ru_nivcsw
+    }
+    if not forked and rusage.ru_maxrss <= resource.getrusage(resource.RUSAGE_SELF).ru_maxrss:
+        del usage['max_rss_kb']  # this process's peak, the task's own was lower
+    return usage
+
+
+class UsageStats:
+    """Usage of finished tasks summed per task type and language"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._totals = {}  # (type, language) -> totals
+
+    def add(self, task_type, language, result):
+        """Count the `usage` of a task's result, if it has one"""
+        usage = result.get('usage') if isinstance(result, dict) else None
+        if not isinstance(usage, dict):
+            return
+        rss = usage.get('max_rss_kb')
+        with self._lock:
+            totals = self._totals.get((task_type, language))
+            if totals is None:
+                totals = self._totals[(task_type, language)] = dict(
+                    tasks=0, peak_rss_kb=None, rss_kb=0, rss_tasks=0, **dict.fromkeys(SUMMED_FIELDS, 0))
+            totals['tasks'] += 1
+            if rss is not None:
+                totals['peak_rss_kb'] = max(totals['peak_rss_kb'] or 0, rss)
+                totals['rss_kb'] += rss
+                totals['rss_tasks'] += 1
+            for field in SUMMED_FIELDS:
+                totals[field] += usage.get(field) or 0
+
+    def get_stats(self):
+        """{type: {language: totals with average CPU seconds and peak RSS per task}}"""
+        with self._lock:
+            items = [(key, dict(totals)) for key, totals in self._totals.items()]
+        stats = {}
+        for (task_type, language), totals in sorted(items):
+            tasks = totals['tasks']
+            cpu = totals['cpu_user_seconds'] + totals['cpu_system_seconds']
+            totals['cpu_user_seconds'] = round(totals['cpu_user_seconds'], 3)
+            totals['cpu_system_seconds'] = round(totals['cpu_system_seconds'], 3)
+            totals['avg_cpu_seconds'] = round(cpu / tasks, 4)
+            rss_kb, rss_tasks = totals.pop('rss_kb'), totals.pop('rss_tasks')
+            totals['avg_max_rss_kb'] = rss_kb // rss_tasks if rss_tasks else None
+            stats.setdefault(task_type, {})[language or 'none'] = totals
+        return stats
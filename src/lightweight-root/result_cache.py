@@ -0,0 +1,121 @@
+#!/usr/bin/env python3
+"""
+Result cache - content-addressed results of deterministic tasks
+
+Tasks are keyed by a hash of the fields that determine their result, so an
+identical resubmission can be answered without running anything. Entries are
+evicted least-recently-used under a memory budget and expire after a TTL.
+"""
+import hashlib
+import json
+import os
+import threading
+import time
+from collections import OrderedDict
+
+from execution_pool import LANGUAGE_ALIASES
+from python_envs import normalize_requirements
+
+CACHEABLE_TYPES = ('code', 'compute')
+
+
+def task_fingerprint(task_type, payload):
+    """Stable hash of the parts of a task that determine its result, or None"""
+    if task_type not in CACHEABLE_TYPES:
+        return None
+    if task_type == 'code':
+        language = payload.get('language', 'python')
+        key = {
+            'type': task_type,
+            'language': LANGUAGE_ALIASES.get(language, language),
+            'code': payload.get('code', ''),
+            'input': payload.get('input'),
+            'files': payload.get('files'),
+            'requirements': normalize_requirements(payload.get('requirements') or []),
+            'artifacts': bool(payload.get('artifacts'))
+        }
+    else:
+        key = {'type': task_type, 'payload': payload}
+    encoded = json.dumps(key, sort_keys=True, separators=(',', ':'), default=str)
+    return hashlib.sha256(encoded.encode()).hexdigest()
+
+
+def is_cacheable_result(result):
+    """Only complete, successful results are worth replaying"""
+    if not isinstance(result, dict) or 'error' in result:
+        return False
+    if result.get('output_spilled') or result.get('output_truncated'):
+        return False
+    if 'artifacts' in result:
+        return False  # the blobs they name may be evicted before the entry expires
+    return result.get('success', True)
+
+
+class ResultCache:
+    """Thread-safe LRU cache with a byte budget and per-entry TTL"""
+
+    def __init__(self, max_bytes=64 * 1024 * 1024, ttl=3600):
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self._entries = OrderedDict()  # key -> (result, size, expires_at)
+        self._bytes = 0
+        self._lock = threading.Lock()
+        self._stats = {'hits': 0, 'misses': 0, 'evictions': 0, 'expired': 0}
+
+    def get(self, key):
+        """Cached result for `key`, or None"""
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and entry[2] < time.monotonic():
+                self._remove(key)
+                self._stats['expired'] += 1
+                entry = None
+            if entry is None:
+                self._stats['misses'] += 1
+                return None
+            self._entries.move_to_end(key)
+            self._stats['hits'] += 1
+            return entry[0]
+
+    def put(self, key, result):
+        """Store a result, evicting the least recently used entries if needed"""
+        result = {field: value for field, value in result.items() if field != 'usage'}  # of that run only
+        size = len(json.dumps(result, default=str))
+        if size > self.max_bytes:
+            return
+        with self._lock:
+            if key in self._entries:
+                self._remove(key)
+            self._entries[key] = (result, size, time.monotonic() + self.ttl)
+            self._bytes += size
+            while self._bytes > self.max_bytes:
+                oldest = next(iter(self._entries))
+                self._remove(oldest)
+                self._stats['evictions'] += 1
+
+    def _remove(self, key):
+        _, size, _ = self._entries.pop(key)
+        self._bytes -= size
+
+    def get_stats(self):
+        with self._lock:
+            lookups = self._stats['hits'] + self._stats['misses']
+            return {
+                'entries': len(self._entries),
+                'bytes': self._bytes,
+                'max_bytes': self.max_bytes,
+                'ttl_seconds': self.ttl,
+                'hit_rate': round(self._stats['hits'] / lookups, 4) if lookups else 0,
+                **self._stats
+            }
+
+
+def result_cache_from_env():
+    """Build the result cache from RESULT_CACHE_* settings, or None if disabled"""
+    max_mb = float(os.getenv('RESULT_CACHE_MB', 64))
+    if max_mb <= 0:
+        return None
+    return ResultCache(
+        max_bytes=int(max_mb * 1024 * 1024),
+        ttl=float(os.getenv('RESULT_CACHE_TTL', 3600))
+    )
@@ -2,13 +2,14 @@
 """
 Root Node - Manages and distributes tasks to workers
 """
-from flask import Flask, jsonify, request
+from flask import Flask, Response, g, jsonify, request
 import os
 import sys
 import requests
 import threading
 import time
 from datetime import datetime
+from prometheus import Counter, Gauge, Histogram, Registry, LATENCY_BUCKETS
 
 print("=" * 50, file=sys.stderr)
 print("Starting Root Node", file=sys.stderr)
@@ -27,6 +28,30 @@ root_stats = {
     'active_workers': 0
 }
 
+def worker_counts():
+    """Registered workers by status"""
+    with worker_lock:
+        statuses = [w['status'] for w in workers.values()]
+    return {status: statuses.count(status) for status in ('online', 'offline')}
+
+def tasks_assigned():
+    with worker_lock:
+        return {worker_id: w['tasks_assigned'] for worker_id, w in workers.items()}
+
+# Prometheus metrics for GET /metrics/prometheus
+metrics = Registry()
+dispatch_latency = metrics.register(Histogram(
+    'root_dispatch_duration_seconds', 'Time to hand a task to a worker',
+    ('worker', 'outcome'), LATENCY_BUCKETS))
+http_latency = metrics.register(Histogram(
+    'root_http_request_duration_seconds', 'Time to handle an HTTP request',
+    ('method', 'route', 'status'), LATENCY_BUCKETS))
+metrics.register(Gauge('root_workers', 'Registered workers by status', ('status',), worker_counts))
+metrics.register(Counter('root_worker_tasks_assigned_total', 'Tasks distributed to each worker',
+                         ('worker',), tasks_assigned))
+metrics.register(Counter('root_tasks_distributed_total', 'Tasks distributed to any worker',
+                         collect=lambda: root_stats['total_tasks_distributed']))
+
 def health_check_worker(worker_id, worker_url):
     """Check worker health"""
     try:
@@ -59,13 +84,26 @@ def heartbeat_monitor():
 monitor_thread = threading.Thread(target=heartbeat_monitor, daemon=True)
 monitor_thread.start()
 
+@app.before_request
+def start_timer():
+    g.request_started = time.perf_counter()
+
+@app.after_request
+def record_latency(response):
+    if 'request_started' in g:
+        rule = request.url_rule.rule if request.url_rule is not None else 'unmatched'
+        http_latency.observe(time.perf_counter() - g.request_started,
+                             request.method, rule, str(response.status_code))
+    return response
+
 @app.route('/')
 def root():
     return jsonify({
         'service': 'root-node',
         'status': 'running',
         'version': '1.0.0',
-        'endpoints': ['/', '/health', '/workers', '/workers/register', '/distribute']
+        'endpoints': ['/', '/health', '/workers', '/workers/register', '/distribute',
+                      '/stats', '/metrics/prometheus']
     })
 
 @app.route('/health')
@@ -143,12 +181,15 @@ def distribute_task():
     target_worker = min(online_workers, key=lambda w: w.get('tasks_assigned', 0))
     
     # Send task to worker
+    started = time.perf_counter()
     try:
         response = requests.post(
             f"{target_worker['url']}/tasks",
             json=data,
             timeout=10
         )
+        dispatch_latency.observe(time.perf_counter() - started, target_worker['id'],
+                                 'accepted' if response.status_code == 201 else 'rejected')
         
         if response.status_code == 201:
             with worker_lock:
@@ -166,6 +207,7 @@ def distribute_task():
             return jsonify({'error': 'Worker rejected task'}), 500
             
     except Exception as e:
+        dispatch_latency.observe(time.perf_counter() - started, target_worker['id'], 'error')
         print(f"Failed to distribute task: {e}", file=sys.stderr)
         return jsonify({'error': str(e)}), 500
 
@@ -179,6 +221,13 @@ def get_stats():
     
     return jsonify(current_stats)
 
+@app.route('/metrics/prometheus', methods=['GET'])
+def get_prometheus_metrics():
+    """Dispatch latency and worker metrics in the Prometheus text format
+    (OpenMetrics if the Accept header asks for it)"""
+    body, content_type = metrics.exposition(request.headers.get('Accept'))
+    return Response(body, content_type=content_type)
+
 if __name__ == '__main__':
     port = int(os.getenv('PORT', 5000))
     print(f"Starting Root Node on 0.0.0.0:{port}", file=sys.stderr)
@@ -0,0 +1,253 @@
+#!/usr/bin/env python3
+"""
+Runner pool - long-lived interpreter processes that execute code tasks
+
+Each runner speaks a line-delimited JSON protocol on stdin/stdout: one request
+object in, then any number of `{"event": "output", "stream": ..., "data": ...}`
+lines carrying output as it is produced, then one response object. Runners are
+recycled after a fixed number of tasks, when they report excessive memory use,
+or when they crash.
+"""
+import json
+import os
+import queue
+import select
+import signal
+import subprocess
+import threading
+import time
+
+READ_SIZE = 65536
+
+
+class RunnerError(Exception):
+    """A runner died or answered with something unusable.
+
+    `delivered` is False when the request never reached a runner, so the code
+    has not run and may safely be run elsewhere.
+    """
+
+    def __init__(self, message, delivered=True):
+        super().__init__(message)
+        self.delivered = delivered
+
+
+class Runner:
+    """A single runner process"""
+
+    def __init__(self, command, env=None):
+        self.proc = subprocess.Popen(
+            command,
+            stdin=subprocess.PIPE,
+            stdout=subprocess.PIPE,
+            env=env,
+            start_new_session=True
+        )
+        self.tasks_run = 0
+        self._pending = bytearray()
+
+    def request(self, message, timeout, on_event=None):
+        """Send one request, pass events to `on_event` and return the response"""
+        try:
+            self.proc.stdin.write(json.dumps(message).encode() + b'\n')
+            self.proc.stdin.flush()
+        except (BrokenPipeError, OSError) as e:
+            raise RunnerError(f"runner {self.proc.pid} unavailable: {e}", delivered=False)
+
+        deadline = time.monotonic() + timeout
+        while True:
+            line = self._read_line(deadline, timeout)
+            try:
+                response = json.loads(line)
+            except ValueError as e:
+                raise RunnerError(f"runner {self.proc.pid} sent invalid response: {e}")
+
+            if 'event' not in response:
+                return response
+            if on_event is not None:
+                on_event(response)
+
+    def _read_line(self, deadline, timeout):
+        """Read one protocol line from the runner's stdout, honouring the deadline"""
+        fd = self.proc.stdout.fileno()
+        while b'\n' not in self._pending:
+            remaining = deadline - time.monotonic()
+            ready, _, _ = select.select([fd], [], [], max(0, remaining))
+            if not ready:
+                raise subprocess.TimeoutExpired(self.proc.args, timeout)
+            data = os.read(fd, READ_SIZE)
+            if not data:
+                raise RunnerError(f"runner {self.proc.pid} exited with {self.proc.poll()}")
+            self._pending += data
+        line, _, rest = self._pending.partition(b'\n')
+        self._pending = bytearray(rest)
+        return line
+
+    def alive(self):
+        return self.proc.poll() is None
+
+    def kill(self):
+        """Kill the runner's process group; the thread using it sees EOF"""
+        try:
+            os.killpg(self.proc.pid, signal.SIGKILL)
+        except OSError:
+            pass
+
+    def stop(self):
+        """Terminate the runner and anything it forked"""
+        self.kill()
+        try:
+            self.proc.wait(timeout=5)
+        except subprocess.TimeoutExpired:
+            pass
+        for stream in (self.proc.stdin, self.proc.stdout):
+            try:
+                stream.close()
+            except OSError:
+                pass
+
+
+class RunnerPool:
+    """Fixed-size pool of pre-started runners.
+
+    `run()` checks out an idle runner, sends the request and returns the
+    response. Runners that crash, time out, exceed `max_tasks`, report an
+    RSS above `max_rss_mb` or ask to be recycled are replaced with a fresh
+    process.
+    """
+
+    def __init__(self, name, command, size, max_tasks=100, max_rss_mb=None,
+                 env=None, logger=None, response_grace=5):
+        self.name = name
+        self.command = command
+        self.size = size
+        self.max_tasks = max_tasks
+        self.max_rss_mb = max_rss_mb
+        self.env = env
+        self.logger = logger
+        self.response_grace = response_grace
+        self._idle = queue.Queue()
+        self._lock = threading.Lock()
+        self._stats = {'tasks': 0, 'recycled': 0, 'crashed': 0, 'cancelled': 0}
+
+    def start(self):
+        """Pre-start all runners"""
+        for _ in range(self.size):
+            self._idle.put(Runner(self.command, self.env))
+        if self.logger:
+            self.logger.info(f"{self.name} pool started with {self.size} runners")
+
+    def _replace(self, runner, reason):
+        runner.stop()
+        with self._lock:
+            self._stats[reason] += 1
+        try:
+            fresh = Runner(self.command, self.env)
+        except OSError as e:
+            if self.logger:
+                self.logger.error(f"{self.name} runner respawn failed: {e}")
+            # Keep the pool size stable; the next checkout retries the spawn.
+            fresh = None
+        self._idle.put(fresh)
+
+    def _checkout(self):
+        runner = self._idle.get()
+        if runner is None or not runner.alive():
+            if runner is not None:
+                runner.stop()
+                with self._lock:
+                    self._stats['crashed'] += 1
+            runner = Runner(self.command, self.env)
+        return runner
+
+    def run(self, message, timeout, on_event=None, cancel=None):
+        """Execute one request on a pooled runner.
+
+        Cancelling `cancel` kills the runner with everything the task started;
+        the request then fails with RunnerError and the runner is replaced.
+        """
+        try:
+            runner = self._checkout()
+        except OSError as e:
+            self._idle.put(None)
+            raise RunnerError(f"{self.name} runner spawn failed: {e}", delivered=False)
+
+        unregister = cancel.on_cancel(runner.kill) if cancel is not None else None
+        try:
+            response = runner.request(message, timeout + self.response_grace, on_event)
+        except subprocess.TimeoutExpired:
+            self._replace(runner, 'crashed')
+            raise
+        except RunnerError:
+            self._replace(runner, 'cancelled' if cancel is not None and cancel.cancelled else 'crashed')
+            raise
+        except Exception:
+            # The caller gave up mid-task (e.g. an output limit); the runner
+            # may still be busy, so it cannot go back to the pool.
+            self._replace(runner, 'recycled')
+            raise
+        finally:
+            if unregister is not None:
+                unregister()
+
+        runner.tasks_run += 1
+        with self._lock:
+            self._stats['tasks'] += 1
+
+        rss_mb = response.get('rss_mb')
+        if response.get('recycle') or runner.tasks_run >= self.max_tasks or (
+                self.max_rss_mb and rss_mb and rss_mb > self.max_rss_mb):
+            self._replace(runner, 'recycled')
+        else:
+            self._idle.put(runner)
+        return response
+
+    def close(self):
+        """Stop all idle runners"""
+        while True:
+            try:
+                runner = self._idle.get_nowait()
+            except queue.Empty:
+                break
+            if runner is not None:
+                runner.stop()
+
+    def get_stats(self):
+        with self._lock:
+            return {'size': self.size, 'idle': self._idle.qsize(), **self._stats}
+
+
+def runner_path(filename):
+    return os.path.join(os.path.dirname(os.path.abspath(__file__)), filename)
+
+
+def python_pool_from_env(default_size, logger=None):
+    """Build the warm Python pool from PYTHON_POOL_* settings, or None if disabled"""
+    size = int(os.getenv('PYTHON_POOL_SIZE', default_size))
+    if size <= 0:
+        return None
+    env = os.environ.copy()
+    env.setdefault('PYTHON_POOL_PRELOAD', 'json,re,math,random,datetime,collections,itertools')
+    return RunnerPool(
+        'python',
+        ['python3', runner_path('python_runner.py')],
+        size,
+        max_tasks=int(os.getenv('PYTHON_POOL_MAX_TASKS', 200)),
+        env=env,
+        logger=logger
+    )
+
+
+def node_pool_from_env(default_size, logger=None):
+    """Build the persistent Node.js pool from NODE_POOL_* settings, or None if disabled"""
+    size = int(os.getenv('NODE_POOL_SIZE', default_size))
+    if size <= 0:
+        return None
+    return RunnerPool(
+        'javascript',
+        ['node', runner_path('node_runner.js')],
+        size,
+        max_tasks=int(os.getenv('NODE_POOL_MAX_TASKS', 500)),
+        max_rss_mb=int(os.getenv('NODE_POOL_MAX_RSS_MB', 256)),
+        logger=logger
+    )
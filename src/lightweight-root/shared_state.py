@@ -0,0 +1,526 @@
+#!/usr/bin/env python3
+"""
+Shared task state - task records and the task queue in one SQLite database
+
+Lets several worker processes (e.g. gunicorn workers running app.py) serve a
+single task space: any process can accept a task, any process with a free
+execution slot can claim it, and every process answers lookups, listings and
+the task counts of /stats from the same data. The database runs in WAL mode,
+so readers never block and writers only hold short transactions.
+
+SharedTaskStore and SharedTaskQueue implement the same methods as TaskStore
+and TaskQueue, so the worker uses them unchanged.
+"""
+import json
+import os
+import queue
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from contextlib import contextmanager
+
+from execution_pool import PRIORITIES, load_client_weights
+from task_store import TASK_STATUSES, FINISHED_STATUSES
+
+
+class SharedDB:
+    """One SQLite database shared by all worker processes, a connection per thread"""
+
+    def __init__(self, db_path='data/state.db'):
+        self.db_path = db_path
+        directory = os.path.dirname(self.db_path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self._local = threading.local()
+        self._init_db()
+
+    def connection(self):
+        conn = getattr(self._local, 'conn', None)
+        if conn is None or self._local.pid != os.getpid():
+            # Connections must not cross a fork
+            conn = sqlite3.connect(self.db_path, timeout=30, isolation_level=None)
+            conn.execute('PRAGMA journal_mode=WAL')
+            conn.execute('PRAGMA synchronous=NORMAL')
+            self._local.conn = conn
+            self._local.pid = os.getpid()
+        return conn
+
+    @contextmanager
+    def transaction(self):
+        """Write transaction; takes the database write lock up front"""
+        conn = self.connection()
+        conn.execute('BEGIN IMMEDIATE')
+        try:
+            yield conn
+        except BaseException:
+            conn.execute('ROLLBACK')
+            raise
+        conn.execute('COMMIT')
+
+    def _init_db(self):
+        """Initialize database schema"""
+        with self.transaction() as conn:
+            conn.execute('''
+                CREATE TABLE IF NOT EXISTS tasks (
+                    seq INTEGER PRIMARY KEY AUTOINCREMENT,
+                    id TEXT UNIQUE NOT NULL,
+                    status TEXT NOT NULL,
+                    created_at TEXT,
+                    finished_at REAL,
+                    queued INTEGER NOT NULL DEFAULT 0,
+                    rank INTEGER,
+                    client TEXT,
+                    start_tag REAL,
+                    finish_tag REAL,
+                    lease_until REAL,
+                    record TEXT NOT NULL
+                )
+            ''')
+            columns = [row[1] for row in conn.execute('PRAGMA table_info(tasks)')]
+            if 'lease_until' not in columns:  # databases created before leases
+                conn.execute('ALTER TABLE tasks ADD COLUMN lease_until REAL')
+            conn.execute('CREATE INDEX IF NOT EXISTS tasks_status ON tasks (status, seq)')
+            conn.execute('CREATE INDEX IF NOT EXISTS tasks_created ON tasks (created_at)')
+            conn.execute('CREATE INDEX IF NOT EXISTS tasks_finished ON tasks (finished_at)')
+            conn.execute('''
+                CREATE INDEX IF NOT EXISTS tasks_queue ON tasks (rank, finish_tag, seq)
+                WHERE queued = 1
+            ''')
+            conn.execute('CREATE TABLE IF NOT EXISTS counters (name TEXT PRIMARY KEY, value INTEGER NOT NULL)')
+            conn.execute('''
+                CREATE TABLE IF NOT EXISTS fair_share (
+                    priority TEXT NOT NULL,
+                    client TEXT NOT NULL,
+                    last_finish REAL NOT NULL,
+                    PRIMARY KEY (priority, client)
+                )
+            ''')
+            conn.execute('CREATE TABLE IF NOT EXISTS vtime (priority TEXT PRIMARY KEY, value REAL NOT NULL)')
+
+
+def _count(conn, name, delta=1):
+    conn.execute(
+        'INSERT INTO counters VALUES (?, ?) ON CONFLICT (name) DO UPDATE SET value = value + ?',
+        (name, delta, delta)
+    )
+
+
+class SharedTaskStore:
+    """Task records in the shared database.
+
+    Every method reads or writes the database, so all processes see the same
+    records. Output of finished tasks is still held by the process that ran
+    them; `on_evict` is called with ids of such tasks once they fall outside
+    the in-memory window (count or age), so spilled output can be freed.
+    Finished records are deleted from the database after `retention` seconds.
+
+    A task in `processing` holds a lease that the process running it renews
+    every `interval` seconds. If that process dies, the lease runs out after
+    `lease` seconds and the task is put back in the queue.
+    """
+
+    shared = True
+
+    def __init__(self, db, max_tasks=10000, max_age=3600, retention=7 * 86400,
+                 on_evict=None, logger=None, interval=1.0, lease=30.0):
+        self.db = db
+        self.max_tasks = max_tasks
+        self.max_age = max_age
+        self.retention = retention
+        self.on_evict = on_evict
+        self.logger = logger
+        self.interval = interval
+        self.lease = lease
+        self._lock = threading.Lock()
+        self._local_finished = OrderedDict()  # task_id -> finished_at, for tasks run here
+        self._local_running = set()  # ids of tasks this process holds the lease of
+        self._thread = None
+
+    def __len__(self):
+        (count,) = self.db.connection().execute('SELECT COUNT(*) FROM tasks').fetchone()
+        return count
+
+    def __contains__(self, task_id):
+        row = self.db.connection().execute('SELECT 1 FROM tasks WHERE id = ?', (task_id,)).fetchone()
+        return row is not None
+
+    def add(self, task):
+        self.add_many([task])
+
+    def add_many(self, task_list):
+        """Insert new tasks in one transaction, assigning each its `seq`"""
+        with self.db.transaction() as conn:
+            for task in task_list:
+                finished_at = time.time() if task['status'] in FINISHED_STATUSES else None
+                cursor = conn.execute(
+                    'INSERT INTO tasks (id, status, created_at, finished_at, client, record) '
+                    'VALUES (?, ?, ?, ?, ?, ?)',
+                    (task['id'], task['status'], task.get('created_at'), finished_at,
+                     task.get('client'), '{}')
+                )
+                task['seq'] = cursor.lastrowid
+                conn.execute('UPDATE tasks SET record = ? WHERE seq = ?',
+                             (json.dumps(task, default=str), task['seq']))
+                _count(conn, f"entered:{task['status']}")
+
+    def get(self, task_id, default=None):
+        """Current record for `task_id` (a copy)"""
+        row = self.db.connection().execute('SELECT record FROM tasks WHERE id = ?', (task_id,)).fetchone()
+        return json.loads(row[0]) if row else default
+
+    def set_status(self, task_id, status, **fields):
+        """Move a task to `status`, updating other record fields along with it.
+
+        Finished states are final: returns None instead of leaving one, so a
+        process cannot start or overwrite a task another process has finished.
+        """
+        finished = status in FINISHED_STATUSES
+        if status != 'processing':
+            with self._lock:
+                self._local_running.discard(task_id)
+        with self.db.transaction() as conn:
+            row = conn.execute('SELECT record FROM tasks WHERE id = ?', (task_id,)).fetchone()
+            if row is None:
+                return None
+            task = json.loads(row[0])
+            if task['status'] in FINISHED_STATUSES:
+                return None
+            task.update(fields)
+            if task['status'] != status:
+                task['status'] = status
+                _count(conn, f'entered:{status}')
+            conn.execute(
+                'UPDATE tasks SET status = ?, record = ?, finished_at = ?, lease_until = ?, '
+                'queued = CASE WHEN ? THEN 0 ELSE queued END WHERE id = ?',
+                (status, json.dumps(task, default=str), time.time() if finished else None,
+                 time.time() + self.lease if status == 'processing' else None, finished, task_id)
+            )
+        with self._lock:
+            if finished:
+                self._local_finished[task_id] = time.monotonic()
+            elif status == 'processing':
+                self._local_running.add(task_id)
+        return task
+
+    def add_follower(self, leader_id, follower_id):
+        """Record that `follower_id` waits for `leader_id`'s result; False if the
+        leader has already finished"""
+        with self.db.transaction() as conn:
+            row = conn.execute('SELECT record FROM tasks WHERE id = ?', (leader_id,)).fetchone()
+            if row is None:
+                return False
+            leader = json.loads(row[0])
+            if leader['status'] in FINISHED_STATUSES:
+                return False
+            leader.setdefault('followers', []).append(follower_id)
+            conn.execute('UPDATE tasks SET record = ? WHERE id = ?', (json.dumps(leader, default=str), leader_id))
+        return True
+
+    def list(self, status=None, before=None, since=None, limit=100):
+        """Newest-first page of tasks; same arguments and result as TaskStore.list"""
+        conn = self.db.connection()
+        if isinstance(since, str):
+            (since,) = conn.execute('SELECT MAX(seq) FROM tasks WHERE created_at <= ?', (since,)).fetchone()
+        where, params = ['seq > ?'], [since or 0]
+        if status is not None:
+            where.append('status = ?')
+            params.append(status)
+        (total,) = conn.execute(f"SELECT COUNT(*) FROM tasks WHERE {' AND '.join(where)}", params).fetchone()
+        if before is not None:
+            where.append('seq < ?')
+            params.append(before)
+        rows = conn.execute(
+            f"SELECT record FROM tasks WHERE {' AND '.join(where)} ORDER BY seq DESC LIMIT ?",
+            params + [limit + 1]
+        ).fetchall()
+        page = [json.loads(record) for (record,) in rows[:limit]]
+        next_cursor = page[-1]['seq'] if len(rows) > limit else None
+        return page, total, next_cursor
+
+    def load(self, task_id):
+        return self.get(task_id)
+
+    def load_many(self, task_ids):
+        """Records for many ids, as {id: task}"""
+        found = {}
+        task_ids = list(task_ids)
+        conn = self.db.connection()
+        # Stay well below SQLite's bound parameter limit
+        for start in range(0, len(task_ids), 500):
+            chunk = task_ids[start:start + 500]
+            cursor = conn.execute(
+                f"SELECT id, record FROM tasks WHERE id IN ({','.join('?' * len(chunk))})",
+                chunk
+            )
+            for task_id, record in cursor:
+                found[task_id] = json.loads(record)
+        return found
+
+    def cancel_requested(self, task_ids):
+        """Ids among `task_ids` whose record asks for cancellation"""
+        task_ids = list(task_ids)
+        if not task_ids:
+            return []
+        rows = self.db.connection().execute(
+            f"SELECT id FROM tasks WHERE id IN ({','.join('?' * len(task_ids))}) "
+            "AND json_extract(record, '$.cancel_requested')",
+            task_ids
+        )
+        return [task_id for (task_id,) in rows]
+
+    def status_counts(self):
+        """{'entered': tasks that ever reached each status, 'current': tasks in it now}"""
+        conn = self.db.connection()
+        entered = {status: 0 for status in TASK_STATUSES}
+        for name, value in conn.execute("SELECT name, value FROM counters WHERE name LIKE 'entered:%'"):
+            entered[name.split(':', 1)[1]] = value
+        current = {status: 0 for status in TASK_STATUSES}
+        for status in ('pending', 'processing'):
+            (current[status],) = conn.execute(
+                'SELECT COUNT(*) FROM tasks WHERE status = ?', (status,)
+            ).fetchone()
+        return {'entered': entered, 'current': current}
+
+    def start(self):
+        """Start the background maintenance thread"""
+        self._thread = threading.Thread(target=self._maintain, name='task-store', daemon=True)
+        self._thread.start()
+
+    def release_local(self):
+        """Hand tasks run here that left the window to `on_evict`; returns how many"""
+        released = []
+        cutoff = time.monotonic() - self.max_age
+        with self._lock:
+            while self._local_finished:
+                task_id, finished_at = next(iter(self._local_finished.items()))
+                if len(self._local_finished) <= self.max_tasks and finished_at >= cutoff:
+                    break
+                del self._local_finished[task_id]
+                released.append(task_id)
+        if released and self.on_evict is not None:
+            self.on_evict(released)
+        return len(released)
+
+    def renew_leases(self):
+        """Extend the leases of the tasks this process is running"""
+        with self._lock:
+            running = list(self._local_running)
+        if not running:
+            return
+        with self.db.transaction() as conn:
+            conn.execute(
+                "UPDATE tasks SET lease_until = ? WHERE status = 'processing' "
+                "AND id IN (SELECT value FROM json_each(?))",
+                (time.time() + self.lease, json.dumps(running))
+            )
+
+    def requeue_expired(self):
+        """Put tasks whose runner stopped renewing their lease back in the queue;
+        returns their ids"""
+        requeued = []
+        with self.db.transaction() as conn:
+            rows = conn.execute(
+                "SELECT seq, id, record FROM tasks WHERE status = 'processing' AND lease_until < ?",
+                (time.time(),)
+            ).fetchall()
+            for seq, task_id, record in rows:
+                task = json.loads(record)
+                task['status'] = 'pending'
+                task.pop('started_at', None)
+                task['requeued'] = task.get('requeued', 0) + 1
+                # Same rank and tags as before, so it goes ahead of tasks queued after it
+                conn.execute(
+                    "UPDATE tasks SET status = 'pending', queued = 1, lease_until = NULL, record = ? "
+                    "WHERE seq = ?",
+                    (json.dumps(task, default=str), seq)
+                )
+                requeued.append(task_id)
+            if requeued:
+                _count(conn, 'requeued', len(requeued))
+        if requeued and self.logger:
+            self.logger.warning(f"Requeued {len(requeued)} task(s) whose worker process stopped: {requeued}")
+        return requeued
+
+    def prune(self):
+        """Delete finished records older than the retention period"""
+        with self.db.transaction() as conn:
+            cursor = conn.execute('DELETE FROM tasks WHERE finished_at < ?', (time.time() - self.retention,))
+        return cursor.rowcount
+
+    def _maintain(self):
+        last_prune = 0
+        while True:
+            time.sleep(self.interval)
+            try:
+                self.release_local()
+                self.renew_leases()
+                self.requeue_expired()
+                if self.retention and time.monotonic() - last_prune > 60:
+                    last_prune = time.monotonic()
+                    self.prune()
+            except Exception as e:
+                if self.logger:
+                    self.logger.error(f"Task store maintenance failed: {e}")
+
+    def get_stats(self):
+        with self._lock:
+            local = len(self._local_finished)
+        row = self.db.connection().execute("SELECT value FROM counters WHERE name = 'requeued'").fetchone()
+        return {
+            'backend': 'sqlite',
+            'db_path': self.db.db_path,
+            'records': len(self),
+            'retention_seconds': self.retention,
+            'lease_seconds': self.lease,
+            'requeued': row[0] if row else 0,
+            'local_outputs': local
+        }
+
+    @property
+    def total(self):
+        """Tasks known to the store"""
+        return len(self)
+
+
+class SharedTaskQueue:
+    """TaskQueue over the shared database.
+
+    Uses the same scheduling as TaskQueue (strict priorities, start-time fair
+    queuing between clients within a priority) with the virtual times kept in
+    the database, and claims tasks in a write transaction so each is handed
+    to exactly one process. Waiting getters are woken by puts from their own
+    process and otherwise poll every `poll_interval` seconds.
+    """
+
+    def __init__(self, db, weights=None, default_weight=1.0, poll_interval=0.1):
+        self.db = db
+        self.weights = dict(weights or {})
+        self.default_weight = default_weight
+        self.poll_interval = poll_interval
+        self._cond = threading.Condition()
+
+    def __len__(self):
+        (count,) = self.db.connection().execute('SELECT COUNT(*) FROM tasks WHERE queued = 1').fetchone()
+        return count
+
+    def put(self, task_id, client=None, priority='normal'):
+        self.put_many([(task_id, client, priority)])
+
+    def put_many(self, items):
+        """Enqueue (task_id, client, priority) tuples in one transaction"""
+        items = list(items)
+        if not items:
+            return
+        with self.db.transaction() as conn:
+            for task_id, client, priority in items:
+                self._push(conn, task_id, client, priority or 'normal')
+        with self._cond:
+            self._cond.notify(len(items))
+
+    def _push(self, conn, task_id, client, priority):
+        client = client or ''
+        row = conn.execute('SELECT value FROM vtime WHERE priority = ?', (priority,)).fetchone()
+        vtime = row[0] if row else 0.0
+        row = conn.execute('SELECT last_finish FROM fair_share WHERE priority = ? AND client = ?',
+                           (priority, client)).fetchone()
+        start = max(vtime, row[0] if row else 0.0)
+        finish = start + 1.0 / self.weights.get(client, self.default_weight)
+        conn.execute(
+            'INSERT INTO fair_share VALUES (?, ?, ?) '
+            'ON CONFLICT (priority, client) DO UPDATE SET last_finish = excluded.last_finish',
+            (priority, client, finish)
+        )
+        conn.execute(
+            "UPDATE tasks SET queued = 1, rank = ?, start_tag = ?, finish_tag = ? "
+            "WHERE id = ? AND status = 'pending'",
+            (PRIORITIES.index(priority), start, finish, task_id)
+        )
+
+    def get(self, timeout=None):
+        """Claim the next task id to run; raises queue.Empty after `timeout` seconds"""
+        deadline = None if timeout is None else time.monotonic() + timeout
+        while True:
+            task_id = self._claim()
+            if task_id is not None:
+                return task_id
+            wait = self.poll_interval
+            if deadline is not None:
+                wait = min(wait, deadline - time.monotonic())
+                if wait <= 0:
+                    raise queue.Empty
+            with self._cond:
+                self._cond.wait(wait)
+
+    def _claim(self):
+        with self.db.transaction() as conn:
+            row = conn.execute(
+                'SELECT seq, id, rank, start_tag FROM tasks WHERE queued = 1 '
+                'ORDER BY rank, finish_tag, seq LIMIT 1'
+            ).fetchone()
+            if row is None:
+                return None
+            seq, task_id, rank, start = row
+            priority = PRIORITIES[rank]
+            conn.execute('UPDATE tasks SET queued = 0 WHERE seq = ?', (seq,))
+            conn.execute(
+                'INSERT INTO vtime VALUES (?, ?) ON CONFLICT (priority) DO UPDATE SET value = excluded.value',
+                (priority, start)
+            )
+            # Finish tags at or behind the virtual time no longer affect scheduling
+            conn.execute('DELETE FROM fair_share WHERE priority = ? AND last_finish <= ?', (priority, start))
+        return task_id
+
+    def remove(self, task_id):
+        """Take a queued task out of the queue; False if it is not queued"""
+        with self.db.transaction() as conn:
+            cursor = conn.execute('UPDATE tasks SET queued = 0 WHERE id = ? AND queued = 1', (task_id,))
+        return cursor.rowcount > 0
+
+    def positions(self, task_ids):
+        """0-based dispatch order of the given queued tasks, as {task_id: position}"""
+        task_ids = list(task_ids)
+        if not task_ids:
+            return {}
+        # One pass over the queue index, however many ids are asked for
+        rows = self.db.connection().execute(
+            'SELECT id, position FROM ('
+            'SELECT id, ROW_NUMBER() OVER (ORDER BY rank, finish_tag, seq) - 1 AS position '
+            'FROM tasks WHERE queued = 1'
+            ') WHERE id IN (SELECT value FROM json_each(?))',
+            (json.dumps(task_ids),)
+        )
+        return dict(rows)
+
+    def get_stats(self):
+        conn = self.db.connection()
+        depth = {priority: 0 for priority in PRIORITIES}
+        for rank, count in conn.execute('SELECT rank, COUNT(*) FROM tasks WHERE queued = 1 GROUP BY rank'):
+            depth[PRIORITIES[rank]] = count
+        clients = conn.execute(
+            'SELECT client, COUNT(*) AS n FROM tasks WHERE queued = 1 GROUP BY client ORDER BY n DESC'
+        ).fetchall()
+        return {
+            'queued': sum(depth.values()),
+            'by_priority': depth,
+            'clients': len(clients),
+            'top_clients': dict(clients[:10])
+        }
+
+
+def shared_state_from_env(on_evict=None, logger=None):
+    """(SharedTaskStore, SharedTaskQueue) on SHARED_STATE_DB, or None if it is unset"""
+    db_path = os.getenv('SHARED_STATE_DB')
+    if not db_path:
+        return None
+    db = SharedDB(db_path)
+    store = SharedTaskStore(
+        db,
+        max_tasks=int(os.getenv('TASK_STORE_MAX_TASKS', 10000)),
+        max_age=float(os.getenv('TASK_STORE_MAX_AGE', 3600)),
+        retention=float(os.getenv('TASK_ARCHIVE_TTL', 7 * 86400)),
+        on_evict=on_evict,
+        logger=logger,
+        lease=float(os.getenv('TASK_LEASE_SECONDS', 30))
+    )
+    return store, SharedTaskQueue(db, load_client_weights())
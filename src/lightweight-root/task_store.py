@@ -0,0 +1,392 @@
+#!/usr/bin/env python3
+"""
+Task store - bounded in-memory task records with a SQLite archive
+
+Recent and unfinished tasks live in memory. Finished tasks are kept while they
+fit the window (count, bytes and age); older ones are moved by a background
+thread into a compact SQLite archive, where they can still be looked up by id.
+
+Every task gets a sequence number on insertion. Sorted per-status lists of
+sequence numbers back the task listing, so filtered, paginated queries cost a
+binary search plus the page itself rather than a sort over all tasks.
+"""
+import json
+import os
+import sqlite3
+import threading
+import time
+import zlib
+from bisect import bisect_left, bisect_right, insort
+from collections import OrderedDict
+
+TASK_STATUSES = ('pending', 'processing', 'completed', 'failed', 'cancelled', 'expired')
+FINISHED_STATUSES = ('completed', 'failed', 'cancelled', 'expired')
+
+
+class TaskArchive:
+    """Compressed task records on disk, keyed by id"""
+
+    def __init__(self, db_path='data/tasks.db'):
+        self.db_path = db_path
+        directory = os.path.dirname(self.db_path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self._init_db()
+
+    def _connect(self):
+        return sqlite3.connect(self.db_path, timeout=30)
+
+    def _init_db(self):
+        """Initialize database schema"""
+        conn = self._connect()
+        conn.execute('PRAGMA journal_mode=WAL')
+        conn.execute('''
+            CREATE TABLE IF NOT EXISTS tasks (
+                id TEXT PRIMARY KEY,
+                status TEXT NOT NULL,
+                created_at TEXT,
+                archived_at REAL NOT NULL,
+                record BLOB NOT NULL
+            )
+        ''')
+        conn.execute('CREATE INDEX IF NOT EXISTS tasks_archived_at ON tasks (archived_at)')
+        conn.commit()
+        conn.close()
+
+    def put_many(self, task_list):
+        """Archive finished tasks in one transaction"""
+        now = time.time()
+        rows = [
+            (task['id'], task['status'], task.get('created_at'), now,
+             zlib.compress(json.dumps(task, default=str).encode()))
+            for task in task_list
+        ]
+        conn = self._connect()
+        conn.execute('PRAGMA synchronous=NORMAL')
+        conn.executemany('INSERT OR REPLACE INTO tasks VALUES (?, ?, ?, ?, ?)', rows)
+        conn.commit()
+        conn.close()
+
+    def get_many(self, task_ids):
+        """Archived records for the given ids, as {id: task}"""
+        found = {}
+        task_ids = list(task_ids)
+        conn = self._connect()
+        # Stay well below SQLite's bound parameter limit
+        for start in range(0, len(task_ids), 500):
+            chunk = task_ids[start:start + 500]
+            cursor = conn.execute(
+                f"SELECT id, record FROM tasks WHERE id IN ({','.join('?' * len(chunk))})",
+                chunk
+            )
+            for task_id, record in cursor:
+                found[task_id] = json.loads(zlib.decompress(record))
+        conn.close()
+        return found
+
+    def prune(self, max_age):
+        """Delete records archived more than `max_age` seconds ago"""
+        conn = self._connect()
+        cursor = conn.execute('DELETE FROM tasks WHERE archived_at < ?', (time.time() - max_age,))
+        conn.commit()
+        conn.close()
+        return cursor.rowcount
+
+    def count(self):
+        conn = self._connect()
+        (count,) = conn.execute('SELECT COUNT(*) FROM tasks').fetchone()
+        conn.close()
+        return count
+
+
+class TaskStore:
+    """Task records by id, bounded in memory, spilling finished tasks to an archive.
+
+    `get` and the mapping methods only see tasks held in memory and never touch
+    disk, so they are safe to call under the worker's task lock. `load` falls
+    back to the archive for tasks that have been evicted.
+
+    `on_evict` is called from the maintenance thread with the ids of tasks that
+    left memory, so their other resources (e.g. spilled output) can be freed.
+    """
+
+    shared = False  # records are private to this process
+
+    def __init__(self, max_tasks=10000, max_bytes=128 * 1024 * 1024, max_age=3600,
+                 archive=None, archive_ttl=7 * 86400, on_evict=None, logger=None,
+                 interval=1.0):
+        self.max_tasks = max_tasks
+        self.max_bytes = max_bytes
+        self.max_age = max_age
+        self.archive = archive
+        self.archive_ttl = archive_ttl
+        self.on_evict = on_evict
+        self.logger = logger
+        self.interval = interval
+        self._tasks = {}
+        self._by_seq = {}
+        self._index = {status: [] for status in (None,) + TASK_STATUSES}  # ascending seqs; None = all
+        self._seq = 0
+        self._finished = OrderedDict()  # task_id -> (size, finished_at), oldest first
+        self._pending = {}  # evicted, not yet written to the archive
+        self._bytes = 0
+        self._archived = archive.count() if archive is not None else 0
+        self._evicted = 0
+        self._entered = {status: 0 for status in TASK_STATUSES}  # tasks that ever reached each status
+        self._cond = threading.Condition()
+        self._thread = None
+
+    def __len__(self):
+        with self._cond:
+            return len(self._tasks)
+
+    def __contains__(self, task_id):
+        with self._cond:
+            return task_id in self._tasks
+
+    def add(self, task):
+        """Insert a new task, assigning its `seq`; finished tasks (e.g. cache hits)
+        count toward the window at once"""
+        with self._cond:
+            self._seq += 1
+            task['seq'] = self._seq
+            self._tasks[task['id']] = task
+            self._by_seq[self._seq] = task
+            self._index[None].append(self._seq)
+            self._index.setdefault(task['status'], []).append(self._seq)
+            self._entered[task['status']] += 1
+            if task['status'] in FINISHED_STATUSES:
+                self._mark_finished(task)
+
+    def add_many(self, task_list):
+        for task in task_list:
+            self.add(task)
+
+    def get(self, task_id, default=None):
+        """In-memory record for `task_id` (the live dict, not a copy)"""
+        with self._cond:
+            task = self._tasks.get(task_id)
+            if task is None:
+                task = self._pending.get(task_id, default)
+            return task
+
+    def set_status(self, task_id, status, **fields):
+        """Move a task to `status`, updating other record fields along with it.
+
+        Finished states are final: returns None instead of leaving one.
+        Finished tasks become eligible for eviction.
+        """
+        with self._cond:
+            task = self._tasks.get(task_id)
+            if task is None or task['status'] in FINISHED_STATUSES:
+                return None
+            task.update(fields)
+            if task['status'] != status:
+                self._unindex(task['status'], task['seq'])
+                task['status'] = status
+                insort(self._index.setdefault(status, []), task['seq'])
+                self._entered[status] += 1
+            if status in FINISHED_STATUSES:
+                self._mark_finished(task)
+            return task
+
+    def add_follower(self, leader_id, follower_id):
+        """Record that `follower_id` waits for `leader_id`'s result; False if the
+        leader has already finished"""
+        with self._cond:
+            leader = self._tasks.get(leader_id)
+            if leader is None or leader['status'] in FINISHED_STATUSES:
+                return False
+            leader.setdefault('followers', []).append(follower_id)
+            return True
+
+    def _unindex(self, status, seq):
+        seqs = self._index[status]
+        i = bisect_left(seqs, seq)
+        if i < len(seqs) and seqs[i] == seq:
+            del seqs[i]
+
+    def _mark_finished(self, task):
+        size = len(json.dumps(task, default=str))
+        previous = self._finished.pop(task['id'], None)
+        if previous is not None:
+            self._bytes -= previous[0]
+        self._finished[task['id']] = (size, time.monotonic())
+        self._bytes += size
+        if self._over_budget():
+            self._cond.notify()
+
+    def _over_budget(self):
+        """Whether finished tasks exceed the window; unfinished ones cannot be evicted and do not count"""
+        return len(self._finished) > self.max_tasks or self._bytes > self.max_bytes
+
+    def list(self, status=None, before=None, since=None, limit=100):
+        """Newest-first page of in-memory tasks.
+
+        `status` filters by status, `before` is the cursor returned by the
+        previous page (a seq), and `since` is a seq or an ISO timestamp: only
+        tasks created after it are listed. Returns (tasks, total, next_cursor),
+        where `total` counts all matches and `next_cursor` is None on the last
+        page.
+        """
+        with self._cond:
+            seqs = self._index.get(status, [])
+            hi = bisect_left(seqs, before) if before is not None else len(seqs)
+            lo = 0
+            if since is not None:
+                if isinstance(since, str):
+                    since = self._seq_before(since)
+                lo = bisect_right(seqs, since)
+            start = max(lo, hi - limit)
+            page = [dict(self._by_seq[seq]) for seq in reversed(seqs[start:hi])]
+            total = len(seqs) - lo
+            next_cursor = seqs[start] if start > lo else None
+        return page, total, next_cursor
+
+    def _seq_before(self, timestamp):
+        """Largest seq of a task created at or before `timestamp`, 0 if none"""
+        seqs = self._index[None]
+        i = bisect_right(seqs, timestamp, key=lambda seq: self._by_seq[seq]['created_at'])
+        return seqs[i - 1] if i else 0
+
+    def load(self, task_id):
+        """Record for `task_id` from memory or the archive, or None"""
+        return self.load_many([task_id]).get(task_id)
+
+    def load_many(self, task_ids):
+        """Records for many ids from memory or the archive, as {id: task}"""
+        found = {}
+        missing = []
+        with self._cond:
+            for task_id in task_ids:
+                task = self._tasks.get(task_id) or self._pending.get(task_id)
+                if task is not None:
+                    found[task_id] = dict(task)
+                else:
+                    missing.append(task_id)
+        if missing and self.archive is not None:
+            found.update(self.archive.get_many(missing))
+        return found
+
+    def cancel_requested(self, task_ids):
+        """Ids among `task_ids` whose record asks for cancellation"""
+        with self._cond:
+            return [task_id for task_id in task_ids
+                    if (self._tasks.get(task_id) or {}).get('cancel_requested')]
+
+    def status_counts(self):
+        """{'entered': tasks that ever reached each status, 'current': tasks in it now}"""
+        with self._cond:
+            return {
+                'entered': dict(self._entered),
+                'current': {status: len(self._index[status]) for status in TASK_STATUSES}
+            }
+
+    def start(self):
+        """Start the background eviction thread"""
+        self._thread = threading.Thread(target=self._maintain, name='task-store', daemon=True)
+        self._thread.start()
+
+    def _select_victims(self):
+        """Pop finished tasks that fall outside the window (call with the lock held)"""
+        victims = []
+        cutoff = time.monotonic() - self.max_age
+        while self._finished:
+            task_id, (size, finished_at) = next(iter(self._finished.items()))
+            if not self._over_budget() and finished_at >= cutoff:
+                break
+            del self._finished[task_id]
+            self._bytes -= size
+            task = self._tasks.pop(task_id)
+            del self._by_seq[task['seq']]
+            self._unindex(None, task['seq'])
+            self._unindex(task['status'], task['seq'])
+            victims.append(task)
+        return victims
+
+    def evict(self):
+        """Move finished tasks outside the window to the archive; returns how many"""
+        with self._cond:
+            victims = self._select_victims()
+            for task in victims:
+                self._pending[task['id']] = task
+        if not victims:
+            return 0
+
+        archived = 0
+        try:
+            if self.archive is not None:
+                self.archive.put_many(victims)
+                archived = len(victims)
+        except sqlite3.Error as e:
+            if self.logger:
+                self.logger.error(f"Task archive write failed, dropping {len(victims)} tasks: {e}")
+        finally:
+            with self._cond:
+                for task in victims:
+                    self._pending.pop(task['id'], None)
+                self._evicted += len(victims)
+                self._archived += archived
+
+        if self.on_evict is not None:
+            self.on_evict([task['id'] for task in victims])
+        return len(victims)
+
+    def _maintain(self):
+        last_prune = 0
+        evicted = 0
+        while True:
+            with self._cond:
+                if not evicted or not self._over_budget():
+                    self._cond.wait(self.interval)
+            evicted = 0
+            try:
+                evicted = self.evict()
+                if self.archive is not None and self.archive_ttl and time.monotonic() - last_prune > 60:
+                    last_prune = time.monotonic()
+                    pruned = self.archive.prune(self.archive_ttl)
+                    with self._cond:
+                        self._archived -= pruned
+            except Exception as e:
+                if self.logger:
+                    self.logger.error(f"Task store maintenance failed: {e}")
+
+    def get_stats(self):
+        with self._cond:
+            return {
+                'in_memory': len(self._tasks),
+                'finished_in_memory': len(self._finished),
+                'memory_bytes': self._bytes,
+                'max_tasks': self.max_tasks,
+                'max_bytes': self.max_bytes,
+                'max_age_seconds': self.max_age,
+                'archived': self._archived,
+                'evicted': self._evicted
+            }
+
+    @property
+    def total(self):
+        """Tasks known to the store, in memory or archived"""
+        with self._cond:
+            return len(self._tasks) + len(self._pending) + self._archived
+
+
+def task_store_from_env(on_evict=None, logger=None):
+    """Build the task store from TASK_STORE_* settings"""
+    db_path = os.getenv('TASK_STORE_DB', 'data/tasks.db')
+    archive = None
+    if db_path:
+        try:
+            archive = TaskArchive(db_path)
+        except (OSError, sqlite3.Error) as e:
+            if logger:
+                logger.warning(f"Task archive disabled: {e}")
+    return TaskStore(
+        max_tasks=int(os.getenv('TASK_STORE_MAX_TASKS', 10000)),
+        max_bytes=int(float(os.getenv('TASK_STORE_MAX_MB', 128)) * 1024 * 1024),
+        max_age=float(os.getenv('TASK_STORE_MAX_AGE', 3600)),
+        archive=archive,
+        archive_ttl=float(os.getenv('TASK_ARCHIVE_TTL', 7 * 86400)),
+        on_evict=on_evict,
+        logger=logger
+    )
@@ -0,0 +1,101 @@
+#!/usr/bin/env python3
+"""
+The NumPy and pure-Python compute backends must agree: same results, same errors
+
+Run with: python -m pytest test_compute.py
+"""
+import math
+
+import pytest
+
+import compute
+
+pytest.importorskip('numpy')
+
+N = 70  # above NUMPY_MIN_ELEMENTS, so the 'numpy' backend really uses NumPy
+INF, NAN = math.inf, math.nan
+
+EDGE_CASES = [
+    {'operation': 'power', 'a': [2] * N, 'b': [-1] * N},
+    {'operation': 'power', 'a': [2, 3] * 35, 'b': [2, -1] * 35},
+    {'operation': 'power', 'a': [0] * N, 'b': [-1] * N},
+    {'operation': 'power', 'a': [0.0, -0.0] * 35, 'b': [-1, -2] * 35},
+    {'operation': 'power', 'a': [-8.0] * N, 'b': [0.5] * N},
+    {'operation': 'power', 'a': [10.0, -10.0] * 35, 'b': [400, 401] * 35},
+    {'operation': 'power', 'a': [3] * N, 'b': [50] * N},
+    {'operation': 'power', 'a': [10] * N, 'b': [5000] * N},
+    {'operation': 'divide', 'a': [1, -1, 0, NAN] * 20, 'b': [0] * 80},
+    {'operation': 'exp', 'a': [1000, -1000, 1] * 30},
+    {'operation': 'log', 'a': [0, -1, 1] * 30},
+    {'operation': 'sqrt', 'a': [-4, 4] * 35},
+    {'operation': 'maximum', 'a': [NAN, 1] * 35, 'b': [1, NAN] * 35},
+    {'operation': 'minimum', 'a': [NAN, 1] * 35, 'b': [1, NAN] * 35},
+    {'operation': 'max', 'numbers': [1, NAN] * 35},
+    {'operation': 'min', 'numbers': [NAN, 1] * 35},
+    {'operation': 'add', 'a': [True] * N, 'b': [True] * N},
+    {'operation': 'subtract', 'a': [True] * N, 'b': [False] * N},
+    {'operation': 'negative', 'a': [True, False] * 35},
+    {'operation': 'add', 'a': [2 ** 63] * N, 'b': [1] * N},
+    {'operation': 'multiply', 'a': [2 ** 40] * N, 'b': [2 ** 40] * N},
+    {'operation': 'sum', 'numbers': [2 ** 62] * N},
+    {'operation': 'add', 'a': [[1, 2], [3]] * 35, 'b': [1]},
+    {'operation': 'add', 'a': [[1, 2], [3, 4]] * 35, 'b': [[1, 2], 3] * 35},
+    {'operation': 'sum', 'numbers': [[1, 2], [3]] * 35},
+    {'operation': 'add', 'a': [[1, 2]] * N, 'b': [1, 2, 3]},
+    {'operation': 'add', 'a': [1, 'x'] * 35, 'b': [1] * N},
+    {'operation': 'matmul', 'a': [[1, 2], [3]] * 35, 'b': [[1], [2]]},
+    {'operation': 'matmul', 'a': [[1] * N], 'b': [[1]] * 69},
+    {'operation': 'mean', 'numbers': [[1, 2]] * N, 'axis': 2},
+]
+
+
+def _outcome(spec, backend):
+    try:
+        return 'result', compute.compute(spec, backend)
+    except (ArithmeticError, TypeError, ValueError) as e:
+        return 'error', str(e)
+
+
+def _same(x, y):
+    if isinstance(x, list) and isinstance(y, list):
+        return len(x) == len(y) and all(_same(a, b) for a, b in zip(x, y))
+    if isinstance(x, (int, float)) and isinstance(y, (int, float)):
+        if math.isnan(x) or math.isnan(y):
+            return math.isnan(x) and math.isnan(y)
+        return x == y or math.isclose(x, y, rel_tol=1e-12)
+    return x == y
+
+
+def _small(spec):
+    """The first few elements of each operand: the same case below the NumPy cutoff"""
+    return {key: value[:2] if isinstance(value, list) else value for key, value in spec.items()}
+
+
+@pytest.mark.parametrize('spec', EDGE_CASES)
+def test_backends_agree(spec):
+    numpy_kind, numpy_value = _outcome(spec, 'numpy')
+    python_kind, python_value = _outcome(spec, 'python')
+    assert numpy_kind == python_kind, (numpy_value, python_value)
+    assert _same(numpy_value, python_value), (numpy_value, python_value)
+
+
+@pytest.mark.parametrize('spec', EDGE_CASES)
+def test_result_does_not_depend_on_length(spec, monkeypatch):
+    monkeypatch.setattr(compute, 'NUMPY_MIN_ELEMENTS', 0)
+    small = _small(spec)
+    numpy_kind, numpy_value = _outcome(small, 'numpy')
+    python_kind, python_value = _outcome(small, 'python')
+    assert numpy_kind == python_kind, (numpy_value, python_value)
+    assert _same(numpy_value, python_value), (numpy_value, python_value)
+
+
+def test_negative_integer_power():
+    spec = {'operation': 'power', 'a': [2] * N, 'b': [-1] * N}
+    assert compute.compute(spec, 'numpy') == [0.5] * N
+    assert compute.compute(_small(spec), 'numpy') == [0.5, 0.5]
+
+
+def test_ragged_operands_are_rejected():
+    for backend in compute.BACKENDS:
+        with pytest.raises(compute.ComputeError, match='regular arrays'):
+            compute.compute({'operation': 'add', 'a': [[1, 2], [3]], 'b': 1}, backend)
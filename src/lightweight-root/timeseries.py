@@ -0,0 +1,184 @@
+#!/usr/bin/env python3
+"""
+Time series - compact metric history in typed-array ring buffers
+
+Samples of a fixed set of metrics share one time axis. Raw samples are kept in
+a ring with running sums and sliding-window maxima, so the summary of the
+retained window is O(1) per sample. Every sample is also folded into rollups
+(1 s, 1 min, 1 h buckets holding mean/min/max) that reach back days while the
+whole history stays a few hundred KB.
+"""
+from array import array
+from collections import deque
+
+# (bucket seconds, buckets kept): 10 minutes at 1 s, 2 days at 1 min, 30 days at 1 h
+ROLLUPS = ((1, 600), (60, 2880), (3600, 720))
+RESOLUTIONS = {'1s': 1, '1m': 60, '1h': 3600}
+
+
+class Ring:
+    """Fixed-capacity ring of timestamped rows with float32 columns"""
+
+    def __init__(self, columns, capacity):
+        self.capacity = capacity
+        self.times = array('d', bytes(8 * capacity))
+        self.columns = {name: array('f', bytes(4 * capacity)) for name in columns}
+        self.start = 0
+        self.count = 0
+
+    def push(self, timestamp, row):
+        """Store a row, overwriting the oldest when full; returns its slot"""
+        if self.count < self.capacity:
+            index = (self.start + self.count) % self.capacity
+            self.count += 1
+        else:
+            index = self.start
+            self.start = (self.start + 1) % self.capacity
+        self.times[index] = timestamp
+        for name, value in row.items():
+            self.columns[name][index] = value
+        return index
+
+    def slots(self, limit=None):
+        """Slots from oldest to newest, the last `limit` only if given"""
+        count = self.count if limit is None else min(limit, self.count)
+        first = self.start + self.count - count
+        return [(first + i) % self.capacity for i in range(count)]
+
+    @property
+    def nbytes(self):
+        return self.times.itemsize * self.capacity + sum(
+            column.itemsize * self.capacity for column in self.columns.values())
+
+
+class SampleRing(Ring):
+    """Raw samples with the mean and max of the retained window kept up to date"""
+
+    def __init__(self, names, capacity):
+        super().__init__(names, capacity)
+        self.names = names
+        self.appended = 0
+        self._sums = dict.fromkeys(names, 0.0)
+        self._maxima = {name: deque() for name in names}  # (sequence, value), values decreasing
+
+    def append(self, timestamp, values):
+        if self.count == self.capacity:
+            oldest = self.start
+            for name in self.names:
+                self._sums[name] -= self.columns[name][oldest]
+                maxima = self._maxima[name]
+                if maxima and maxima[0][0] <= self.appended - self.capacity:
+                    maxima.popleft()
+        index = self.push(timestamp, values)
+        for name in self.names:
+            value = self.columns[name][index]  # as stored, so removal later subtracts the same
+            self._sums[name] += value
+            maxima = self._maxima[name]
+            while maxima and maxima[-1][1] <= value:
+                maxima.pop()
+            maxima.append((self.appended, value))
+        self.appended += 1
+        if self.appended % self.capacity == 0:
+            # Re-add once per lap so floating-point error cannot accumulate
+            for name in self.names:
+                self._sums[name] = sum(self.columns[name][i] for i in self.slots())
+
+    def latest(self, name):
+        if not self.count:
+            return 0.0
+        return self.columns[name][(self.start + self.count - 1) % self.capacity]
+
+    def mean(self, name):
+        return self._sums[name] / self.count if self.count else 0.0
+
+    def max(self, name):
+        maxima = self._maxima[name]
+        return maxima[0][1] if maxima else 0.0
+
+
+class Rollup(Ring):
+    """Downsampled series: count and mean/min/max of the samples in each bucket"""
+
+    def __init__(self, names, resolution, capacity):
+        columns = ['count'] + [f'{name}:{stat}' for name in names for stat in ('mean', 'min', 'max')]
+        super().__init__(columns, capacity)
+        self.names = names
+        self.resolution = resolution
+        self._bucket = None
+        self._count = 0
+        self._sums = {}
+        self._mins = {}
+        self._maxs = {}
+
+    def add(self, timestamp, values):
+        bucket = timestamp - timestamp % self.resolution
+        if bucket != self._bucket:
+            self._commit()
+            self._bucket = bucket
+        self._count += 1
+        for name in self.names:
+            value = values[name]
+            self._sums[name] = self._sums.get(name, 0.0) + value
+            self._mins[name] = min(self._mins.get(name, value), value)
+            self._maxs[name] = max(self._maxs.get(name, value), value)
+
+    def _commit(self):
+        if not self._count:
+            return
+        self.push(self._bucket, self._row())
+        self._count = 0
+        self._sums, self._mins, self._maxs = {}, {}, {}
+
+    def _row(self):
+        row = {'count': self._count}
+        for name in self.names:
+            row[f'{name}:mean'] = self._sums[name] / self._count
+            row[f'{name}:min'] = self._mins[name]
+            row[f'{name}:max'] = self._maxs[name]
+        return row
+
+    def points(self, limit=None):
+        """Buckets oldest first, including the one still filling"""
+        points = [(self.times[i], {column: values[i] for column, values in self.columns.items()})
+                  for i in self.slots(limit)]
+        if self._count:
+            points.append((self._bucket, self._row()))
+        return points[-limit:] if limit else points
+
+
+class MetricHistory:
+    """Raw samples plus rollups for a fixed set of metrics"""
+
+    def __init__(self, names, capacity=2880, rollups=ROLLUPS):
+        self.names = tuple(names)
+        self.samples = SampleRing(self.names, capacity)
+        self.rollups = {resolution: Rollup(self.names, resolution, buckets) for resolution, buckets in rollups}
+
+    def add(self, timestamp, values):
+        self.samples.append(timestamp, values)
+        for rollup in self.rollups.values():
+            rollup.add(timestamp, values)
+
+    def __len__(self):
+        return self.samples.count
+
+    def summary(self, name):
+        """(current, mean, max) of the retained raw samples, O(1)"""
+        return self.samples.latest(name), self.samples.mean(name), self.samples.max(name)
+
+    def points(self, resolution=None, limit=None):
+        """[(timestamp, {metric: value})] raw, or [(timestamp, count, {metric: (mean, min, max)})]
+        for a rollup resolution in seconds"""
+        if resolution is None:
+            columns = self.samples.columns
+            return [(self.samples.times[i], {name: columns[name][i] for name in self.names})
+                    for i in self.samples.slots(limit)]
+        points = []
+        for timestamp, row in self.rollups[resolution].points(limit):
+            stats = {name: (row[f'{name}:mean'], row[f'{name}:min'], row[f'{name}:max']) for name in self.names}
+            points.append((timestamp, int(row['count']), stats))
+        return points
+
+    @property
+    def nbytes(self):
+        return self.samples.nbytes + sum(rollup.nbytes for rollup in self.rollups.values())
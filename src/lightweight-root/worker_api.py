@@ -0,0 +1,444 @@
+#!/usr/bin/env python3
+"""
+Worker API helpers - request validation and response shapes shared by the
+threaded Flask server (app.py) and the asyncio server (async_app.py)
+"""
+import hashlib
+import os
+import time
+import uuid
+from datetime import datetime, timezone
+
+from blob_store import BlobError, is_blob_id, is_file_name
+from compute import run_compute
+from execution_pool import PRIORITIES
+from output_capture import STREAMS
+from prometheus import Counter, Gauge, Histogram, Registry, DURATION_BUCKETS, LATENCY_BUCKETS
+from python_envs import normalize_requirements
+from result_cache import task_fingerprint
+from task_store import TASK_STATUSES
+from version import VERSION
+
+MAX_BATCH_SIZE = int(os.getenv('MAX_BATCH_SIZE', 1000))
+MAX_WAIT_SECONDS = float(os.getenv('TASK_MAX_WAIT', 60))
+DEFAULT_TIMEOUT = float(os.getenv('TASK_DEFAULT_TIMEOUT', 30))
+MAX_TIMEOUT = float(os.getenv('TASK_MAX_TIMEOUT', 600))
+MAX_OUTPUT_READ = 16 * 1024 * 1024
+COALESCE_TASKS = os.getenv('TASK_COALESCE', '0') == '1'  # opt-in: identical code may still differ per run
+TASK_TYPES = ('code', 'sleep', 'compute', 'echo')
+LANGUAGES = {'python': 'python', 'javascript': 'javascript', 'node': 'javascript', 'bash': 'bash', 'shell': 'bash'}
+
+ENDPOINTS = ['/', '/health', '/ping', '/tasks', '/tasks/batch', '/tasks/status', '/tasks/<id>',
+             '/tasks/<id>/stream', '/tasks/<id>/output', '/blobs/<sha256>', '/stats', '/metrics',
+             '/metrics/prometheus', '/logs']
+
+
+class RequestError(ValueError):
+    """Invalid request, with the HTTP status to answer it with"""
+
+    def __init__(self, message, status=400):
+        super().__init__(message)
+        self.status = status
+
+
+def service_info(mode):
+    """Body of GET /"""
+    return {
+        'service': 'lightweight-ai-worker',
+        'status': 'running',
+        'version': VERSION,
+        'server_mode': mode,
+        'features': ['task-scheduling', 'distributed-computing', 'code-execution'],
+        'supported_languages': ['python', 'javascript', 'bash'],
+        'endpoints': ENDPOINTS
+    }
+
+
+def health_info():
+    return {
+        'status': 'healthy',
+        'service': 'lightweight-ai-worker',
+        'version': VERSION
+    }
+
+
+def client_identity(headers, remote_addr):
+    """Fair-share identity of the caller: API key, X-Client-Id header or address"""
+    api_key = headers.get('X-API-Key')
+    if api_key:
+        return 'key:' + hashlib.sha256(api_key.encode()).hexdigest()[:12]
+    return headers.get('X-Client-Id') or remote_addr or 'anonymous'
+
+
+def parse_deadline(value):
+    """Deadline as a Unix timestamp, from a number or an ISO 8601 string (UTC if naive)"""
+    if value is None:
+        return None
+    if isinstance(value, str):
+        try:
+            parsed = datetime.fromisoformat(value)
+        except ValueError:
+            raise RequestError("deadline must be a Unix timestamp or an ISO 8601 time")
+        if parsed.tzinfo is None:
+            parsed = parsed.replace(tzinfo=timezone.utc)
+        value = parsed.timestamp()
+    elif isinstance(value, bool) or not isinstance(value, (int, float)):
+        raise RequestError("deadline must be a Unix timestamp or an ISO 8601 time")
+    if value <= time.time():
+        raise RequestError("deadline has already passed")
+    return float(value)
+
+
+def prepare_task(data, client, result_cache=None, blob_store=None, python_envs=None):
+    """Build a task record from a submission, completing it on a cache hit.
+
+    Raises RequestError for invalid fields.
+    """
+    task_id = str(uuid.uuid4())
+
+    priority = data.get('priority', 'normal')
+    if priority not in PRIORITIES:
+        raise RequestError(f"priority must be one of {list(PRIORITIES)}")
+
+    timeout = data.get('timeout', DEFAULT_TIMEOUT)
+    if isinstance(timeout, bool) or not isinstance(timeout, (int, float)) or not 0 < timeout <= MAX_TIMEOUT:
+        raise RequestError(f"timeout must be a number of seconds in (0, {MAX_TIMEOUT:g}]")
+    deadline = parse_deadline(data.get('deadline'))
+
+    task = {
+        'id': task_id,
+        'type': data.get('type', 'echo'),
+        'payload': data.get('payload', {}),
+        'status': 'pending',
+        'priority': priority,
+        'client': client,
+        'timeout': timeout,
+        'created_at': datetime.utcnow().isoformat()
+    }
+    if deadline is not None:
+        task['deadline'] = deadline
+    if task['type'] == 'code':
+        check_task_files(task['payload'], blob_store)
+        check_requirements(task['payload'], python_envs)
+
+    # Identical code/compute tasks can share one execution (opt-in coalescing) and,
+    # with the opt-in result cache, complete immediately
+    use_cache = bool(data.get('cache')) and result_cache is not None
+    coalesce = bool(data.get('coalesce', COALESCE_TASKS))
+    if use_cache or coalesce:
+        fingerprint = task_fingerprint(task['type'], task['payload'])
+        if fingerprint is not None:
+            task['fingerprint'] = fingerprint
+            if coalesce:
+                task['coalesce'] = True
+            if use_cache:
+                task['cache'] = True
+                cached = result_cache.get(fingerprint)
+                if cached is not None:
+                    task.update(status='completed', result=cached, cached=True,
+                                completed_at=task['created_at'])
+
+    return task
+
+
+def check_task_files(payload, blob_store):
+    """Validate the blobs a code task reads (`files`) and its `artifacts` flag"""
+    files = payload.get('files')
+    if not files and not payload.get('artifacts'):
+        return
+    if blob_store is None:
+        raise RequestError('Blob store is disabled (BLOB_STORE_DIR)')
+    if files is None:
+        return
+    if not isinstance(files, dict):
+        raise RequestError('files must map file names to blob sha256 ids')
+    for name, digest in files.items():
+        if not is_file_name(name):
+            raise RequestError(f'Invalid file name: {name!r}')
+        if blob_store.get(digest) is None:
+            raise RequestError(f'Unknown blob {digest!r}; upload it with PUT /blobs/<sha256> first')
+
+
+def check_requirements(payload, python_envs):
+    """Validate the packages a Python code task needs installed (`requirements`)"""
+    requirements = payload.get('requirements')
+    if not requirements:
+        return
+    if python_envs is None:
+        raise RequestError('Python environments are disabled (PYTHON_ENV_DIR)')
+    if payload.get('language', 'python') != 'python':
+        raise RequestError('requirements are only supported for python code')
+    if normalize_requirements(requirements) is None:
+        raise RequestError('requirements must be a list of package specifiers such as "requests==2.31.0"')
+
+
+def can_follow(task, leader):
+    """Whether `task` may wait for `leader`'s result instead of running itself:
+    the leader must not finish sooner (timeout, deadline) or start later (priority)"""
+    if leader is None or leader['status'] not in ('pending', 'processing'):
+        return False
+    if leader.get('timeout', DEFAULT_TIMEOUT) < task.get('timeout', DEFAULT_TIMEOUT):
+        return False
+    if (leader.get('deadline') or float('inf')) < (task.get('deadline') or float('inf')):
+        return False
+    if leader['status'] == 'pending':
+        return PRIORITIES.index(leader['priority']) <= PRIORITIES.index(task['priority'])
+    return True
+
+
+def batch_specs(data):
+    """Task specs of a POST /tasks/batch body"""
+    specs = data if isinstance(data, list) else (data or {}).get('tasks')
+    if not isinstance(specs, list) or not all(isinstance(spec, dict) for spec in specs):
+        raise RequestError('Expected a list of task objects')
+    if len(specs) > MAX_BATCH_SIZE:
+        raise RequestError(f'Batch too large (max {MAX_BATCH_SIZE} tasks)', 413)
+    return specs
+
+
+def batch_ids(data):
+    """Task ids of a POST /tasks/status body"""
+    ids = data if isinstance(data, list) else (data or {}).get('ids')
+    if not isinstance(ids, list):
+        raise RequestError('Expected a list of task ids')
+    if len(ids) > MAX_BATCH_SIZE:
+        raise RequestError(f'Too many ids (max {MAX_BATCH_SIZE})', 413)
+    return ids
+
+
+def submission_response(task):
+    """What the submitter gets back for one task"""
+    if task.get('cached'):
+        return {
+            'id': task['id'],
+            'status': 'completed',
+            'cached': True,
+            'result': task['result'],
+            'message': 'Result served from cache'
+        }
+    if task.get('coalesced_with'):
+        return {
+            'id': task['id'],
+            'status': 'pending',
+            'coalesced_with': task['coalesced_with'],
+            'message': 'Identical task in flight; sharing its result'
+        }
+    return {
+        'id': task['id'],
+        'status': 'pending',
+        'message': 'Task queued successfully'
+    }
+
+
+def batch_response(new_tasks):
+    return {
+        'ids': [task['id'] for task in new_tasks],
+        'tasks': [submission_response(task) for task in new_tasks],
+        'count': len(new_tasks)
+    }
+
+
+def status_response(ids, records, positions):
+    """Body of POST /tasks/status from loaded records and queue positions"""
+    found = [records[task_id] for task_id in ids if task_id in records]
+    missing = [task_id for task_id in ids if task_id not in records]
+    for task in found:
+        if task['status'] == 'pending':
+            task['queue_position'] = positions.get(task['id'])
+    return {
+        'tasks': found,
+        'missing': missing,
+        'counts': {
+            status: sum(1 for task in found if task['status'] == status)
+            for status in TASK_STATUSES
+        }
+    }
+
+
+def list_query(args):
+    """(status, cursor, since, limit) from GET /tasks query args"""
+    status = args.get('status')
+    if status is not None and status not in TASK_STATUSES:
+        raise RequestError(f'status must be one of {list(TASK_STATUSES)}')
+    limit = min(max(1, _int_arg(args, 'limit', 100)), 1000)
+    cursor = args.get('cursor')
+    cursor = int(cursor) if cursor is not None and cursor.isdigit() else None
+    since = args.get('since')
+    if since is not None:
+        since = int(since) if since.isdigit() else _since_timestamp(since)
+    return status, cursor, since, limit
+
+
+def _since_timestamp(value):
+    """An ISO 8601 `since` in the stores' created_at format (naive UTC with
+    microseconds), so that it compares correctly as a string"""
+    try:
+        parsed = datetime.fromisoformat(value)
+    except ValueError:
+        raise RequestError('since must be a seq or an ISO 8601 time')
+    if parsed.tzinfo is not None:
+        parsed = parsed.astimezone(timezone.utc).replace(tzinfo=None)
+    return parsed.isoformat(timespec='microseconds')
+
+
+def output_query(args):
+    """(stream, offset, length) from GET /tasks/<id>/output query args"""
+    stream = args.get('stream', 'stdout')
+    if stream not in STREAMS:
+        raise RequestError(f'stream must be one of {list(STREAMS)}')
+    offset = _int_arg(args, 'offset', 0)
+    length = _int_arg(args, 'length', 1024 * 1024)
+    return stream, max(0, offset), min(max(0, length), MAX_OUTPUT_READ)
+
+
+def _int_arg(args, name, default):
+    try:
+        return int(args.get(name, default))
+    except ValueError:
+        return default
+
+
+def blob_upload(blob_store, digest, length):
+    """BlobUpload for PUT /blobs/<sha256>, or None if the blob is already stored"""
+    if blob_store is None:
+        raise RequestError('Blob store is disabled (BLOB_STORE_DIR)', 404)
+    if not is_blob_id(digest):
+        raise RequestError('Blob id must be a lowercase hex sha256')
+    if length is not None and length > blob_store.max_blob_bytes:
+        raise RequestError(f'Blob too large (max {blob_store.max_blob_bytes} bytes)', 413)
+    try:
+        return blob_store.upload(digest)
+    except BlobError as e:
+        raise RequestError(str(e), e.status)
+
+
+def blob_info(blob_store, digest, created=False):
+    """Body of a PUT /blobs/<sha256> response"""
+    return {'sha256': digest, 'size': os.path.getsize(blob_store.path(digest)), 'created': created}
+
+
+def blob_path(blob_store, digest):
+    """Path of a stored blob for GET /blobs/<sha256>"""
+    path = blob_store.get(digest) if blob_store is not None else None
+    if path is None:
+        raise RequestError('Blob not found', 404)
+    return path
+
+
+def byte_range(header, size):
+    """(start, end) to serve for a Range header, end exclusive; None for the whole
+    file. Only single ranges are honoured."""
+    if not header or not header.startswith('bytes=') or ',' in header:
+        return None
+    first, _, last = header[6:].strip().partition('-')
+    try:
+        if not first:
+            start, end = max(0, size - int(last)), size
+        else:
+            start, end = int(first), min(size, int(last) + 1) if last else size
+    except ValueError:
+        return None
+    if start >= size or start >= end:
+        raise RequestError('Requested range not satisfiable', 416)
+    return start, end
+
+
+def task_counters(counts):
+    """Task counters of GET /stats from a task store's status_counts()"""
+    entered, current = counts['entered'], counts['current']
+    return {
+        'tasks_completed': entered['completed'],
+        'tasks_failed': entered['failed'],
+        'tasks_cancelled': entered['cancelled'],
+        'tasks_expired': entered['expired'],
+        'tasks_pending': current['pending'] + current['processing'],
+        'tasks_running': current['processing']
+    }
+
+
+class WorkerMetrics:
+    """Prometheus metrics of a worker: task latency histograms and queue gauges"""
+
+    def __init__(self, tasks, task_queue, running):
+        self.registry = Registry()
+        register = self.registry.register
+        self.queue_wait = register(Histogram(
+            'worker_task_queue_wait_seconds', 'Time from submission until a task starts running',
+            ('type',), DURATION_BUCKETS))
+        self.execution = register(Histogram(
+            'worker_task_execution_seconds', 'Time a task spent running',
+            ('type', 'language', 'status'), DURATION_BUCKETS))
+        self.http = register(Histogram(
+            'worker_http_request_duration_seconds', 'Time to handle an HTTP request (until the response starts)',
+            ('method', 'route', 'status'), LATENCY_BUCKETS))
+        register(Gauge(
+            'worker_queue_depth', 'Tasks waiting in the queue', ('priority',),
+            lambda: task_queue.get_stats()['by_priority']))
+        register(Gauge(
+            'worker_tasks_running', 'Tasks currently running in this process', collect=running))
+        register(Gauge(
+            'worker_tasks_active', 'Tasks pending or processing', ('status',),
+            lambda: active_counts(tasks.status_counts())))
+        register(Counter(
+            'worker_tasks_total', 'Tasks that reached each status', ('status',),
+            lambda: tasks.status_counts()['entered']))
+
+    def task_started(self, task, started_at):
+        """Observe the queue wait of a task starting at `started_at` (naive UTC datetime)"""
+        try:
+            waited = (started_at - datetime.fromisoformat(task['created_at'])).total_seconds()
+        except (KeyError, TypeError, ValueError):
+            return
+        self.queue_wait.observe(max(0.0, waited), task_label(task))
+
+    def task_finished(self, task, status, seconds):
+        self.execution.observe(seconds, task_label(task), language_label(task), status)
+
+    def request_handled(self, method, route, status, seconds):
+        self.http.observe(seconds, method, route or 'unmatched', str(status))
+
+    def exposition(self, accept=None):
+        return self.registry.exposition(accept)
+
+
+def active_counts(counts):
+    current = counts['current']
+    return {status: current[status] for status in ('pending', 'processing')}
+
+
+def task_label(task):
+    """Task type as a metric label; unknown types share one label"""
+    task_type = task.get('type', 'default')
+    return task_type if task_type in TASK_TYPES else 'other'
+
+
+def language_label(task):
+    if task.get('type') != 'code':
+        return ''
+    payload = task.get('payload')
+    language = payload.get('language', 'python') if isinstance(payload, dict) else None
+    return LANGUAGES.get(language, 'other') if isinstance(language, str) else 'other'
+
+
+def run_builtin_task(task_type, payload, timeout=None):
+    """Execute the tasks that need no subprocess: compute and echo"""
+    if task_type == 'compute':
+        return run_compute(payload, deadline=time.monotonic() + timeout if timeout is not None else None)
+
+    elif task_type == 'echo':
+        return {'echo': payload.get('message', 'hello')}
+
+    return {'result': 'unknown task type'}
+
+
+def sleep_timeout(duration, timeout):
+    """Error for a sleep task asking for longer than it may run"""
+    return TimeoutError(f"sleep of {duration} seconds exceeds the task's {timeout:.3g} second timeout")
+
+
+def task_time_left(task):
+    """Seconds the task may run: its timeout, cut short by its deadline"""
+    timeout = task.get('timeout', DEFAULT_TIMEOUT)
+    if task.get('deadline') is not None:
+        timeout = min(timeout, task['deadline'] - time.time())
+    return timeout
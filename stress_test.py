@@ -109,6 +109,57 @@ def stress_test(num_tasks=100, workers=2):
     
     return results
 
+def batch_stress_test(num_tasks=500, workers=2, batch_size=100):
+    """Submit the same load through POST /tasks/batch"""
+    print(f"📦 Starting batch test: {num_tasks} tasks in batches of {batch_size}")
+    print("=" * 60)
+    
+    workers_list = [RAILWAY_URL, KOYEB_URL][:workers]
+    
+    start_time = time.time()
+    submitted = 0
+    requests_made = 0
+    ids = {worker_url: [] for worker_url in workers_list}
+    
+    for start in range(0, num_tasks, batch_size):
+        worker = workers_list[(start // batch_size) % len(workers_list)]
+        specs = []
+        for i in range(start, min(start + batch_size, num_tasks)):
+            if i % 2 == 0:
+                specs.append({'type': 'compute', 'payload': {
+                    'operation': ['factorial', 'multiply', 'add'][i % 3],
+                    'number': 10 + (i % 10),
+                    'numbers': [i, i+1, i+2]
+                }})
+            else:
+                specs.append({'type': 'echo', 'payload': {'message': f'Task {i}'}})
+        
+        try:
+            response = requests.post(f"{worker}/tasks/batch", json={'tasks': specs}, timeout=30)
+            requests_made += 1
+            if response.status_code == 201:
+                batch_ids = response.json()['ids']
+                ids[worker].extend(batch_ids)
+                submitted += len(batch_ids)
+        except Exception as e:
+            print(f"Batch to {worker} failed: {e}")
+    
+    total_time = time.time() - start_time
+    
+    print(f"Submitted: {submitted}/{num_tasks} in {requests_made} requests")
+    print(f"Total time: {total_time:.2f}s")
+    print(f"Tasks/second: {submitted/total_time:.2f}")
+    
+    # One status lookup per worker instead of one per task
+    for worker_url, worker_ids in ids.items():
+        if not worker_ids:
+            continue
+        response = requests.post(f"{worker_url}/tasks/status", json={'ids': worker_ids}, timeout=30)
+        if response.status_code == 200:
+            print(f"{worker_url.split('//')[1].split('.')[0]}: {response.json()['counts']}")
+    
+    return ids
+
 if __name__ == '__main__':
     # Test 1: 100 tasks
     print("\n🧪 TEST 1: 100 concurrent tasks\n")
@@ -120,4 +171,10 @@ if __name__ == '__main__':
     print("\n\n🧪 TEST 2: 500 concurrent tasks\n")
     results_500 = stress_test(500, 2)
     
+    time.sleep(5)
+    
+    # Test 3: 500 tasks through the batch endpoint
+    print("\n\n🧪 TEST 3: 500 tasks via /tasks/batch\n")
+    batch_ids = batch_stress_test(500, 2)
+    
     print("\n✅ All stress tests completed!")
@@ -8,6 +8,7 @@ import json
 
 RAILWAY_URL = "https://lightweight-distributed-ai-production.up.railway.app"
 KOYEB_URL = "https://naughty-carina-risker666-8ce36d54.koyeb.app"
+FINISHED_STATUSES = ('completed', 'failed', 'cancelled', 'expired')
 
 def submit_task(worker_url, code, language="python"):
     """Submit a task to worker"""
@@ -27,11 +28,17 @@ def get_task_result(worker_url, task_id, max_wait=30):
     """Wait for task completion and get result"""
     start = time.time()
     while time.time() - start < max_wait:
-        response = requests.get(f"{worker_url}/tasks/{task_id}")
+        wait = max(0.1, max_wait - (time.time() - start))
+        poll_start = time.time()
+        response = requests.get(f"{worker_url}/tasks/{task_id}", params={'wait': wait}, timeout=wait + 10)
         data = response.json()
         if data['status'] == 'completed':
             return data
-        time.sleep(1)
+        if data['status'] in FINISHED_STATUSES:
+            return None
+        if time.time() - poll_start < wait / 2:
+            # Worker without `wait` support answered at once: poll instead
+            time.sleep(1)
     return None
 
 def test_cpu_intensive():